@@ -0,0 +1,91 @@
+"""
+Benchmark for token-aware chunking
+
+Times the character chunker plus the per-chunk re-encode that embedding
+truncation used to do, against TokenChunker's single tokenization pass, and
+streams a large transcript file through chunk_stream to check that time
+grows linearly with size. Run from the data-processing directory:
+
+    python -m benchmarks.chunking --sizes 1 4 16 --stream-mb 100
+"""
+
+import argparse
+import json
+import resource
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.clean_text import synthetic_transcript
+from services.chunker import read_text_blocks
+from services.text_processor import TextProcessor
+
+
+def run(sizes_mb: List[float], stream_mb: float) -> Dict[str, Dict[str, Any]]:
+    processor = TextProcessor()
+    chunker = processor.chunker
+    encoding = chunker.encoding
+    results = {}
+    for size_mb in sizes_mb:
+        text = synthetic_transcript(int(size_mb * 1024 * 1024))
+
+        start = time.perf_counter()
+        chunks = processor.chunk_text(text, chunk_size=2000, overlap=250)
+        for chunk in chunks:
+            encoding.encode(chunk)
+        legacy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        token_chunks = chunker.chunk(text)
+        current = time.perf_counter() - start
+
+        results[f"chunk_{size_mb}mb"] = {
+            'legacy_s': legacy,
+            'current_s': current,
+            'current_mb_s': size_mb / current,
+            'chunks': len(token_chunks),
+            'max_chunk_tokens': max(chunk.n_tokens for chunk in token_chunks),
+        }
+
+    if stream_mb:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'transcript.txt'
+            block = synthetic_transcript(4 * 1024 * 1024)
+            with open(path, 'w', encoding='utf-8') as f:
+                for _ in range(max(1, int(stream_mb / 4))):
+                    f.write(block)
+            size_mb = path.stat().st_size / (1024 * 1024)
+
+            start = time.perf_counter()
+            count = sum(1 for _ in chunker.chunk_stream(read_text_blocks(str(path))))
+            elapsed = time.perf_counter() - start
+            results[f"stream_{round(size_mb)}mb"] = {
+                'current_s': elapsed,
+                'current_mb_s': size_mb / elapsed,
+                'chunks': count,
+                'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16], help='Transcript sizes in MB')
+    parser.add_argument('--stream-mb', type=float, default=100, help='Size of the streamed file, 0 to skip')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.stream_mb)
+    for name, row in results.items():
+        legacy = f"legacy {row['legacy_s']:7.2f} s  " if 'legacy_s' in row else ''
+        print(f"{name:<16} {legacy}current {row['current_s']:7.2f} s "
+              f"({row['current_mb_s']:6.1f} MB/s)  chunks {row['chunks']}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
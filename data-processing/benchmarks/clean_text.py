@@ -0,0 +1,139 @@
+"""
+Micro-benchmark for TextProcessor.clean_text / clean_texts
+
+Compares the current cleaner against the previous two-pass implementation
+on synthetic transcripts of 1 MB and up, checks that both produce identical
+output, and reports throughput. The batch rows time ``clean_texts`` on a
+list, a pandas Series and a pyarrow array (whichever are installed) against
+the legacy per-document loop. Run from the data-processing directory:
+
+    python -m benchmarks.clean_text --sizes 1 4 16
+"""
+
+import argparse
+import json
+import random
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from services.text_processor import TextProcessor
+
+WORDS = [
+    'interviewer', 'participant', 'loan', 'emi', 'app', 'upi', 'salary', 'credit', 'score',
+    'onboarding', 'kyc', 'aadhaar', 'pan', 'rupees', 'confusing', 'screen', 'button', 'trust',
+    'honestly', 'actually', 'basically', 'bank', 'payment', 'reminder', 'notification', 'café',
+]
+NOISE = ['₹', '@', '#', '&', '*', '%', '"', "'", '/', '…', '😊', '<br>', '\t', '\n\n', '  ']
+PUNCTUATION = ['.', ',', '?', '!', ';', ':', '-', '(', ')']
+
+
+def legacy_clean_text(text: str) -> str:
+    """The two-pass cleaner clean_text replaced, kept as the baseline"""
+    if not text:
+        return ""
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'[^\w\s\.\,\!\?\;\:\-\(\)]', '', text)
+    text = ' '.join(text.split())
+    return text.strip()
+
+
+def synthetic_transcript(size_bytes: int, seed: int = 0) -> str:
+    """Interview-transcript-like text with speaker tags, symbols and odd whitespace"""
+    rng = random.Random(seed)
+    parts: List[str] = []
+    length = 0
+    while length < size_bytes:
+        speaker = rng.choice(['Interviewer', 'Participant'])
+        words = [rng.choice(WORDS) for _ in range(rng.randint(5, 30))]
+        for i in range(len(words)):
+            roll = rng.random()
+            if roll < 0.08:
+                words[i] += rng.choice(NOISE)
+            elif roll < 0.2:
+                words[i] += rng.choice(PUNCTUATION)
+        line = f"{speaker}: {' '.join(words)}\n"
+        parts.append(line)
+        length += len(line)
+    return ''.join(parts)
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run(sizes_mb: List[float], repeat: int) -> Dict[str, Dict[str, float]]:
+    processor = TextProcessor()
+    results = {}
+    for size_mb in sizes_mb:
+        text = synthetic_transcript(int(size_mb * 1024 * 1024))
+        if processor.clean_text(text) != legacy_clean_text(text):
+            raise AssertionError(f"clean_text output differs from the legacy cleaner at {size_mb} MB")
+
+        legacy = best_of(lambda: legacy_clean_text(text), repeat)
+        current = best_of(lambda: processor.clean_text(text), repeat)
+        results[f"single_{size_mb}mb"] = {
+            'legacy_mb_s': size_mb / legacy,
+            'current_mb_s': size_mb / current,
+            'speedup': legacy / current,
+        }
+
+    # Many transcript-sized documents through the batch API
+    docs = [synthetic_transcript(4096, seed=i) + ' café ²\u3000naïve' for i in range(2000)]
+    total_mb = sum(len(doc) for doc in docs) / (1024 * 1024)
+    expected = [processor.clean_text(doc) for doc in docs]
+    legacy = best_of(lambda: [legacy_clean_text(doc) for doc in docs], repeat)
+    for name, container in batch_containers(docs).items():
+        cleaned = processor.clean_texts(container)
+        if list(cleaned.to_pylist() if hasattr(cleaned, 'to_pylist') else cleaned) != expected:
+            raise AssertionError(f"clean_texts output on a {name} differs from clean_text")
+        current = best_of(lambda: processor.clean_texts(container), repeat)
+        results[f"batch_2000x4kb_{name}"] = {
+            'legacy_mb_s': total_mb / legacy,
+            'current_mb_s': total_mb / current,
+            'speedup': legacy / current,
+        }
+    return results
+
+
+def batch_containers(docs: List[str]) -> Dict[str, object]:
+    """The documents as each container clean_texts accepts"""
+    containers = {'list': docs}
+    try:
+        import pandas
+        containers['series'] = pandas.Series(docs)
+    except ImportError:
+        pass
+    try:
+        import pyarrow
+        containers['arrow'] = pyarrow.array(docs)
+    except ImportError:
+        pass
+    return containers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=float, nargs='+', default=[1, 4, 16], help='Transcript sizes in MB')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.repeat)
+    for name, row in results.items():
+        print(f"{name:<22} legacy {row['legacy_mb_s']:8.1f} MB/s  "
+              f"current {row['current_mb_s']:8.1f} MB/s  speedup {row['speedup']:5.2f}x")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
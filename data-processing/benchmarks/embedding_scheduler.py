@@ -0,0 +1,111 @@
+"""
+Benchmark for the embedding request scheduler against the local mock server
+
+Scenarios:
+  coalesce   many concurrent generate_embedding calls
+  batch      one large generate_embeddings_batch split by input and token limits
+  unpaced    the batch scenario against a rate-limited server that also fails
+             randomly, with client-side rate limiting off (429s and retries)
+  paced      the same server with the client's RPM bucket at half its limit
+
+Reports wall time, requests actually sent and the scheduler's retry
+counters. Every text must come back with its own deterministic vector.
+Run from the data-processing directory:
+
+    python -m benchmarks.embedding_scheduler --texts 5000
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.mock_embedding_server import MockEmbeddingServer
+from config.settings import settings
+
+
+def make_texts(count: int) -> List[str]:
+    return [f"Participant {i % 97} said the loan app reminder number {i} was confusing." for i in range(count)]
+
+
+def check(server: MockEmbeddingServer, texts: List[str], embeddings: np.ndarray):
+    for i in range(0, len(texts), max(1, len(texts) // 50)):
+        if not np.allclose(embeddings[i], server.embed(texts[i]), atol=1e-6):
+            raise AssertionError(f"Embedding {i} does not match its text")
+
+
+async def run_scenario(name: str, server: MockEmbeddingServer, texts: List[str],
+                       client_rpm: int) -> Dict[str, Any]:
+    from services.embedding_service import EmbeddingService
+    settings.embedding_rpm_limit = client_rpm
+    service = EmbeddingService()
+
+    start = time.perf_counter()
+    if name == 'coalesce':
+        embeddings = np.stack(await asyncio.gather(*(service.generate_embedding(text) for text in texts)))
+    else:
+        embeddings = await service.generate_embeddings_batch(texts)
+    elapsed = time.perf_counter() - start
+
+    check(server, texts, embeddings)
+    return {
+        'seconds': elapsed,
+        'texts_per_s': len(texts) / elapsed,
+        'server': dict(server.stats),
+        'scheduler': service.get_request_stats(),
+    }
+
+
+def run(count: int, latency_ms: float) -> Dict[str, Dict[str, Any]]:
+    # Measure the scheduler, not the cache
+    settings.embedding_cache_enabled = False
+    settings.openai_api_key = settings.openai_api_key or 'mock'
+    settings.embedding_max_batch_inputs = 64
+    settings.retry_backoff_base_seconds = 0.05
+    settings.retry_attempts = 10
+
+    texts = make_texts(count)
+    # The limited server allows 10 requests per second
+    limited = {'rpm': 10, 'window_seconds': 1.0, 'error_rate': 0.05}
+    scenarios = {
+        'coalesce': ({}, 0),
+        'batch': ({}, 0),
+        'unpaced': (limited, 0),
+        'paced': (limited, 300),
+    }
+    results = {}
+    for name, (options, client_rpm) in scenarios.items():
+        server = MockEmbeddingServer(dimension=settings.embedding_dimension, latency_ms=latency_ms,
+                                     max_inputs=settings.embedding_max_batch_inputs, **options).start()
+        settings.openai_base_url = server.base_url
+        try:
+            results[name] = asyncio.run(run_scenario(name, server, texts, client_rpm))
+        finally:
+            server.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--texts', type=int, default=5000)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.texts, args.latency_ms)
+    for name, row in results.items():
+        print(f"{name:<10} {row['seconds']:7.2f} s  {row['texts_per_s']:9.1f} texts/s  "
+              f"requests {row['server']['accepted']:5d}  429s {row['server']['rate_limited']:3d}  "
+              f"500s {row['server']['errors']:3d}  retries {row['scheduler']['retries']:3d}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
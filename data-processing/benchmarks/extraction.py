@@ -0,0 +1,154 @@
+"""
+Throughput benchmark for HTML, PDF and DOCX text extraction
+
+Builds synthetic documents of each format from transcript text (HTML with
+scripts, styles and nested markup, a multi-page PDF with one text stream
+per page, a DOCX with one paragraph per line), extracts them with
+services.document_extractor and reports MB/s and extracted characters per
+second. HTML is also run through BeautifulSoup, the previous extractor,
+when bs4 is installed. Run from the data-processing directory:
+
+    python -m benchmarks.extraction --size-mb 8 --formats html pdf docx
+"""
+
+import argparse
+import html
+import io
+import json
+import time
+import zipfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.clean_text import synthetic_transcript
+from services import document_extractor
+
+LINES_PER_PAGE = 45
+
+
+def make_html(lines: List[str]) -> bytes:
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Transcript</title>',
+             '<style>p { margin: 0 } .speaker { font-weight: bold }</style></head><body>']
+    for i, line in enumerate(lines):
+        speaker, _, said = line.partition(': ')
+        parts.append(f'<div class="turn" data-i="{i}"><p><span class="speaker">{html.escape(speaker)}</span>: '
+                     f'{html.escape(said)}</p></div>')
+        if i % 50 == 0:
+            parts.append(f'<script>window.analytics && analytics.track("turn", {i});</script>')
+    parts.append('</body></html>')
+    return ''.join(parts).encode('utf-8')
+
+
+def make_pdf(lines: List[str]) -> bytes:
+    """Minimal PDF with a Helvetica text stream per page"""
+    pages = [lines[i:i + LINES_PER_PAGE] for i in range(0, len(lines), LINES_PER_PAGE)]
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None,
+               b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>']
+    kids = []
+    for page in pages:
+        text = ['BT /F1 9 Tf 11 TL 36 806 Td']
+        for line in page:
+            escaped = line.encode('cp1252', 'replace').replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+            text.append('(' + escaped.decode('latin-1') + ") '")
+        text.append('ET')
+        stream = '\n'.join(text).encode('latin-1')
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append(b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                       b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % (len(objects)))
+        kids.append(b'%d 0 R' % len(objects))
+    objects[1] = b'<< /Type /Pages /Kids [' + b' '.join(kids) + b'] /Count %d >>' % len(kids)
+
+    out = io.BytesIO()
+    out.write(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(out.tell())
+        out.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+    xref = out.tell()
+    out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1))
+    out.write(b''.join(b'%010d 00000 n \n' % offset for offset in offsets))
+    out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+def make_docx(lines: List[str]) -> bytes:
+    namespace = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+    body = ''.join(
+        f'<w:p><w:r><w:rPr><w:b/></w:rPr><w:t>{html.escape(speaker)}:</w:t></w:r>'
+        f'<w:r><w:t xml:space="preserve"> {html.escape(said)}</w:t></w:r></w:p>'
+        for speaker, _, said in (line.partition(': ') for line in lines)
+    )
+    document = f'<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="{namespace}"><w:body>{body}</w:body></w:document>'
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml',
+                         '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/'
+                         'package/2006/content-types"><Override PartName="/word/document.xml" ContentType="'
+                         'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>')
+        archive.writestr('word/document.xml', document)
+    return out.getvalue()
+
+
+BUILDERS = {'html': make_html, 'pdf': make_pdf, 'docx': make_docx}
+
+
+def bs4_html(data: bytes) -> str:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(data.decode('utf-8'), 'html.parser')
+    for script in soup(["script", "style"]):
+        script.decompose()
+    return soup.get_text()
+
+
+def time_best(fn: Callable[[], str], repeat: int) -> Dict[str, Any]:
+    best, text = float('inf'), ''
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = fn()
+        best = min(best, time.perf_counter() - start)
+    return {'seconds': best, 'chars': len(text)}
+
+
+def run(size_mb: float, formats: List[str], repeat: int) -> Dict[str, Any]:
+    lines = synthetic_transcript(int(size_mb * (1 << 20)), seed=0).splitlines()
+    results = {}
+    for name in formats:
+        data = BUILDERS[name](lines)
+        timing = time_best(lambda: document_extractor.extract_text(data, name), repeat)
+        results[name] = {
+            'input_mb': len(data) / (1 << 20),
+            'mb_per_s': len(data) / (1 << 20) / timing['seconds'],
+            'chars_per_s': timing['chars'] / timing['seconds'],
+            **timing,
+        }
+        if name == 'html':
+            try:
+                baseline = time_best(lambda: bs4_html(data), repeat)
+                results['html_bs4'] = {'input_mb': results[name]['input_mb'],
+                                       'mb_per_s': len(data) / (1 << 20) / baseline['seconds'],
+                                       'chars_per_s': baseline['chars'] / baseline['seconds'], **baseline}
+            except ImportError:
+                pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=float, default=4, help='Transcript text per document, in MB')
+    parser.add_argument('--formats', nargs='+', choices=list(BUILDERS), default=list(BUILDERS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.size_mb, args.formats, args.repeat)
+    for name, row in results.items():
+        print(f"{name:<10} {row['input_mb']:8.2f} MB  {row['mb_per_s']:8.2f} MB/s  "
+              f"{row['chars_per_s'] / 1e6:8.2f} M chars/s  ({row['seconds']:.3f}s)")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Benchmark for the BM25 lexical index
+
+Indexes synthetic transcript-like documents and reports indexing rate,
+posting-list size (delta + varint encoded, against 8 bytes per posting for
+plain int32 pairs) and query latency. Run from the data-processing
+directory:
+
+    python -m benchmarks.lexical_search --documents 100000 --analyzer simple
+"""
+
+import argparse
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+
+from benchmarks.clean_text import WORDS
+from services.lexical_index import BM25Index
+
+
+def run(count: int, analyzer: str, n_queries: int, top_k: int) -> Dict[str, Any]:
+    rng = random.Random(0)
+    # Zipf-like term frequencies, plus rare "names" that exact-term queries look for
+    vocabulary = WORDS + [f"name{i}" for i in range(5000)]
+    weights = [1.0 / (rank + 1) for rank in range(len(vocabulary))]
+    texts = [' '.join(rng.choices(vocabulary, weights, k=rng.randint(20, 200))) for _ in range(count)]
+    ids = [str(i) for i in range(count)]
+
+    if analyzer == 'nltk':
+        from services.text_processor import TextProcessor
+        index = BM25Index(TextProcessor().preprocess_text)
+    else:
+        index = BM25Index(lambda text: text.lower().split())
+
+    start = time.perf_counter()
+    for offset in range(0, count, 1000):
+        index.add_many(ids[offset:offset + 1000], texts[offset:offset + 1000])
+    build_s = time.perf_counter() - start
+
+    postings = sum(p.count for p in index._postings.values())
+    encoded = sum(len(p.data) for p in index._postings.values())
+
+    queries = [' '.join(rng.choices(vocabulary, k=rng.randint(1, 3))) for _ in range(n_queries)]
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, top_k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'documents': count,
+        'terms': index.vocabulary_size,
+        'postings': postings,
+        'documents_per_s': count / build_s,
+        'posting_bytes': encoded,
+        'bytes_per_posting': encoded / postings,
+        'uncompressed_bytes': postings * 8,
+        'mean_query_ms': float(np.mean(latencies)),
+        'p95_query_ms': float(np.percentile(latencies, 95)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=100000)
+    parser.add_argument('--analyzer', choices=['simple', 'nltk'], default='simple',
+                        help='simple splits on whitespace; nltk uses TextProcessor.preprocess_text')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.documents, args.analyzer, args.queries, args.top_k)
+    for key, value in results.items():
+        print(f"{key:<20} {value:,.2f}" if isinstance(value, float) else f"{key:<20} {value:,}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Throughput benchmark for the local embedding provider
+
+For each quantization mode, reports texts/sec for:
+  single     one text per encode call, as the old fallback path did
+  batch      embed_many over the whole corpus (length-sorted batches)
+  dynamic    every text submitted concurrently through embed()
+
+Also reports how far each mode's vectors drift from the unquantized model
+(mean cosine similarity). Run from the data-processing directory:
+
+    python -m benchmarks.local_embedding --texts 2000 --modes none int8 onnx onnx-int8
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from benchmarks.clean_text import WORDS
+from services.local_embedding import LocalEmbeddingProvider
+
+
+def make_texts(count: int, seed: int = 0) -> List[str]:
+    """Transcript-like sentences with a wide spread of lengths"""
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.choice([4, 8, 16, 32, 64, 128])))
+            for _ in range(count)]
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run(modes: List[str], count: int, single_count: int) -> Dict[str, Dict[str, Any]]:
+    texts = make_texts(count)
+    results = {}
+    reference = None
+    for mode in modes:
+        provider = LocalEmbeddingProvider(quantization=mode)
+        load = timed(provider.warmup)
+
+        sample = texts[:single_count]
+        single = timed(lambda: [provider.encode([text]) for text in sample])
+
+        vectors = None
+
+        def batch():
+            nonlocal vectors
+            vectors = asyncio.run(provider.embed_many(texts))
+        batch_s = timed(batch)
+
+        async def dynamic():
+            return await asyncio.gather(*(provider.embed(text) for text in texts))
+        provider.stats.update(batches=0, texts=0, max_batch=0)
+        dynamic_s = timed(lambda: asyncio.run(dynamic()))
+        dynamic_stats = provider.get_stats()
+
+        if reference is None:
+            reference = vectors
+        width = min(reference.shape[1], vectors.shape[1])
+        agreement = float(np.mean(np.sum(reference[:, :width] * vectors[:, :width], axis=1)))
+
+        results[mode] = {
+            'load_s': load,
+            'single_texts_per_s': len(sample) / single,
+            'batch_texts_per_s': len(texts) / batch_s,
+            'dynamic_texts_per_s': len(texts) / dynamic_s,
+            'dynamic_mean_batch': dynamic_stats['texts'] / max(1, dynamic_stats['batches']),
+            'cosine_vs_first_mode': agreement,
+            'dimension': int(vectors.shape[1]),
+        }
+        provider.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--single', type=int, default=200, help='Texts for the one-at-a-time baseline')
+    parser.add_argument('--modes', nargs='+', default=['none', 'int8'],
+                        choices=['none', 'int8', 'onnx', 'onnx-int8'])
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.modes, args.texts, args.single)
+    for mode, row in results.items():
+        print(f"{mode:<10} single {row['single_texts_per_s']:8.1f}/s  batch {row['batch_texts_per_s']:8.1f}/s  "
+              f"dynamic {row['dynamic_texts_per_s']:8.1f}/s (mean batch {row['dynamic_mean_batch']:.1f})  "
+              f"cosine {row['cosine_vs_first_mode']:.4f}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
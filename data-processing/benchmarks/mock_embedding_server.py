@@ -0,0 +1,197 @@
+"""
+Local mock of the OpenAI embeddings endpoint
+
+Serves POST /v1/embeddings with deterministic unit vectors (the same text
+always gets the same vector). Enforces per-request input and token limits,
+and request and token limits per window (a minute by default) with 429 +
+Retry-After; can add latency and random 500s. GET /stats returns what it
+has seen. Point the service at it with OPENAI_BASE_URL:
+
+    python -m benchmarks.mock_embedding_server --port 8089 --rpm 600 --error-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=mock python main.py
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+
+import numpy as np
+
+
+class MockEmbeddingServer:
+    """OpenAI-compatible embeddings server running in a background thread"""
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, dimension: int = 3072,
+                 latency_ms: float = 20.0, error_rate: float = 0.0, rpm: int = 0, tpm: int = 0,
+                 max_inputs: int = 2048, max_request_tokens: int = 300000, window_seconds: float = 60.0,
+                 seed: int = 0):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_inputs = max_inputs
+        self.max_request_tokens = max_request_tokens
+        self.window_seconds = window_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        # (timestamp, tokens) of accepted requests in the current window
+        self._window = deque()
+        self.stats: Dict[str, Any] = {
+            'requests': 0, 'accepted': 0, 'inputs': 0, 'tokens': 0,
+            'rate_limited': 0, 'errors': 0, 'rejected': 0, 'max_batch_inputs': 0,
+        }
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockEmbeddingServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        """Rough token count; close enough for rate limiting"""
+        return len(text) // 4 + 1
+
+    def embed(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def _admit(self, tokens: int):
+        """Return (status, retry_after) for a request of ``tokens`` tokens"""
+        with self._lock:
+            self.stats['requests'] += 1
+            if self.error_rate and self._random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                return 500, None
+
+            now = time.monotonic()
+            while self._window and now - self._window[0][0] >= self.window_seconds:
+                self._window.popleft()
+            used_tokens = sum(n for _, n in self._window)
+            if (self.rpm and len(self._window) >= self.rpm) or (self.tpm and used_tokens + tokens > self.tpm):
+                self.stats['rate_limited'] += 1
+                retry_after = self.window_seconds - (now - self._window[0][0]) if self._window else 1.0
+                return 429, max(0.05, retry_after)
+
+            self._window.append((now, tokens))
+            return 200, None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+                payload = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/stats'):
+                    with server._lock:
+                        self._reply(200, dict(server.stats))
+                else:
+                    self._reply(404, {'error': {'message': 'not found'}})
+
+            def do_POST(self):
+                if not self.path.rstrip('/').endswith('/embeddings'):
+                    self._reply(404, {'error': {'message': 'not found'}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                inputs = request.get('input', [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                tokens = sum(server.count_tokens(text) for text in inputs)
+
+                if len(inputs) > server.max_inputs or tokens > server.max_request_tokens:
+                    with server._lock:
+                        server.stats['rejected'] += 1
+                    self._reply(400, {'error': {'message': 'request exceeds input or token limit'}})
+                    return
+
+                status, retry_after = server._admit(tokens)
+                if server.latency_ms:
+                    time.sleep(server.latency_ms / 1000)
+                if status == 429:
+                    self._reply(429, {'error': {'message': 'rate limit reached', 'type': 'requests'}},
+                                {'retry-after': f"{retry_after:.2f}",
+                                 'retry-after-ms': str(int(retry_after * 1000))})
+                    return
+                if status != 200:
+                    self._reply(status, {'error': {'message': 'mock server error'}})
+                    return
+
+                base64_output = request.get('encoding_format') == 'base64'
+                data = []
+                for index, text in enumerate(inputs):
+                    vector = server.embed(text)
+                    embedding = base64.b64encode(vector.tobytes()).decode('ascii') if base64_output else vector.tolist()
+                    data.append({'object': 'embedding', 'index': index, 'embedding': embedding})
+                with server._lock:
+                    server.stats['accepted'] += 1
+                    server.stats['inputs'] += len(inputs)
+                    server.stats['tokens'] += tokens
+                    server.stats['max_batch_inputs'] = max(server.stats['max_batch_inputs'], len(inputs))
+                self._reply(200, {
+                    'object': 'list',
+                    'data': data,
+                    'model': request.get('model', 'mock'),
+                    'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+                })
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--dimension', type=int, default=3072)
+    parser.add_argument('--latency-ms', type=float, default=20.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with 500')
+    parser.add_argument('--rpm', type=int, default=0, help='Requests per window, 0 for unlimited')
+    parser.add_argument('--tpm', type=int, default=0, help='Tokens per window, 0 for unlimited')
+    parser.add_argument('--window-seconds', type=float, default=60.0)
+    parser.add_argument('--max-inputs', type=int, default=2048)
+    parser.add_argument('--max-request-tokens', type=int, default=300000)
+    args = parser.parse_args()
+
+    server = MockEmbeddingServer(args.host, args.port, args.dimension, args.latency_ms, args.error_rate,
+                                 args.rpm, args.tpm, args.max_inputs, args.max_request_tokens,
+                                 args.window_seconds)
+    print(f"Mock embedding server on {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
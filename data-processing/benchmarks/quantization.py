@@ -0,0 +1,120 @@
+"""
+Memory / recall trade-offs of quantized embedding indexes
+
+Builds an EmbeddingStore of synthetic embeddings and, for every format and
+code dimension, reports bytes per vector, recall@k against exact float32
+search with and without full-precision rescoring, and query latency.
+
+The synthetic vectors are clustered and their variance decays along the
+dimensions, like Matryoshka-trained embeddings (text-embedding-3-*), so
+truncated codes keep most of the signal. Run from the data-processing
+directory:
+
+    python -m benchmarks.quantization --vectors 100000 --dimension 3072 --code-dims 0 1024 256
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from services.embedding_store import EmbeddingStore
+from services.quantization import FORMATS, QuantizedIndex
+from services.vector_index import VectorIndex, normalize_rows
+
+
+def make_vectors(count: int, dimension: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    """Clustered vectors whose per-dimension scale decays with the index"""
+    rng = np.random.default_rng(seed)
+    decay = (1.0 / np.sqrt(1.0 + np.arange(dimension) / 64.0)).astype(np.float32)
+    centers = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    vectors = np.empty((count, dimension), dtype=np.float32)
+    for start in range(0, count, 8192):
+        size = min(8192, count - start)
+        labels = rng.integers(0, clusters, size)
+        vectors[start:start + size] = (centers[labels] + 0.8 * rng.standard_normal((size, dimension),
+                                                                                  dtype=np.float32)) * decay
+    return normalize_rows(vectors)
+
+
+def recall(results, truth, k: int) -> float:
+    hits = sum(len({id for id, _ in got[:k]} & {id for id, _ in want[:k]}) for got, want in zip(results, truth))
+    return hits / (k * len(truth))
+
+
+def timed_search(index, queries: np.ndarray, top_k: int, **kwargs):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, top_k, **kwargs))
+        latencies.append((time.perf_counter() - start) * 1000)
+    return results, float(np.mean(latencies)), float(np.percentile(latencies, 95))
+
+
+def run(count: int, dimension: int, code_dims: List[int], n_queries: int, top_k: int,
+        rescore_factor: int, store_dir: str) -> List[Dict[str, Any]]:
+    vectors = make_vectors(count, dimension)
+    ids = [str(i) for i in range(count)]
+    store = EmbeddingStore(store_dir, dimension=dimension, dtype='float32')
+    for start in range(0, count, 8192):
+        store.append(ids[start:start + 8192], vectors[start:start + 8192])
+
+    rng = np.random.default_rng(1)
+    picks = rng.choice(count, n_queries, replace=False)
+    queries = normalize_rows(vectors[picks] + 0.05 * rng.standard_normal((n_queries, dimension), dtype=np.float32))
+
+    exact = VectorIndex.from_normalized(vectors, ids)
+    truth, mean_ms, p95_ms = timed_search(exact, queries, top_k)
+    rows = [{'format': 'float32', 'code_dimension': dimension, 'bytes_per_vector': exact.matrix.nbytes // count,
+             'rescore': False, 'recall_at_k': 1.0, 'mean_latency_ms': mean_ms, 'p95_latency_ms': p95_ms}]
+    del exact
+
+    for format in FORMATS:
+        for code_dim in code_dims:
+            index = QuantizedIndex.from_store(store, format, code_dim or None, rescore_factor=rescore_factor)
+            for rescore in (False, True):
+                results, mean_ms, p95_ms = timed_search(index, queries, top_k, rescore=rescore)
+                rows.append({
+                    'format': format,
+                    'code_dimension': index.dimension,
+                    'bytes_per_vector': index.memory_bytes / count,
+                    'rescore': rescore,
+                    'recall_at_k': recall(results, truth, top_k),
+                    'mean_latency_ms': mean_ms,
+                    'p95_latency_ms': p95_ms,
+                })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=100000)
+    parser.add_argument('--dimension', type=int, default=3072)
+    parser.add_argument('--code-dims', type=int, nargs='+', default=[0, 1024, 256],
+                        help='Code dimensions to try; 0 keeps the full dimension')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        rows = run(args.vectors, args.dimension, args.code_dims, args.queries, args.top_k,
+                   args.rescore_factor, store_dir)
+    for row in rows:
+        print(f"{row['format']:<8} d={row['code_dimension']:<5} {row['bytes_per_vector']:8.0f} B/vec  "
+              f"rescore={str(row['rescore']):<5}  recall@{args.top_k} {row['recall_at_k']:.3f}  "
+              f"mean {row['mean_latency_ms']:7.2f} ms  p95 {row['p95_latency_ms']:7.2f} ms")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(rows, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""
+Correctness check and scaling benchmark for sharded ingestion and search
+
+Ingests the same synthetic corpus into one in-process AvinciDataProcessor
+and into ShardedProcessor with each requested number of worker processes,
+then runs the same queries against all of them in vector, lexical and
+hybrid mode, each with and without a metadata filter. Embeddings come from
+the suite's deterministic mock, so every process produces identical
+vectors.
+
+Every search must return the same documents with the same scores as the
+single processor; the script exits non-zero if any query differs. Ingest
+and (unfiltered vector) search throughput are printed per shard count. Run from the data-processing directory:
+
+    python -m benchmarks.sharded --chunks 20000 --shards 1 2 4 --latency-ms 20
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from benchmarks.suite import MockEmbeddingProvider, configure_offline, make_chunks, make_documents, make_queries
+
+# Read by use_mock_embeddings in every worker, which inherits the environment
+LATENCY_ENV = 'SHARDED_BENCHMARK_LATENCY_MS'
+
+MODES = ('vector', 'lexical', 'hybrid')
+
+
+def use_mock_embeddings(processor):
+    """ShardedProcessor setup hook: embed with the deterministic mock instead of the API"""
+    from config.settings import settings
+    mock = MockEmbeddingProvider(settings.embedding_dimension, float(os.environ.get(LATENCY_ENV, '0')))
+    processor.embedding_service.scheduler.request_fn = mock.request
+
+
+def by_content(results: List[Dict[str, Any]]) -> List[tuple]:
+    # Vector ids are assigned per process, so documents are matched by content;
+    # sorting makes equal fused scores compare the same whatever their order
+    return sorted(((round(result['score'], 5), result['content']) for result in results),
+                  key=lambda item: (-item[0], item[1]))
+
+
+def label_documents(documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Give documents a keyword and a range field and return a filter matching about a quarter"""
+    for i, document in enumerate(documents):
+        document['metadata'] = {'type': 'transcript' if i % 2 == 0 else 'note', 'created_at': i}
+    return {'type': 'transcript', 'created_at': {'$lt': len(documents) // 2}}
+
+
+async def ingest(processor, documents: List[Dict[str, Any]], batch: int) -> float:
+    start = time.perf_counter()
+    for offset in range(0, len(documents), batch):
+        await processor.process_documents(documents[offset:offset + batch])
+    return time.perf_counter() - start
+
+
+async def search_all(processor, queries: List[str], top_k: int, mode: str, filters: Dict[str, Any],
+                     concurrent: bool) -> tuple:
+    start = time.perf_counter()
+    if concurrent:
+        results = await asyncio.gather(*(processor.search_documents(query, top_k, mode=mode, filters=filters)
+                                         for query in queries))
+    else:
+        results = [await processor.search_documents(query, top_k, mode=mode, filters=filters) for query in queries]
+    return results, time.perf_counter() - start
+
+
+async def search_cases(processor, queries: List[str], top_k: int, filters: Dict[str, Any],
+                       concurrent: bool) -> tuple:
+    """Results of every mode with and without ``filters``, and the unfiltered vector search time"""
+    results, vector_seconds = {}, 0.0
+    for mode in MODES:
+        for name, case_filters in ((mode, None), (f'{mode}+filters', filters)):
+            results[name], seconds = await search_all(processor, queries, top_k, mode, case_filters, concurrent)
+            if name == 'vector':
+                vector_seconds = seconds
+    return results, vector_seconds
+
+
+async def run(chunks: int, shard_counts: List[int], top_k: int, batch: int, workdir: str) -> Dict[str, Any]:
+    from config.settings import settings
+    from main import AvinciDataProcessor
+    from services.sharding import ShardedProcessor
+
+    documents = make_documents(make_chunks(chunks))
+    filters = label_documents(documents)
+    queries = make_queries()
+    report: Dict[str, Any] = {'documents': len(documents), 'queries': len(queries), 'runs': {}}
+
+    configure_offline(str(Path(workdir) / 'single'), settings.embedding_dimension)
+    single = AvinciDataProcessor()
+    use_mock_embeddings(single)
+    seconds = await ingest(single, documents, batch)
+    expected, search_seconds = await search_cases(single, queries, top_k, filters, concurrent=False)
+    report['runs']['single'] = {'ingest_docs_per_s': len(documents) / seconds,
+                                'search_qps': len(queries) / search_seconds}
+
+    mismatches = 0
+    for shards in shard_counts:
+        configure_offline(str(Path(workdir) / f'sharded-{shards}'), settings.embedding_dimension)
+        async with ShardedProcessor(shards, setup=use_mock_embeddings) as processor:
+            seconds = await ingest(processor, documents, batch)
+            counts = [shard['documents'] for shard in await processor.stats()]
+            found, search_seconds = await search_cases(processor, queries, top_k, filters, concurrent=True)
+        wrong = {case: sum(by_content(got) != by_content(want) for got, want in zip(found[case], expected[case]))
+                 for case in expected}
+        mismatches += sum(wrong.values())
+        report['runs'][f'{shards}_shards'] = {
+            'ingest_docs_per_s': len(documents) / seconds,
+            'search_qps': len(queries) / search_seconds,
+            'documents_per_shard': counts,
+            'mismatches': wrong,
+        }
+    report['mismatches'] = mismatches
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--chunks', type=int, default=4000, help='Corpus size; 20 chunks per document')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--dimension', type=int, default=256)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Simulated embedding request latency')
+    parser.add_argument('--batch', type=int, default=100, help='Documents per process_documents call')
+    parser.add_argument('--top-k', type=int, default=10)
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    os.environ[LATENCY_ENV] = str(args.latency_ms)
+    from config.settings import settings
+    settings.embedding_dimension = args.dimension
+    with tempfile.TemporaryDirectory() as workdir:
+        report = asyncio.run(run(args.chunks, args.shards, args.top_k, args.batch, workdir))
+
+    for name, row in report['runs'].items():
+        line = f"{name:<10} ingest {row['ingest_docs_per_s']:9.1f} docs/s  search {row['search_qps']:9.1f} qps"
+        if 'mismatches' in row:
+            failed = {case: count for case, count in row['mismatches'].items() if count}
+            line += f"  mismatches {failed or 0}  per shard {row['documents_per_shard']}"
+        print(line)
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(report, indent=2))
+    if report['mismatches']:
+        print(f"FAIL: {report['mismatches']} searches differ from the single processor")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Benchmark for batch similarity, near-duplicate detection and clustering
+
+Builds clustered unit vectors with planted near-duplicates and times
+all-pairs near-duplicate detection, k-means and average-linkage clustering
+from services.similarity. The all-pairs cost of the scalar
+``EmbeddingService.compute_similarity`` is extrapolated from a sample of
+calls for comparison. Run from the data-processing directory:
+
+    python -m benchmarks.similarity --rows 20000 --dimension 384 --workers 1 4
+"""
+
+import argparse
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+from services import similarity
+
+SCALAR_SAMPLE = 2000
+
+
+def make_embeddings(rows: int, dimension: int, clusters: int, duplicates: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((clusters, dimension))
+    vectors = centers[rng.integers(0, clusters, rows)] + rng.standard_normal((rows, dimension))
+    copies = rng.choice(rows, duplicates, replace=False)
+    vectors[rng.choice(rows, duplicates, replace=False)] = vectors[copies] + 0.01 * rng.standard_normal(
+        (duplicates, dimension))
+    return vectors.astype(np.float32)
+
+
+def scalar_pairs_per_s(vectors: np.ndarray) -> float:
+    from services.embedding_service import EmbeddingService
+    service = EmbeddingService.__new__(EmbeddingService)  # compute_similarity needs no clients
+
+    async def score():
+        for i in range(SCALAR_SAMPLE):
+            await service.compute_similarity(vectors[i % len(vectors)], vectors[(i * 7 + 1) % len(vectors)])
+
+    start = time.perf_counter()
+    asyncio.run(score())
+    return SCALAR_SAMPLE / (time.perf_counter() - start)
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run(rows: int, dimension: int, clusters: int, threshold: float, workers: List[int]) -> Dict[str, Any]:
+    vectors = make_embeddings(rows, dimension, clusters, duplicates=max(1, rows // 100))
+    pairs = rows * (rows - 1) // 2
+    results: Dict[str, Any] = {'rows': rows, 'dimension': dimension, 'pairs': pairs}
+    results['scalar_all_pairs_s'] = pairs / scalar_pairs_per_s(vectors)
+    for count in workers:
+        seconds = timed(lambda: similarity.near_duplicates(vectors, threshold, workers=count))
+        results[f'near_duplicates_s_workers_{count}'] = seconds
+        results[f'pairs_per_s_workers_{count}'] = pairs / seconds
+    results['duplicate_pairs'] = len(similarity.near_duplicates(vectors, threshold).first)
+    results['kmeans_s'] = timed(lambda: similarity.kmeans(vectors, clusters))
+    results['agglomerative_s'] = timed(lambda: similarity.agglomerative(vectors, n_clusters=clusters))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--dimension', type=int, default=384)
+    parser.add_argument('--clusters', type=int, default=20)
+    parser.add_argument('--threshold', type=float, default=0.95)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1])
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = run(args.rows, args.dimension, args.clusters, args.threshold, args.workers)
+    for key, value in results.items():
+        print(f"{key:<32} {value:,.3f}" if isinstance(value, float) else f"{key:<32} {value:,}")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
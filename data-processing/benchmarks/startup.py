@@ -0,0 +1,113 @@
+"""
+Startup benchmark: import time and time-to-first-request
+
+Every scenario runs in a fresh interpreter so module caches and lazily
+loaded models start cold. Run from the data-processing directory:
+
+    python -m benchmarks.startup --repeat 5 --output results/startup.json
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Any, Dict, List
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# name -> (imports, setup, first request)
+SCENARIOS = {
+    'clean_text': (
+        'from services.text_processor import TextProcessor',
+        'processor = TextProcessor()',
+        'processor.clean_text("Hello,   world! <b>tags</b> & symbols")',
+    ),
+    'preprocess_text': (
+        'from services.text_processor import TextProcessor',
+        'processor = TextProcessor()',
+        'processor.preprocess_text("The interviews covered several onboarding problems.")',
+    ),
+    'extract_entities': (
+        'from services.text_processor import TextProcessor',
+        'processor = TextProcessor()',
+        'processor.extract_entities("Priya moved from Mumbai to Bangalore in 2021.")',
+    ),
+    'truncate_text': (
+        'from services.embedding_service import EmbeddingService',
+        'service = EmbeddingService()',
+        'service._truncate_text("A short transcript line.", "text-embedding-3-large")',
+    ),
+    'processor': (
+        'from main import AvinciDataProcessor',
+        'processor = AvinciDataProcessor()',
+        'processor.text_processor.clean_text("Hello world")',
+    ),
+}
+
+CHILD_TEMPLATE = """
+import json, resource, time
+start = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+{setup}
+constructed = time.perf_counter()
+{first_request}
+done = time.perf_counter()
+print(json.dumps({{
+    'import_s': imported - start,
+    'construct_s': constructed - imported,
+    'first_request_s': done - constructed,
+    'total_s': done - start,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}}))
+"""
+
+
+def run_scenario(name: str) -> Dict[str, Any]:
+    """Run one scenario in a fresh interpreter and return its timings"""
+    imports, setup, first_request = SCENARIOS[name]
+    code = CHILD_TEMPLATE.format(imports=imports, setup=setup, first_request=first_request)
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'unknown error'
+        return {'error': error}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Median of each timing across repeats"""
+    ok = [run for run in runs if 'error' not in run]
+    if not ok:
+        return {'error': runs[-1]['error']}
+    return {key: statistics.median(run[key] for run in ok) for key in ok[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run (repeatable, default: all)')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenario or SCENARIOS:
+        results[name] = summarize([run_scenario(name) for _ in range(args.repeat)])
+        row = results[name]
+        if 'error' in row:
+            print(f"{name:<18} failed: {row['error']}")
+        else:
+            print(f"{name:<18} import {row['import_s'] * 1000:8.1f} ms  "
+                  f"construct {row['construct_s'] * 1000:8.1f} ms  "
+                  f"first request {row['first_request_s'] * 1000:8.1f} ms  "
+                  f"peak RSS {row['peak_rss_mb']:7.1f} MB")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
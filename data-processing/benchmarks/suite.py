@@ -0,0 +1,312 @@
+"""
+Offline benchmark suite for ingest, embedding and search
+
+Every (case, scale) pair runs in a fresh interpreter so peak RSS is per
+case. Embeddings come from a deterministic in-process mock (no network,
+same text -> same vector) and the corpus is synthetic transcript chunks, so
+runs are reproducible and comparable. Scales are corpus sizes in chunks:
+1k, 100k and 1m.
+
+Cases: clean_text, chunk_text, preprocess_text, extract_entities,
+generate_embeddings_batch, find_most_similar, process_documents and
+search_documents. Each reports throughput, per-call latency percentiles
+and peak RSS. Run from the data-processing directory:
+
+    python -m benchmarks.suite --scales 1k 100k --output results/suite.json
+    python -m benchmarks.suite --scales 1k --compare results/suite.json
+
+``--compare`` prints the throughput change against an earlier run and
+exits non-zero when any case got slower than ``--threshold``. The suite
+also exits non-zero when any case fails to run.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SCALES = {'1k': 1000, '100k': 100000, '1m': 1000000}
+CASES = ('clean_text', 'chunk_text', 'preprocess_text', 'extract_entities', 'generate_embeddings_batch',
+         'find_most_similar', 'process_documents', 'search_documents')
+
+CHUNK_CHARS = 400
+CHUNKS_PER_DOCUMENT = 20
+QUERIES = 50
+
+
+class MockEmbeddingProvider:
+    """Deterministic unit vectors seeded by a hash of the text
+
+    ``request`` has the signature of ``EmbeddingService._request_embeddings``
+    so it can stand in as the scheduler's request function.
+    """
+
+    def __init__(self, dimension: int = 256, latency_ms: float = 0.0):
+        self.dimension = dimension
+        self.latency_ms = latency_ms
+        self.requests = 0
+
+    def embed(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+        return vector / np.linalg.norm(vector)
+
+    def embed_many(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self.embed(text) for text in texts]) if texts else np.empty((0, self.dimension), np.float32)
+
+    async def request(self, texts: List[str], model: str) -> np.ndarray:
+        self.requests += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self.embed_many(texts)
+
+
+def make_chunks(count: int, seed: int = 0) -> List[str]:
+    """``count`` distinct transcript chunks of about CHUNK_CHARS characters"""
+    from benchmarks.clean_text import synthetic_transcript
+    base = synthetic_transcript(1 << 20, seed=seed)
+    span = len(base) - CHUNK_CHARS
+    step = 7919  # prime, so offsets cycle through the whole base text
+    return [f"Participant {i}: {base[(i * step) % span:(i * step) % span + CHUNK_CHARS]}" for i in range(count)]
+
+
+def make_documents(chunks: List[str]) -> List[Dict[str, Any]]:
+    return [
+        {'id': f"doc{start}", 'content': '\n'.join(chunks[start:start + CHUNKS_PER_DOCUMENT]),
+         'metadata': {'type': 'transcript'}}
+        for start in range(0, len(chunks), CHUNKS_PER_DOCUMENT)
+    ]
+
+
+def make_queries(count: int = QUERIES, seed: int = 1) -> List[str]:
+    from benchmarks.clean_text import WORDS
+    rng = np.random.default_rng(seed)
+    return [' '.join(rng.choice(WORDS, size=int(rng.integers(2, 6)))) for _ in range(count)]
+
+
+def measure(calls: List[Callable[[], Any]], items: int) -> Dict[str, Any]:
+    """Run each call once, timing each; ``items`` is the work done by all of them"""
+    latencies = []
+    start = time.perf_counter()
+    for call in calls:
+        call_start = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - call_start)
+    elapsed = time.perf_counter() - start
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'items': items,
+        'calls': len(calls),
+        'seconds': elapsed,
+        'items_per_s': items / elapsed if elapsed else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+    }
+
+
+def configure_offline(workdir: str, dimension: int):
+    """Point every cache and store at a scratch directory and lift client-side rate limits"""
+    from config.settings import settings
+    settings.embedding_cache_enabled = False
+    settings.query_cache_enabled = False
+    settings.embedding_tpm_limit = 0
+    settings.embedding_rpm_limit = 0
+    settings.embedding_provider = 'openai'
+    settings.openai_api_key = settings.openai_api_key or 'offline'
+    settings.embedding_store_path = str(Path(workdir) / 'embeddings')
+    settings.vector_index_path = str(Path(workdir) / 'vector_index')
+    settings.lexical_index_path = str(Path(workdir) / 'lexical_index')
+    settings.embedding_dimension = dimension
+
+
+def run_case(case: str, count: int, dimension: int, workdir: str) -> Dict[str, Any]:
+    configure_offline(workdir, dimension)
+    mock = MockEmbeddingProvider(dimension)
+    chunks = make_chunks(count)
+
+    if case in ('clean_text', 'chunk_text', 'preprocess_text', 'extract_entities'):
+        from services.text_processor import TextProcessor
+        processor = TextProcessor()
+        processor.warmup(spacy_model=case == 'extract_entities')
+        if case == 'chunk_text':
+            documents = [document['content'] for document in make_documents(chunks)]
+            return measure([lambda text=text: processor.chunk_text(text) for text in documents], len(chunks))
+        fn = getattr(processor, case)
+        return measure([lambda text=text: fn(text) for text in chunks], len(chunks))
+
+    if case == 'generate_embeddings_batch':
+        from services.embedding_service import EmbeddingService
+        service = EmbeddingService()
+        service.scheduler.request_fn = mock.request
+        batch = 1000
+        # Known token counts skip tokenization, which needs the tiktoken files
+        calls = [
+            lambda part=chunks[start:start + batch]: asyncio.run(service.generate_embeddings_batch(
+                part, token_counts=[len(text) // 4 for text in part]))
+            for start in range(0, len(chunks), batch)
+        ]
+        result = measure(calls, len(chunks))
+        result['requests'] = mock.requests
+        return result
+
+    if case == 'find_most_similar':
+        from services.embedding_service import EmbeddingService
+        service = EmbeddingService()
+        matrix = mock.embed_many(chunks)
+        queries = mock.embed_many(make_queries())
+        return measure([lambda query=query: asyncio.run(service.find_most_similar(query, matrix, top_k=10))
+                        for query in queries], len(queries))
+
+    from main import AvinciDataProcessor
+    processor = AvinciDataProcessor()
+    processor.embedding_service.scheduler.request_fn = mock.request
+
+    if case == 'process_documents':
+        documents = make_documents(chunks)
+        batch = 100
+        calls = [lambda part=documents[start:start + batch]: asyncio.run(processor.process_documents(part))
+                 for start in range(0, len(documents), batch)]
+        return measure(calls, len(documents))
+
+    if case == 'search_documents':
+        # Load the corpus straight into the stores; ingest cost is measured above
+        ids = [f"chunk{i}" for i in range(len(chunks))]
+        for start in range(0, len(chunks), 10000):
+            part = chunks[start:start + 10000]
+            asyncio.run(processor.vector_service.store_documents(
+                part, mock.embed_many(part), ids=ids[start:start + 10000]))
+            processor.lexical_index.add_many(ids[start:start + 10000], part)
+        results = {}
+        for mode in ('vector', 'lexical', 'hybrid'):
+            results[mode] = measure(
+                [lambda query=query: asyncio.run(processor.search_documents(query, top_k=10, mode=mode))
+                 for query in make_queries()],
+                QUERIES
+            )
+        return {**results['vector'], 'modes': results}
+
+    raise ValueError(f"Unknown case: {case}")
+
+
+def run_child(case: str, scale: str, dimension: int) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as workdir:
+        result = run_case(case, SCALES[scale], dimension, workdir)
+    result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return result
+
+
+def run_isolated(case: str, scale: str, dimension: int) -> Dict[str, Any]:
+    """Run one case in a fresh interpreter and return its result"""
+    command = [sys.executable, '-m', 'benchmarks.suite', '--child', case, scale, '--dimension', str(dimension)]
+    result = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = [line.strip() for line in result.stderr.splitlines() if line.strip(' *')]
+        # The exception line, plus the message NLTK-style errors put on the following line
+        raised = [i for i, line in enumerate(lines) if re.match(r'\w+(\.\w+)*(Error|Exception)\b', line)]
+        if not raised:
+            return {'error': lines[-1] if lines else 'unknown error'}
+        error = lines[raised[-1]]
+        if error.endswith(':') and raised[-1] + 1 < len(lines):
+            error += ' ' + lines[raised[-1] + 1]
+        return {'error': error}
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'numpy': np.__version__,
+    }
+
+
+def compare(results: List[Dict[str, Any]], baseline_path: str, threshold: float) -> List[str]:
+    """Print throughput changes against a baseline run; return the regressed cases"""
+    baseline = {(row['case'], row['scale']): row for row in json.loads(Path(baseline_path).read_text())['results']}
+    regressions = []
+    for row in results:
+        before = baseline.get((row['case'], row['scale']))
+        if 'error' in row:
+            continue  # reported as a failure by main()
+        if before is None or 'error' in before:
+            print(f"{row['case']:<26} {row['scale']:>5}  no baseline to compare against")
+            continue
+        change = row['items_per_s'] / before['items_per_s'] - 1 if before['items_per_s'] else 0.0
+        flag = ''
+        if change < -threshold:
+            flag = '  REGRESSION'
+            regressions.append(f"{row['case']}@{row['scale']}")
+        print(f"{row['case']:<26} {row['scale']:>5}  {before['items_per_s']:12.1f} -> "
+              f"{row['items_per_s']:12.1f} items/s  ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', nargs='+', choices=CASES, default=list(CASES))
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['1k'])
+    parser.add_argument('--dimension', type=int, default=256, help='Mock embedding dimension')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--compare', help='Earlier results JSON to compare throughput against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Fractional throughput drop that counts as a regression')
+    parser.add_argument('--child', nargs=2, metavar=('CASE', 'SCALE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_child(args.child[0], args.child[1], args.dimension)))
+        return
+
+    results = []
+    for scale in args.scales:
+        for case in args.cases:
+            row = {'case': case, 'scale': scale, **run_isolated(case, scale, args.dimension)}
+            results.append(row)
+            if 'error' in row:
+                print(f"{case:<26} {scale:>5}  failed: {row['error']}")
+            else:
+                print(f"{case:<26} {scale:>5}  {row['items_per_s']:12.1f} items/s  "
+                      f"p50 {row['p50_ms']:9.2f} ms  p95 {row['p95_ms']:9.2f} ms  p99 {row['p99_ms']:9.2f} ms  "
+                      f"peak RSS {row['peak_rss_mb']:8.1f} MB")
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.output).write_text(json.dumps({'environment': environment(), 'dimension': args.dimension,
+                                                 'results': results}, indent=2))
+
+    regressions: Optional[List[str]] = None
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+    failed = [f"{row['case']}@{row['scale']}" for row in results if 'error' in row]
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+    if regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+    if failed or regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ class Settings(BaseSettings):
     
     # API Keys
     openai_api_key: str = os.getenv("OPENAI_API_KEY", "")
+    openai_base_url: str = os.getenv("OPENAI_BASE_URL", "")  # e.g. a local mock embedding server
     pinecone_api_key: str = os.getenv("PINECONE_API_KEY", "")
     pinecone_environment: str = os.getenv("PINECONE_ENVIRONMENT", "us-west1-gcp")
     weaviate_url: str = os.getenv("WEAVIATE_URL", "")
@@ -23,6 +24,7 @@ class Settings(BaseSettings):
     # Model settings
     embedding_model: str = "text-embedding-3-large"
     embedding_dimension: int = 3072
+    embedding_output_dimension: int = int(os.getenv("EMBEDDING_OUTPUT_DIMENSION", "0"))  # shortens text-embedding-3 vectors, 0 keeps native
     chunk_size: int = 1000
     chunk_overlap: int = 200
     
@@ -31,12 +33,109 @@ class Settings(BaseSettings):
     pinecone_index_name: str = os.getenv("PINECONE_INDEX_NAME", "avinci-documents")
     weaviate_class_name: str = os.getenv("WEAVIATE_CLASS_NAME", "Document")
     
+    # Embedding store settings
+    embedding_store_path: str = os.getenv("EMBEDDING_STORE_PATH", "data/embeddings")
+    embedding_store_dtype: str = "float32"  # float32, float16
+    
+    # Incremental ingest settings
+    ingest_manifest_path: str = os.getenv("INGEST_MANIFEST_PATH", "data/ingest_manifest.sqlite3")
+    
+    # Local vector index settings
+    vector_index_type: str = os.getenv("VECTOR_INDEX_TYPE", "flat")  # flat, ivf, hnsw
+    vector_index_path: str = os.getenv("VECTOR_INDEX_PATH", "data/vector_index")
+    ivf_nlist: int = 1024
+    ivf_nprobe: int = 16
+    ivf_pq_m: int = 0  # > 0 compresses IVF lists with product quantization
+    ivf_train_size: int = 0  # vectors buffered before training, 0 means 39 * ivf_nlist
+    hnsw_m: int = 32
+    hnsw_ef_construction: int = 200
+    hnsw_ef_search: int = 64
+    hnsw_rebuild_fraction: float = 0.25  # rebuild the HNSW graph once this share of it is tombstoned
+    
+    # Quantized index settings (defaults for services.quantization.QuantizedIndex, not VectorService)
+    quantized_format: str = os.getenv("QUANTIZED_FORMAT", "int8")  # float16, int8, binary
+    quantized_dimension: int = 0  # Matryoshka-truncate codes to this many dims, 0 keeps all
+    rescore_factor: int = 4  # candidates per result rescored at full precision
+    
+    # Lexical / hybrid search settings
+    search_mode: str = os.getenv("SEARCH_MODE", "vector")  # vector, lexical, hybrid
+    lexical_index_path: str = os.getenv("LEXICAL_INDEX_PATH", "data/lexical_index")
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    rrf_k: int = 60  # reciprocal rank fusion damping constant
+    hybrid_candidates: int = 4  # candidates per result fetched from each ranking before fusion
+    
+    # Metadata filter settings
+    metadata_keyword_fields: str = os.getenv("METADATA_KEYWORD_FIELDS", "type,title,persona,document_id")
+    metadata_range_fields: str = os.getenv("METADATA_RANGE_FIELDS", "processed_at,created_at,date")
+    
+    # Similarity and clustering settings
+    similarity_block_size: int = 2048  # query rows scored per matrix product
+    similarity_workers: int = int(os.getenv("SIMILARITY_WORKERS", "1"))  # > 1 scores blocks on a thread pool
+    near_duplicate_threshold: float = 0.95
+    cluster_max_dense_points: int = 5000  # larger inputs are reduced with k-means before average linkage
+    
+    # Search result cache settings
+    query_cache_enabled: bool = True
+    query_cache_backend: str = os.getenv("QUERY_CACHE_BACKEND", "memory")  # memory, redis (uses redis_url)
+    query_cache_max_items: int = 1000
+    query_cache_ttl_seconds: float = 300.0
+    
+    # Metrics settings
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    profiler_sample_hz: int = int(os.getenv("PROFILER_SAMPLE_HZ", "0"))  # > 0 starts the sampling profiler
+    
+    # Sharding settings
+    shard_count: int = int(os.getenv("SHARD_COUNT", "0"))  # ShardedProcessor worker processes, 0 uses every CPU core
+    
     # Processing settings
     max_concurrent_requests: int = 10
     batch_size: int = 100
     retry_attempts: int = 3
     timeout_seconds: int = 30
     
+    # NLP batch processing settings
+    nlp_workers: int = int(os.getenv("NLP_WORKERS", "0"))  # 0 uses every CPU core
+    nlp_batch_size: int = 64  # texts per worker task and per spaCy nlp.pipe batch
+    nltk_auto_download: bool = os.getenv("NLTK_AUTO_DOWNLOAD", "true").lower() == "true"
+    nlp_model: str = os.getenv("NLP_MODEL", "en_core_web_sm")
+    nlp_analyses: str = os.getenv("NLP_ANALYSES", "entities,keywords,sentences,sentiment")
+    nlp_keywords_top_k: int = 10
+    
+    # Document extraction settings
+    extract_workers: int = int(os.getenv("EXTRACT_WORKERS", "0"))  # 0 uses every CPU core
+    extract_inline_max_bytes: int = 1048576  # smaller documents are extracted on a thread
+    
+    # Chunking settings
+    chunk_tokens: int = 512
+    chunk_overlap_tokens: int = 64
+    chunk_stream_block_chars: int = 1000000  # characters tokenized at a time when streaming
+    
+    # Embedding cache settings
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_items: int = 10000  # in-process LRU tier
+    embedding_cache_disk_max_items: int = 1000000  # on-disk tier, 0 disables it
+    embedding_cache_path: str = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")
+    
+    # Embedding request scheduling settings
+    embedding_max_batch_inputs: int = 2048  # inputs per request
+    embedding_max_batch_tokens: int = 300000  # tokens per request
+    embedding_tpm_limit: int = int(os.getenv("EMBEDDING_TPM_LIMIT", "1000000"))  # 0 disables
+    embedding_rpm_limit: int = int(os.getenv("EMBEDDING_RPM_LIMIT", "3000"))  # 0 disables
+    embedding_coalesce_ms: float = 5.0  # window for batching concurrent single-text calls
+    retry_backoff_base_seconds: float = 0.5
+    retry_backoff_max_seconds: float = 20.0
+    
+    # Local embedding settings
+    embedding_provider: str = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai, local
+    local_embedding_model: str = os.getenv("LOCAL_EMBEDDING_MODEL", "all-MiniLM-L6-v2")
+    local_embedding_quantization: str = os.getenv("LOCAL_EMBEDDING_QUANTIZATION", "none")  # none, int8, onnx, onnx-int8
+    local_embedding_dimension: int = int(os.getenv("LOCAL_EMBEDDING_DIMENSION", "0"))  # 0 keeps the model's own
+    local_embedding_batch_size: int = 64
+    local_embedding_max_wait_ms: float = 10.0  # how long a dynamic batch waits to fill
+    local_embedding_threads: int = 0  # torch intra-op threads, 0 leaves the default
+    local_embedding_cache_dir: str = os.getenv("LOCAL_EMBEDDING_CACHE_DIR", "cache/local_models")  # ONNX exports
+    
     # Logging
     log_level: str = os.getenv("LOG_LEVEL", "INFO")
     log_file: str = os.getenv("LOG_FILE", "logs/data_processing.log")
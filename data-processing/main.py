@@ -4,18 +4,23 @@ Main entry point for data processing, NLP, and AI operations
 """
 
 import asyncio
+import gc
 import logging
-from pathlib import Path
-from typing import List, Dict, Any, Optional
-import pandas as pd
-import numpy as np
+import weakref
+from typing import List, Dict, Any, Optional, Union, Iterable, AsyncIterable, AsyncIterator
 from dotenv import load_dotenv
 
 from services.text_processor import TextProcessor
 from services.embedding_service import EmbeddingService
 from services.vector_service import VectorService
 from services.nlp_analyzer import NLPAnalyzer
-from api.data_api import DataAPI
+from services.ingest_pipeline import IngestPipeline, IngestCheckpoint
+from services.incremental_ingest import IncrementalIngestor
+from services.vector_index import VectorIndex
+from services.embedding_store import EmbeddingStore
+from services.lexical_index import BM25Index, reciprocal_rank_fusion
+from services.query_cache import QueryResultCache, exact_ranking
+from services.metrics import metrics, SamplingProfiler
 from config.settings import Settings
 
 # Load environment variables
@@ -28,6 +33,22 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Live processors, held weakly so the gauges below never keep one alive
+_processors: "weakref.WeakSet[AvinciDataProcessor]" = weakref.WeakSet()
+
+def _vector_documents() -> float:
+    return sum(len(processor.vector_service) for processor in list(_processors))
+
+def _search_cache_hit_rate() -> float:
+    caches = [processor.query_cache for processor in list(_processors) if processor.query_cache is not None]
+    hits = sum(cache.hits for cache in caches)
+    lookups = hits + sum(cache.misses for cache in caches)
+    return hits / lookups if lookups else 0.0
+
+# Registered once per process and summed over every processor
+metrics.gauge('vector_documents', callback=_vector_documents)
+metrics.gauge('search_cache_hit_rate', callback=_search_cache_hit_rate)
+
 class AvinciDataProcessor:
     """Main data processing orchestrator"""
     
@@ -36,86 +57,260 @@ class AvinciDataProcessor:
         self.text_processor = TextProcessor()
         self.embedding_service = EmbeddingService()
         self.vector_service = VectorService()
-        self.nlp_analyzer = NLPAnalyzer()
+        self.nlp_analyzer = NLPAnalyzer(self.text_processor)
+        self.embedding_store = EmbeddingStore(self.settings.embedding_store_path)
+        self.lexical_index = BM25Index(self.text_processor.preprocess_text)
+        self.query_cache = QueryResultCache() if self.settings.query_cache_enabled else None
+        if self.query_cache is not None:
+            # Every write to the vector store makes cached results stale
+            self.vector_service.add_listener(self.query_cache.invalidate)
+        _processors.add(self)
+        self.profiler: Optional[SamplingProfiler] = None
+        self.incremental: Optional[IncrementalIngestor] = None
+        self.pipeline = IngestPipeline(
+            self.text_processor,
+            self.embedding_service,
+            self.vector_service,
+            self.nlp_analyzer,
+            batch_size=self.settings.batch_size,
+            max_concurrency=self.settings.max_concurrent_requests,
+            embedding_store=self.embedding_store,
+            lexical_index=self.lexical_index
+        )
         
-    async def process_documents(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-        """Process a batch of documents"""
+    def warmup(self):
+        """Load every model and tokenizer up front
+
+        Heavy resources otherwise load lazily on first use. Pre-fork servers
+        should call this in the parent so workers share the loaded models
+        copy-on-write; freezing the GC afterwards keeps collections from
+        touching (and so copying) those pages in the children.
+        """
+        self.text_processor.warmup()
+        self.embedding_service.warmup()
+        if hasattr(self.nlp_analyzer, 'warmup'):
+            self.nlp_analyzer.warmup()
+        gc.freeze()
+        
+    async def process_documents(self, documents: List[Dict[str, Any]],
+                                return_exceptions: bool = False) -> List[Any]:
+        """Process a batch of documents
+
+        Documents are micro-batched and pushed through the staged ingest
+        pipeline. Results come back in input order; failed documents are
+        dropped unless ``return_exceptions`` is set, in which case their
+        slot holds the exception instead. Each result's ``embedding`` is a
+        read-only view into the embedding store.
+        """
         logger.info(f"Processing {len(documents)} documents")
         
+        results = await self.pipeline.run(documents)
+        
         processed_docs = []
-        for doc in documents:
-            try:
-                # Extract text content
-                content = await self.text_processor.extract_text(doc)
-                
-                # Clean and preprocess text
-                cleaned_text = self.text_processor.clean_text(content)
-                
-                # Generate embeddings
-                embedding = await self.embedding_service.generate_embedding(cleaned_text)
-                
-                # Perform NLP analysis
-                analysis = await self.nlp_analyzer.analyze(cleaned_text)
-                
-                # Store in vector database
-                vector_id = await self.vector_service.store_document(
-                    content=cleaned_text,
-                    embedding=embedding,
-                    metadata={
-                        **doc.get('metadata', {}),
-                        'analysis': analysis,
-                        'processed_at': pd.Timestamp.now().isoformat()
-                    }
-                )
-                
-                processed_doc = {
-                    'id': vector_id,
-                    'content': cleaned_text,
-                    'embedding': embedding,
-                    'analysis': analysis,
-                    'metadata': doc.get('metadata', {}),
-                    'processed_at': pd.Timestamp.now().isoformat()
-                }
-                
-                processed_docs.append(processed_doc)
-                logger.info(f"Processed document: {doc.get('id', 'unknown')}")
-                
-            except Exception as e:
-                logger.error(f"Error processing document {doc.get('id', 'unknown')}: {e}")
+        failed = 0
+        for doc, result in zip(documents, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error processing document {doc.get('id', 'unknown')}: {result}")
+                failed += 1
+                if return_exceptions:
+                    processed_docs.append(result)
                 continue
+            processed_docs.append(result)
+        metrics.inc('documents_total', len(documents) - failed, status='ok')
+        metrics.inc('documents_total', failed, status='failed')
         
+        logger.info(f"Processed {len(processed_docs)} of {len(documents)} documents")
         return processed_docs
     
-    async def search_documents(self, query: str, top_k: int = 10) -> List[Dict[str, Any]]:
-        """Search documents using vector similarity"""
-        logger.info(f"Searching for: {query}")
+    async def process_documents_incremental(self, documents: Iterable[Dict[str, Any]],
+                                            delete_missing: bool = False) -> Dict[str, Any]:
+        """Re-ingest a document set, reprocessing only what changed since the last run
+
+        Unlike ``process_documents``, vectors are stored per chunk. Returns a
+        report of new, changed, unchanged, deleted and failed documents and
+        of added, kept and removed chunks. With ``delete_missing``, documents
+        ingested before but absent from ``documents`` are removed.
+        """
+        if self.incremental is None:
+            # Opened on first use, so the manifest database is only created when needed
+            self.incremental = IncrementalIngestor(
+                self.text_processor,
+                self.embedding_service,
+                self.vector_service,
+                self.nlp_analyzer,
+                lexical_index=self.lexical_index,
+                embedding_store=self.embedding_store,
+                batch_size=self.settings.batch_size
+            )
+        return await self.incremental.run(documents, delete_missing=delete_missing)
+    
+    async def process_documents_stream(self, documents: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+                                       checkpoint_path: Optional[str] = None,
+                                       return_exceptions: bool = False) -> AsyncIterator[Any]:
+        """Stream documents from any sync or async iterable through the pipeline
+
+        Processed documents are yielded in input order as their batch
+        finishes, with memory bounded regardless of input size. With a
+        ``checkpoint_path``, documents already ingested under the same
+        checkpoint are skipped, so a crashed ingest resumes where it stopped.
+        """
+        checkpoint = IngestCheckpoint(checkpoint_path) if checkpoint_path else None
+        if checkpoint is not None and len(checkpoint):
+            logger.info(f"Resuming ingest, {len(checkpoint)} documents already done")
+        
+        try:
+            async for doc, result in self.pipeline.stream(documents, checkpoint=checkpoint):
+                if isinstance(result, BaseException):
+                    logger.error(f"Error processing document {doc.get('id', 'unknown')}: {result}")
+                    metrics.inc('documents_total', status='failed')
+                    if return_exceptions:
+                        yield result
+                    continue
+                metrics.inc('documents_total', status='ok')
+                yield result
+        finally:
+            if checkpoint is not None:
+                checkpoint.close()
+    
+    async def search_documents(self, query: str, top_k: int = 10,
+                               index: Optional[VectorIndex] = None,
+                               mode: Optional[str] = None,
+                               filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Search documents by vector similarity, BM25 or both
+
+        ``mode`` (default ``SEARCH_MODE``) is ``vector``, ``lexical`` or
+        ``hybrid``. Lexical search never calls the embedding API, which suits
+        exact terms such as names; hybrid fuses both rankings with reciprocal
+        rank fusion. When an in-process ``VectorIndex`` is given it is
+        searched directly instead of the vector service.
+
+        ``filters`` scopes the search by metadata, e.g.
+        ``{"type": "transcript", "processed_at": {"$gte": "2024-01-01"}}``;
+        it is applied while scoring, so ``top_k`` matching results come back
+        without overfetching.
+
+        Results from the vector service are cached per normalized query,
+        mode and filters (and ``top_k`` for hybrid and approximate vector
+        search) until the next write to the store.
+        """
+        mode = (mode or self.settings.search_mode).lower()
+        if mode not in ('vector', 'lexical', 'hybrid'):
+            raise ValueError(f"Unknown search mode: {mode}")
+        if filters and index is not None:
+            raise ValueError("Filters need the vector service's metadata index; they can't apply to a caller's index")
+        
+        # Results from a caller's own index are not cached; nothing invalidates them
+        cache = self.query_cache if index is None else None
+        if cache is not None:
+            prefix = exact_ranking(mode, self.vector_service.index_type)
+            cached, generation = await cache.lookup(query, top_k, mode, filters, prefix)
+            if cached is not None:
+                return cached
+        
+        with metrics.timer('search_seconds', mode=mode):
+            results = await self._search(query, top_k, index, mode, filters)
+        if cache is not None:
+            await cache.store(query, top_k, results, mode, filters, generation=generation, prefix=prefix)
+        return results
+    
+    async def _search(self, query: str, top_k: int, index: Optional[VectorIndex],
+                      mode: str, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        logger.info(f"Searching ({mode}) for: {query}")
+        
+        # One selection serves both rankings
+        selection = self.vector_service.select(filters) if filters else None
+        allow = self.vector_service.id_filter(selection) if selection is not None else None
+        
+        if mode == 'lexical':
+            return self._with_documents(self.lexical_index.search(query, top_k, allow=allow))
+        
+        # Hybrid search fuses longer candidate lists from both rankings
+        candidates = top_k * self.settings.hybrid_candidates if mode == 'hybrid' else top_k
         
         # Generate query embedding
         query_embedding = await self.embedding_service.generate_embedding(query)
         
-        # Search vector database
-        results = await self.vector_service.search_similar(
-            query_embedding=query_embedding,
-            top_k=top_k
-        )
+        if index is not None:
+            results = [
+                {'id': id, 'score': score}
+                for id, score in index.search(query_embedding, candidates)
+            ]
+        else:
+            # Search vector database
+            results = await self.vector_service.search_similar(
+                query_embedding=query_embedding,
+                top_k=candidates,
+                filters=selection
+            )
         
+        if mode == 'vector':
+            return results
+        
+        lexical = self.lexical_index.search(query, candidates, allow=allow)
+        fused = reciprocal_rank_fusion([lexical, [(result['id'], result['score']) for result in results]])
+        return self._with_documents(fused[:top_k])
+    
+    def _with_documents(self, hits: List[tuple]) -> List[Dict[str, Any]]:
+        """Attach stored content and metadata to (id, score) hits"""
+        results = []
+        for (id, score), document in zip(hits, self.vector_service.get_documents([id for id, _ in hits])):
+            result = dict(document) if document is not None else {'id': id}
+            result['score'] = score
+            results.append(result)
         return results
     
-    async def analyze_text(self, text: str) -> Dict[str, Any]:
-        """Perform comprehensive NLP analysis on text"""
+    def get_metrics(self) -> Dict[str, Any]:
+        """Snapshot of every metric; histograms carry p50/p95/p99"""
+        return metrics.snapshot()
+    
+    def metrics_text(self) -> str:
+        """Metrics in Prometheus text format, for a /metrics endpoint"""
+        return metrics.render_prometheus()
+    
+    def start_profiler(self, interval_seconds: float = None):
+        """Start sampling every thread's stack in the background
+
+        Start it after forking workers; the sampler thread does not survive
+        a fork.
+        """
+        if self.profiler is None:
+            self.profiler = SamplingProfiler(interval_seconds)
+        self.profiler.start()
+    
+    def stop_profiler(self) -> str:
+        """Stop the profiler and return its samples as folded stacks for flame graphs"""
+        if self.profiler is None:
+            return ''
+        self.profiler.stop()
+        return self.profiler.collapsed()
+    
+    def get_search_cache_stats(self) -> Dict[str, Any]:
+        """Hit rate and size of the search result cache"""
+        if self.query_cache is None:
+            return {}
+        return self.query_cache.stats()
+    
+    async def analyze_text(self, text: str, analyses: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Perform comprehensive NLP analysis on text
+
+        Entities, keywords, sentences and sentiment all come from one parse;
+        ``analyses`` limits the work to the named outputs.
+        """
         logger.info("Analyzing text")
         
         # Clean text
         cleaned_text = self.text_processor.clean_text(text)
         
         # Perform analysis
-        analysis = await self.nlp_analyzer.analyze(cleaned_text)
+        analysis = await self.nlp_analyzer.analyze(cleaned_text, analyses)
         
         return analysis
 
 async def main():
     """Main entry point"""
     processor = AvinciDataProcessor()
+    if processor.settings.profiler_sample_hz > 0:
+        processor.start_profiler()
     
     # Example usage
     sample_documents = [
@@ -142,6 +337,11 @@ async def main():
     # Analyze text
     analysis = await processor.analyze_text("This is a test sentence for analysis.")
     logger.info(f"Analysis results: {analysis}")
+    
+    logger.info(f"Metrics:\n{processor.metrics_text()}")
+    if processor.profiler is not None:
+        logger.info(f"Hottest frames: {processor.profiler.top(10)}")
+        processor.stop_profiler()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,206 @@
+"""
+Token-aware chunking with a single tokenization pass
+"""
+
+import logging
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Token bytes that end a sentence once trailing whitespace and quotes are dropped
+_SENTENCE_END = (b'.', b'?', b'!')
+_TRAILING = b' \t\r\n"\')]'
+
+
+class Chunk(NamedTuple):
+    """A token-bounded slice of a document
+
+    ``start``/``end`` are character offsets and ``token_start``/``token_end``
+    token offsets into the whole document; ``text`` decodes exactly from
+    the tokens in that range.
+    """
+    text: str
+    start: int
+    end: int
+    token_start: int
+    token_end: int
+
+    @property
+    def n_tokens(self) -> int:
+        return self.token_end - self.token_start
+
+
+class TokenChunker:
+    """Split text into chunks of at most ``max_tokens`` tokens
+
+    The text is tokenized once; chunk ends snap back to the last sentence
+    boundary in the second half of the window, and consecutive chunks
+    share ``overlap_tokens`` tokens. Work is linear in the document
+    length, and ``chunk_stream`` does the same over an iterable of text
+    pieces so arbitrarily large inputs never need to be one string.
+    """
+
+    def __init__(self, encoding=None, max_tokens: int = None, overlap_tokens: int = None,
+                 block_chars: int = None):
+        if encoding is None:
+            import tiktoken
+            encoding = tiktoken.get_encoding("cl100k_base")
+        self.encoding = encoding
+        self.max_tokens = max_tokens or settings.chunk_tokens
+        self.overlap_tokens = settings.chunk_overlap_tokens if overlap_tokens is None else overlap_tokens
+        if not 0 <= self.overlap_tokens < self.max_tokens:
+            raise ValueError("overlap_tokens must be at least 0 and smaller than max_tokens")
+        self.block_chars = block_chars or settings.chunk_stream_block_chars
+        # token id -> (starts mid-character, characters started, ends a sentence)
+        self._token_info: Dict[int, Tuple[bool, int, bool]] = {}
+
+    def chunk(self, text: str) -> List[Chunk]:
+        """Chunk a whole document held in memory"""
+        return list(self.chunk_stream([text]))
+
+    def chunk_stream(self, pieces: Iterable[str]) -> Iterator[Chunk]:
+        """Chunk a document arriving as an iterable of text pieces (e.g. file blocks)
+
+        Pieces are buffered up to ``block_chars`` and tokenized segment by
+        segment, cutting only where tokenization cannot span the cut, so the
+        tokens match tokenizing the whole document at once.
+        """
+        state = _StreamState()
+        buffered: List[str] = []
+        buffered_chars = 0
+        for piece in pieces:
+            if not piece:
+                continue
+            buffered.append(piece)
+            buffered_chars += len(piece)
+            if buffered_chars < self.block_chars:
+                continue
+            pending = ''.join(buffered)
+            cut = _safe_cut(pending)
+            if cut:
+                self._extend(state, pending[:cut])
+                yield from self._emit(state, final=False)
+                pending = pending[cut:]
+            buffered, buffered_chars = [pending], len(pending)
+
+        self._extend(state, ''.join(buffered))
+        yield from self._emit(state, final=True)
+
+    def _extend(self, state: "_StreamState", segment: str):
+        """Tokenize one segment and append its token offsets and boundaries"""
+        if not segment:
+            return
+        tokens = self.encoding.encode(segment, disallowed_special=())
+        info = self._token_info
+        char_base = len(state.text)
+        text_len = 0
+        for token in tokens:
+            entry = info.get(token)
+            if entry is None:
+                entry = info[token] = self._describe(token)
+            continuation, chars, sentence_end = entry
+            state.offsets.append(char_base + max(0, text_len - continuation))
+            text_len += chars
+            state.boundaries.append(state.token_base + len(state.boundaries) + 1 if sentence_end
+                                    else state.last_boundary)
+            state.last_boundary = state.boundaries[-1]
+        state.text += segment
+
+    def _describe(self, token: int) -> Tuple[bool, int, bool]:
+        data = self.encoding.decode_single_token_bytes(token)
+        continuation = bool(data) and 0x80 <= data[0] < 0xC0
+        chars = sum(1 for byte in data if not 0x80 <= byte < 0xC0)
+        stripped = data.rstrip(_TRAILING)
+        sentence_end = b'\n' in data or stripped.endswith(_SENTENCE_END)
+        return continuation, chars, sentence_end
+
+    def _emit(self, state: "_StreamState", final: bool) -> Iterator[Chunk]:
+        """Yield every window that is complete, then drop what no later chunk needs"""
+        n = len(state.offsets)
+        start = 0
+        while start < n:
+            end = start + self.max_tokens
+            if end >= n:
+                if not final:
+                    break
+                end = n
+            else:
+                # Snap to the last sentence end in the second half of the window
+                boundary = state.boundaries[end - 1] - state.token_base
+                if boundary > start + self.max_tokens // 2:
+                    end = boundary
+
+            char_start = state.offsets[start]
+            char_end = state.offsets[end] if end < n else len(state.text)
+            yield Chunk(
+                text=state.text[char_start:char_end],
+                start=state.char_base + char_start,
+                end=state.char_base + char_end,
+                token_start=state.token_base + start,
+                token_end=state.token_base + end,
+            )
+            if end == n:
+                start = n
+                break
+            next_start = end - self.overlap_tokens
+            start = next_start if next_start > start else end
+        state.drop(start)
+
+
+class _StreamState:
+    """Tokens of the part of a document that later chunks still need"""
+
+    __slots__ = ('text', 'offsets', 'boundaries', 'last_boundary', 'token_base', 'char_base')
+
+    def __init__(self):
+        self.text = ''
+        # Character offset (into text) where each token starts
+        self.offsets: List[int] = []
+        # For each token, the absolute token index just after the last sentence end so far
+        self.boundaries: List[int] = []
+        self.last_boundary = 0
+        self.token_base = 0
+        self.char_base = 0
+
+    def drop(self, count: int):
+        """Forget the first ``count`` tokens and the text they cover"""
+        if count <= 0:
+            return
+        char_cut = self.offsets[count] if count < len(self.offsets) else len(self.text)
+        self.text = self.text[char_cut:]
+        self.offsets = [offset - char_cut for offset in self.offsets[count:]]
+        self.boundaries = self.boundaries[count:]
+        self.token_base += count
+        self.char_base += char_cut
+
+
+def _safe_cut(text: str) -> int:
+    """Position where text can be split without changing its tokenization
+
+    Prefers the end of a run of newlines followed by a non-space character,
+    then a single space between a non-space character and a letter.
+    Returns 0 if there is no such place.
+    """
+    i = text.rfind('\n', 0, len(text) - 1)
+    while i >= 0:
+        if not text[i + 1].isspace():
+            return i + 1
+        i = text.rfind('\n', 0, i)
+    i = text.rfind(' ', 0, len(text) - 1)
+    while i >= 1:
+        if text[i + 1].isalpha() and not text[i - 1].isspace():
+            return i
+        i = text.rfind(' ', 0, i)
+    return 0
+
+
+def read_text_blocks(path: str, block_chars: int = 1 << 16, encoding: str = 'utf-8') -> Iterator[str]:
+    """Read a text file in blocks, for feeding TokenChunker.chunk_stream"""
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                return
+            yield block
@@ -0,0 +1,217 @@
+"""
+Streaming text extraction for HTML, PDF and DOCX documents
+"""
+
+import codecs
+import io
+import logging
+import os
+import re
+import zipfile
+from html.parser import HTMLParser
+from typing import Any, BinaryIO, Iterator, List, Union
+from xml.etree import ElementTree
+
+logger = logging.getLogger(__name__)
+
+Source = Union[str, bytes, bytearray, os.PathLike, BinaryIO]
+
+# file type -> extractor name; anything else is treated as plain text
+FORMATS = {'html': 'html', 'htm': 'html', 'pdf': 'pdf', 'docx': 'docx', 'doc': 'docx'}
+
+READ_BLOCK_SIZE = 1 << 16
+
+# Elements whose content is never visible text
+_SKIPPED_TAGS = frozenset({'script', 'style', 'noscript', 'template'})
+# Elements that start a new line, so paragraphs and list items don't run together
+_BLOCK_TAGS = frozenset({
+    'address', 'article', 'aside', 'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'figcaption', 'figure',
+    'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr', 'li', 'main', 'nav', 'ol', 'p',
+    'pre', 'section', 'table', 'title', 'tr', 'ul'
+})
+_CHARSET = re.compile(rb'<meta[^>]+charset=["\']?([\w-]+)', re.IGNORECASE)
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Parts holding body text, in reading order
+_DOCX_PARTS = ('word/document.xml', 'word/footnotes.xml', 'word/endnotes.xml')
+
+
+class _HTMLTextParser(HTMLParser):
+    """Collects visible text from parser events without building a tree"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts: List[str] = []
+        self._skip_depth = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth += 1
+        elif tag in _BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in _BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag in _BLOCK_TAGS:
+            self._parts.append('\n')
+
+    def handle_data(self, data):
+        if not self._skip_depth:
+            self._parts.append(data)
+
+    def take(self) -> str:
+        """Text collected since the last call"""
+        text = ''.join(self._parts)
+        self._parts = []
+        return text
+
+
+def _open_binary(source: Source):
+    """(file object, whether we opened it) for a path, bytes or binary file"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source), True
+    if isinstance(source, os.PathLike):
+        return open(source, 'rb'), True
+    return source, False
+
+
+def _html_encoding(head: bytes, default: str) -> str:
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    match = _CHARSET.search(head[:4096])
+    if match:
+        try:
+            return codecs.lookup(match.group(1).decode('ascii')).name
+        except LookupError:
+            pass
+    return default
+
+
+def iter_html(source: Source, encoding: str = 'utf-8', block_size: int = READ_BLOCK_SIZE) -> Iterator[str]:
+    """Yield the visible text of an HTML document as it is parsed
+
+    ``source`` is markup as ``str``, raw bytes, an ``os.PathLike`` path or
+    a binary file. Bytes are decoded incrementally, honouring a BOM or
+    ``<meta charset>`` near the start. Script, style, noscript and template
+    contents are dropped; block elements become line breaks.
+    """
+    parser = _HTMLTextParser()
+    if isinstance(source, str):
+        for start in range(0, len(source), block_size):
+            parser.feed(source[start:start + block_size])
+            text = parser.take()
+            if text:
+                yield text
+    else:
+        stream, owned = _open_binary(source)
+        try:
+            head = stream.read(block_size)
+            decoder = codecs.getincrementaldecoder(_html_encoding(head, encoding))(errors='replace')
+            block = head
+            while block:
+                parser.feed(decoder.decode(block))
+                text = parser.take()
+                if text:
+                    yield text
+                block = stream.read(block_size)
+            parser.feed(decoder.decode(b'', final=True))
+        finally:
+            if owned:
+                stream.close()
+    parser.close()
+    text = parser.take()
+    if text:
+        yield text
+
+
+def iter_pdf(source: Source) -> Iterator[str]:
+    """Yield the text of a PDF one page at a time
+
+    ``source`` is raw bytes, an ``os.PathLike`` path or a binary file.
+    Pages are decoded lazily, so only the page being extracted is held in
+    memory.
+    """
+    from pypdf import PdfReader
+
+    stream, owned = _open_binary(source)
+    try:
+        reader = PdfReader(stream)
+        for page in reader.pages:
+            yield (page.extract_text() or '') + '\n'
+    finally:
+        if owned:
+            stream.close()
+
+
+def iter_docx(source: Source) -> Iterator[str]:
+    """Yield the paragraphs of a DOCX file, part by part
+
+    ``source`` is raw bytes, an ``os.PathLike`` path or a binary file.
+    Each XML part is streamed with ``iterparse`` and paragraphs are released
+    once read, so memory stays flat however long the document is.
+    """
+    stream, owned = _open_binary(source)
+    try:
+        try:
+            archive = zipfile.ZipFile(stream)
+        except zipfile.BadZipFile:
+            raise ValueError("Not a DOCX (Office Open XML) file; legacy .doc is not supported")
+        with archive:
+            names = set(archive.namelist())
+            for name in _DOCX_PARTS:
+                if name in names:
+                    with archive.open(name) as part:
+                        yield from _iter_docx_part(part)
+    finally:
+        if owned:
+            stream.close()
+
+
+def _iter_docx_part(part: BinaryIO) -> Iterator[str]:
+    parts: List[str] = []
+    for _, element in ElementTree.iterparse(part, events=('end',)):
+        tag = element.tag
+        if tag == _W + 't':
+            parts.append(element.text or '')
+        elif tag == _W + 'tab':
+            parts.append('\t')
+        elif tag == _W + 'br' or tag == _W + 'cr':
+            parts.append('\n')
+        elif tag == _W + 'p':
+            parts.append('\n')
+            yield ''.join(parts)
+            parts = []
+            element.clear()
+    if parts:
+        yield ''.join(parts)
+
+
+def iter_text(source: Source, file_type: str) -> Iterator[str]:
+    """Yield text pieces of a document of ``file_type`` (html, htm, pdf, docx, doc)"""
+    extractor = FORMATS.get(file_type.lower())
+    if extractor == 'html':
+        return iter_html(source)
+    if extractor == 'pdf':
+        return iter_pdf(source)
+    if extractor == 'docx':
+        return iter_docx(source)
+    raise ValueError(f"Unsupported document type: {file_type}")
+
+
+def extract_text(source: Source, file_type: str) -> str:
+    """Whole text of a document; picklable, so it can run in a process pool"""
+    return ''.join(iter_text(source, file_type))
+
+
+def source_size(source: Any) -> int:
+    """Size in bytes (or characters) of a source, 0 if unknown"""
+    if isinstance(source, os.PathLike):
+        return os.path.getsize(source)
+    if isinstance(source, (str, bytes, bytearray, memoryview)):
+        return len(source)
+    return 0
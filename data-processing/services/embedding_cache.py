@@ -0,0 +1,236 @@
+"""
+Content-addressed embedding cache with an in-process LRU and an on-disk tier
+"""
+
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """Two-tier cache of embeddings keyed by a hash of (model, text)
+
+    The memory tier is a bounded LRU of float32 arrays. The disk tier is a
+    SQLite table of raw float32 blobs that survives restarts; memory misses
+    fall through to it and disk hits are promoted back into memory. The
+    ``*_async`` methods answer memory hits inline and run disk reads and
+    writes in a thread, so a large batch never blocks the event loop on I/O.
+    """
+
+    def __init__(self, max_items: int = None, path: Optional[str] = None,
+                 disk_max_items: int = None):
+        self.max_items = settings.embedding_cache_max_items if max_items is None else max_items
+        self.disk_max_items = (settings.embedding_cache_disk_max_items
+                               if disk_max_items is None else disk_max_items)
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        # SQLite calls are serialized separately, so memory lookups never wait on disk I/O
+        self._disk_lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._disk_count = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        path = settings.embedding_cache_path if path is None else path
+        if path and self.disk_max_items > 0:
+            try:
+                self._open_disk(path)
+            except Exception as e:
+                logger.warning(f"Embedding disk cache disabled, could not open {path}: {e}")
+                self._db = None
+
+    def _open_disk(self, path: str):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+        self._disk_count = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, text: str) -> bytes:
+        """Content address for an embedding of ``text`` under ``model``"""
+        digest = hashlib.sha256(model.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8'))
+        return digest.digest()
+
+    def get(self, key: bytes) -> Optional[np.ndarray]:
+        """Look up a single embedding"""
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[bytes]) -> Dict[bytes, np.ndarray]:
+        """Look up many embeddings, returning only the keys that were found"""
+        found, missing = self._get_memory(keys)
+        if missing and self._db is not None:
+            self._promote(found, self._read_disk(missing))
+        return self._count(found, missing)
+
+    async def get_many_async(self, keys: Iterable[bytes]) -> Dict[bytes, np.ndarray]:
+        """``get_many`` that reads memory misses from disk in a thread"""
+        found, missing = self._get_memory(keys)
+        if missing and self._db is not None:
+            loop = asyncio.get_running_loop()
+            self._promote(found, await loop.run_in_executor(None, self._read_disk, missing))
+        return self._count(found, missing)
+
+    def _get_memory(self, keys: Iterable[bytes]) -> Tuple[Dict[bytes, np.ndarray], List[bytes]]:
+        found: Dict[bytes, np.ndarray] = {}
+        missing: List[bytes] = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                elif key not in found:
+                    missing.append(key)
+        return found, missing
+
+    def _promote(self, found: Dict[bytes, np.ndarray], rows: List[Tuple[bytes, np.ndarray]]):
+        """Add disk hits to ``found`` and to the memory tier"""
+        with self._lock:
+            for key, vector in rows:
+                found[key] = vector
+                self._remember(key, vector)
+                self.disk_hits += 1
+
+    def _count(self, found: Dict[bytes, np.ndarray], missing: List[bytes]) -> Dict[bytes, np.ndarray]:
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(set(missing) - found.keys())
+        return found
+
+    def put(self, key: bytes, vector) -> None:
+        """Store a single embedding"""
+        self.put_many([(key, vector)])
+
+    def put_many(self, items: Iterable[Tuple[bytes, object]]) -> None:
+        """Store many embeddings in both tiers"""
+        rows = self._put_memory(items)
+        if rows and self._db is not None:
+            self._write_disk(rows)
+
+    async def put_many_async(self, items: Iterable[Tuple[bytes, object]]) -> None:
+        """``put_many`` that writes the disk tier in a thread"""
+        rows = self._put_memory(items)
+        if rows and self._db is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._write_disk, rows)
+
+    def _put_memory(self, items: Iterable[Tuple[bytes, object]]) -> List[Tuple[bytes, bytes]]:
+        """Insert into the memory tier and return the (key, blob) rows for disk"""
+        rows = []
+        with self._lock:
+            for key, vector in items:
+                # Copy so a cached row never pins the caller's whole batch matrix
+                vector = np.array(vector, dtype=np.float32)
+                vector.flags.writeable = False
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+        return rows
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        """Insert into the memory tier, evicting the least recently used"""
+        if self.max_items <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _read_disk(self, keys: List[bytes]) -> List[Tuple[bytes, np.ndarray]]:
+        found = []
+        with self._disk_lock:
+            if self._db is None:
+                return found
+            try:
+                # Stay well below SQLite's bound-parameter limit
+                for start in range(0, len(keys), 500):
+                    chunk = keys[start:start + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor = self._db.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk
+                    )
+                    for key, blob in cursor:
+                        found.append((bytes(key), np.frombuffer(blob, dtype=np.float32)))
+            except sqlite3.Error as e:
+                logger.error(f"Error reading embedding disk cache: {e}")
+        return found
+
+    def _write_disk(self, rows: List[Tuple[bytes, bytes]]):
+        with self._disk_lock:
+            if self._db is None:
+                return
+            try:
+                self._db.execute("BEGIN")
+                before = self._db.total_changes
+                self._db.executemany("INSERT OR IGNORE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                added = self._db.total_changes - before
+
+                overflow = self._disk_count + added - self.disk_max_items
+                if overflow > 0:
+                    # Oldest rows go first; rowids grow with insertion order
+                    self._db.execute(
+                        "DELETE FROM embeddings WHERE rowid IN "
+                        "(SELECT rowid FROM embeddings ORDER BY rowid LIMIT ?)",
+                        (overflow,)
+                    )
+                else:
+                    overflow = 0
+                self._db.execute("COMMIT")
+            except sqlite3.Error as e:
+                logger.error(f"Error writing embedding disk cache: {e}")
+                try:
+                    self._db.execute("ROLLBACK")
+                except sqlite3.Error:
+                    pass
+                return
+            with self._lock:
+                self._disk_count += added - overflow
+                self.evictions += overflow
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters and current tier sizes"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'memory_items': len(self._memory),
+                'disk_items': self._disk_count
+            }
+
+    def clear(self):
+        """Drop every cached embedding from both tiers"""
+        with self._lock:
+            self._memory.clear()
+        with self._disk_lock:
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+                with self._lock:
+                    self._disk_count = 0
+
+    def close(self):
+        with self._disk_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
@@ -0,0 +1,268 @@
+"""
+Request scheduling for embedding APIs: coalescing, token-budget batching,
+rate limiting and retries
+"""
+
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: timeouts, conflicts, rate limits and server errors
+RETRYABLE_STATUS = {408, 409, 429}
+RETRYABLE_ERRORS = {'APIConnectionError', 'APITimeoutError'}
+
+
+class TokenBucket:
+    """Continuously refilling token bucket for per-minute limits
+
+    The bucket holds one second of budget by default, so bursts stay close
+    to the average rate. A request larger than the whole bucket waits for a
+    full bucket and then leaves it in debt, so oversized batches are slowed
+    rather than rejected. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: float = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or max(1.0, self.rate)
+        self.level = self.capacity
+        self._clock = clock
+        self._updated = clock()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _refill(self):
+        now = self._clock()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, amount: float = 1):
+        """Wait until ``amount`` can be spent, then spend it"""
+        if self.rate <= 0:
+            return
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # One waiter at a time keeps the bucket first-come first-served
+        async with self._lock:
+            needed = min(amount, self.capacity)
+            while True:
+                self._refill()
+                if self.level >= needed:
+                    self.level -= amount
+                    return
+                await asyncio.sleep((needed - self.level) / self.rate)
+
+    def drain(self):
+        """Empty the bucket, e.g. after the server reports a rate limit"""
+        if self.rate > 0:
+            self._refill()
+            self.level = min(self.level, 0)
+
+
+class EmbeddingScheduler:
+    """Central scheduler for embedding requests
+
+    Single texts submitted with ``embed`` within ``coalesce_ms`` of each
+    other are sent together. Every request, coalesced or from
+    ``embed_many``, is split to stay under the per-request input and token
+    limits, waits on the requests-per-minute and tokens-per-minute buckets,
+    runs with a timeout and is retried with jittered exponential backoff.
+
+    ``request_fn(texts, model)`` sends one request and returns an
+    (n, dim) float32 matrix.
+    """
+
+    def __init__(self, request_fn: Callable[[List[str], str], Awaitable[np.ndarray]],
+                 max_batch_inputs: int = None, max_batch_tokens: int = None,
+                 tokens_per_minute: int = None, requests_per_minute: int = None,
+                 coalesce_ms: float = None, max_concurrency: int = None,
+                 retry_attempts: int = None, timeout_seconds: float = None):
+        self.request_fn = request_fn
+        self.max_batch_inputs = max_batch_inputs or settings.embedding_max_batch_inputs
+        self.max_batch_tokens = max_batch_tokens or settings.embedding_max_batch_tokens
+        self.coalesce_seconds = (settings.embedding_coalesce_ms if coalesce_ms is None else coalesce_ms) / 1000
+        self.max_concurrency = max_concurrency or settings.max_concurrent_requests
+        self.retry_attempts = settings.retry_attempts if retry_attempts is None else retry_attempts
+        self.timeout_seconds = timeout_seconds or settings.timeout_seconds
+        self.tokens = TokenBucket(settings.embedding_tpm_limit if tokens_per_minute is None else tokens_per_minute)
+        self.requests = TokenBucket(settings.embedding_rpm_limit if requests_per_minute is None
+                                    else requests_per_minute)
+
+        # model -> [(text, n_tokens, future)] waiting to be coalesced
+        self._pending: Dict[str, List[Tuple[str, int, asyncio.Future]]] = {}
+        self._pending_tokens: Dict[str, int] = {}
+        self._flush_handles: Dict[str, asyncio.TimerHandle] = {}
+        self._tasks = set()
+        self._loop = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        self.stats = {'requests': 0, 'inputs': 0, 'tokens': 0, 'retries': 0, 'failures': 0, 'coalesced': 0}
+
+    def _bind_loop(self):
+        """Create loop-bound primitives on first use in each event loop"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.tokens._lock = None
+            self.requests._lock = None
+            self._pending.clear()
+            self._pending_tokens.clear()
+            self._flush_handles.clear()
+        return loop
+
+    async def embed(self, text: str, n_tokens: int, model: str) -> np.ndarray:
+        """Embed one text, batched with other calls arriving at the same time"""
+        loop = self._bind_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(model, [])
+        pending.append((text, n_tokens, future))
+        self._pending_tokens[model] = self._pending_tokens.get(model, 0) + n_tokens
+
+        if (len(pending) >= self.max_batch_inputs or self._pending_tokens[model] >= self.max_batch_tokens
+                or self.coalesce_seconds <= 0):
+            self._flush(model)
+        elif model not in self._flush_handles:
+            self._flush_handles[model] = loop.call_later(self.coalesce_seconds, self._flush, model)
+        return await future
+
+    def _flush(self, model: str):
+        handle = self._flush_handles.pop(model, None)
+        if handle is not None:
+            handle.cancel()
+        pending = self._pending.pop(model, [])
+        self._pending_tokens.pop(model, None)
+        if not pending:
+            return
+        if len(pending) > 1:
+            self.stats['coalesced'] += len(pending)
+        task = asyncio.ensure_future(self._dispatch_pending(pending, model))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _dispatch_pending(self, pending: List[Tuple[str, int, asyncio.Future]], model: str):
+        texts = [text for text, _, _ in pending]
+        counts = [n_tokens for _, n_tokens, _ in pending]
+        try:
+            embeddings = await self.embed_many(texts, counts, model)
+        except Exception as e:
+            for _, _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, _, future), embedding in zip(pending, embeddings):
+            if not future.done():
+                future.set_result(embedding)
+
+    async def embed_many(self, texts: List[str], token_counts: List[int], model: str) -> np.ndarray:
+        """Embed texts in as few requests as the limits allow, sent concurrently"""
+        self._bind_loop()
+        batches = self.plan_batches(token_counts)
+        results = await asyncio.gather(*(
+            self._send([texts[i] for i in batch], sum(token_counts[i] for i in batch), model)
+            for batch in batches
+        ))
+        if len(results) == 1:
+            return results[0]
+        return np.concatenate(results) if results else np.empty((0, 0), dtype=np.float32)
+
+    def plan_batches(self, token_counts: List[int]) -> List[List[int]]:
+        """Group consecutive inputs into batches under the input and token limits"""
+        batches: List[List[int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for i, n_tokens in enumerate(token_counts):
+            if current and (len(current) >= self.max_batch_inputs
+                            or current_tokens + n_tokens > self.max_batch_tokens):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += n_tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _send(self, texts: List[str], n_tokens: int, model: str) -> np.ndarray:
+        """Send one request within the rate limits, retrying transient failures"""
+        attempt = 0
+        while True:
+            await self.requests.acquire(1)
+            await self.tokens.acquire(n_tokens)
+            try:
+                async with self._semaphore:
+                    with metrics.timer('embedding_request_seconds', model=model):
+                        embeddings = await asyncio.wait_for(self.request_fn(texts, model), self.timeout_seconds)
+                self.stats['requests'] += 1
+                self.stats['inputs'] += len(texts)
+                self.stats['tokens'] += n_tokens
+                metrics.inc('embedding_requests_total', model=model, status='ok')
+                metrics.inc('embedding_inputs_total', len(texts), model=model)
+                metrics.inc('embedding_tokens_total', n_tokens, model=model)
+                return embeddings
+            except Exception as e:
+                if attempt >= self.retry_attempts or not _is_retryable(e):
+                    self.stats['failures'] += 1
+                    metrics.inc('embedding_requests_total', model=model, status='failed')
+                    raise
+                if _status_code(e) == 429:
+                    self.requests.drain()
+                    self.tokens.drain()
+                delay = self._backoff(attempt, _retry_after(e))
+                attempt += 1
+                self.stats['retries'] += 1
+                metrics.inc('embedding_requests_total', model=model, status='retried')
+                logger.warning(f"Embedding request failed ({type(e).__name__}: {e}), "
+                               f"retry {attempt}/{self.retry_attempts} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    def _backoff(self, attempt: int, retry_after: Optional[float]) -> float:
+        """Full-jitter exponential backoff, never shorter than the server's Retry-After"""
+        ceiling = min(settings.retry_backoff_max_seconds, settings.retry_backoff_base_seconds * (2 ** attempt))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    return status
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    status = _status_code(error)
+    return status is not None and (status in RETRYABLE_STATUS or status >= 500)
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value is not None:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
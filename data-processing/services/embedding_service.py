@@ -3,14 +3,21 @@ Embedding generation service using various providers
 """
 
 import asyncio
+import base64
+import functools
 import logging
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Tuple, Union
 import numpy as np
-from openai import AsyncOpenAI
-from sentence_transformers import SentenceTransformer
-import tiktoken
 
 from config.settings import settings
+from services.chunker import Chunk
+from services.embedding_cache import EmbeddingCache
+from services.embedding_scheduler import EmbeddingScheduler
+from services.local_embedding import LocalEmbeddingProvider
+from services.metrics import metrics
+from services import similarity
+from services.vector_index import VectorIndex
 
 logger = logging.getLogger(__name__)
 
@@ -18,124 +25,295 @@ class EmbeddingService:
     """Service for generating text embeddings"""
     
     def __init__(self):
-        self.openai_client = AsyncOpenAI(api_key=settings.openai_api_key)
-        self.sentence_transformer = None
-        self.encoding = tiktoken.get_encoding("cl100k_base")
+        self.cache = EmbeddingCache() if settings.embedding_cache_enabled else None
+        # Every API request goes through the scheduler for batching, rate limits and retries
+        self.scheduler = EmbeddingScheduler(self._request_embeddings)
+        # Clients and models are loaded on first use; see warmup()
+        self._lock = threading.RLock()
+        self._openai_client = None
+        self._encoding = None
+        self._local_provider = None
+    
+    @property
+    def openai_client(self):
+        """OpenAI client, created on first use"""
+        if self._openai_client is None:
+            with self._lock:
+                if self._openai_client is None:
+                    from openai import AsyncOpenAI
+                    # Retries and timeouts are handled by the scheduler
+                    self._openai_client = AsyncOpenAI(
+                        api_key=settings.openai_api_key,
+                        base_url=settings.openai_base_url or None,
+                        max_retries=0,
+                        timeout=settings.timeout_seconds
+                    )
+        return self._openai_client
+    
+    @property
+    def encoding(self):
+        """tiktoken encoding used for truncation, loaded on first use"""
+        if self._encoding is None:
+            with self._lock:
+                if self._encoding is None:
+                    import tiktoken
+                    self._encoding = tiktoken.get_encoding("cl100k_base")
+        return self._encoding
+    
+    @property
+    def local_provider(self) -> LocalEmbeddingProvider:
+        """Local embedding model: the provider in local mode, the OpenAI fallback otherwise
         
-        # Initialize sentence transformer as fallback
-        try:
-            self.sentence_transformer = SentenceTransformer('all-MiniLM-L6-v2')
-        except Exception as e:
-            logger.warning(f"Could not load sentence transformer: {e}")
+        Created on first use; the model itself loads on the first embedding.
+        """
+        if self._local_provider is None:
+            with self._lock:
+                if self._local_provider is None:
+                    self._local_provider = LocalEmbeddingProvider()
+        return self._local_provider
     
-    async def generate_embedding(self, text: str, model: str = None) -> List[float]:
-        """Generate embedding for text using OpenAI API"""
-        model = model or settings.embedding_model
+    @property
+    def default_model(self) -> str:
+        """Model used when none is given; local models are named by their signature"""
+        if settings.embedding_provider == "local":
+            return self.local_provider.signature
+        return settings.embedding_model
+    
+    def _is_local(self, model: str) -> bool:
+        return model.startswith("local:")
+    
+    def warmup(self, fallback_model: bool = True):
+        """Load the tokenizer, client and local model now instead of on first use
+
+        Call this before forking server workers so they share the loaded
+        models copy-on-write.
+        """
+        if settings.embedding_provider == "local":
+            self.local_provider.warmup()
+            return
+        self.encoding
+        self.openai_client
+        if fallback_model:
+            try:
+                self.local_provider.warmup()
+            except Exception as e:
+                logger.warning(f"Could not load local fallback embedding model: {e}")
+    
+    @metrics.timed('stage_seconds', stage='embed_one')
+    async def generate_embedding(self, text: str, model: str = None) -> np.ndarray:
+        """Generate a float32 embedding vector for text using OpenAI API or the local model"""
+        model = model or self.default_model
         
         try:
-            # Truncate text if too long
-            text = self._truncate_text(text, model)
+            # Truncate text if too long; local models truncate to their own limit
+            n_tokens = None
+            if not self._is_local(model):
+                text, n_tokens = self._truncate_with_count(text, model)
             
-            response = await self.openai_client.embeddings.create(
-                model=model,
-                input=text,
-                encoding_format="float"
-            )
+            key = None
+            if self.cache is not None:
+                key = self._cache_key(model, text)
+                cached = (await self.cache.get_many_async([key])).get(key)
+                metrics.inc('embedding_cache_total', result='hit' if cached is not None else 'miss')
+                if cached is not None:
+                    return cached
             
-            return response.data[0].embedding
+            # Concurrent single-text calls are coalesced into one request or batch
+            if self._is_local(model):
+                embedding = await self.local_provider.embed(text)
+            else:
+                embedding = await self.scheduler.embed(text, n_tokens, model)
+            if key is not None:
+                await self.cache.put_many_async([(key, embedding)])
+            return embedding
             
         except Exception as e:
+            if self._is_local(model):
+                logger.error(f"Error generating local embedding: {e}")
+                raise
             logger.error(f"Error generating OpenAI embedding: {e}")
-            # Fallback to sentence transformer
+            # Fallback to the local model
             return await self._generate_fallback_embedding(text)
     
-    async def generate_embeddings_batch(self, texts: List[str], model: str = None) -> List[List[float]]:
-        """Generate embeddings for multiple texts"""
-        model = model or settings.embedding_model
+    @metrics.timed('stage_seconds', stage='embed')
+    async def generate_embeddings_batch(self, texts: List[str], model: str = None,
+                                        token_counts: Optional[List[int]] = None) -> np.ndarray:
+        """Generate embeddings for multiple texts as one (len(texts), dim) float32 matrix
+        
+        token_counts, when known (e.g. from TokenChunker), lets texts that fit
+        the model skip being encoded again for truncation.
+        """
+        model = model or self.default_model
         
         try:
             # Truncate texts
-            texts = [self._truncate_text(text, model) for text in texts]
+            if token_counts is None:
+                token_counts = [None] * len(texts)
+            if self._is_local(model):
+                truncated = list(zip(texts, token_counts))
+            else:
+                truncated = [self._truncate_with_count(text, model, n_tokens)
+                             for text, n_tokens in zip(texts, token_counts)]
+            texts = [text for text, _ in truncated]
             
-            response = await self.openai_client.embeddings.create(
-                model=model,
-                input=texts,
-                encoding_format="float"
-            )
+            if self.cache is None:
+                return await self._embed_uncached(texts, [n for _, n in truncated], model)
             
-            return [item.embedding for item in response.data]
+            # Look every key up first and only send the misses
+            keys = [self._cache_key(model, text) for text in texts]
+            found = await self.cache.get_many_async(keys)
+            
+            pending: Dict[bytes, Tuple[str, int]] = {}
+            for key, item in zip(keys, truncated):
+                if key not in found and key not in pending:
+                    pending[key] = item
+            metrics.inc('embedding_cache_total', len(keys) - len(pending), result='hit')
+            metrics.inc('embedding_cache_total', len(pending), result='miss')
+            
+            if pending:
+                fresh = await self._embed_uncached(
+                    [text for text, _ in pending.values()], [n for _, n in pending.values()], model
+                )
+                fresh_items = list(zip(pending.keys(), fresh))
+                await self.cache.put_many_async(fresh_items)
+                found.update(fresh_items)
+            
+            return np.stack([found[key] for key in keys]) if keys else np.empty((0, 0), dtype=np.float32)
             
         except Exception as e:
             logger.error(f"Error generating batch embeddings: {e}")
-            # Fallback to sentence transformer
+            if self._is_local(model):
+                raise
+            # Fallback to the local model
             return await self._generate_fallback_embeddings_batch(texts)
     
-    async def _generate_fallback_embedding(self, text: str) -> List[float]:
-        """Generate embedding using sentence transformer as fallback"""
-        if not self.sentence_transformer:
-            raise Exception("No embedding service available")
+    async def _embed_uncached(self, texts: List[str], token_counts: List[Optional[int]], model: str) -> np.ndarray:
+        """Embed texts with the provider behind model"""
+        if self._is_local(model):
+            return await self.local_provider.embed_many(texts)
+        return await self.scheduler.embed_many(texts, token_counts, model)
+    
+    async def _request_embeddings(self, texts: List[str], model: str) -> np.ndarray:
+        """Send one embeddings request for already-truncated texts (called by the scheduler)"""
+        # text-embedding-3 models can return shortened (Matryoshka) vectors;
+        # this client version has no dimensions argument, so send it in the body
+        dimensions = self._output_dimension(model)
+        extra_body = {"dimensions": dimensions} if dimensions else None
+        # base64 decodes straight into a float32 buffer instead of a list of Python floats
+        response = await self.openai_client.embeddings.create(
+            model=model,
+            input=texts,
+            encoding_format="base64",
+            extra_body=extra_body
+        )
+        return np.stack([
+            np.frombuffer(base64.b64decode(item.embedding), dtype=np.float32)
+            for item in sorted(response.data, key=lambda item: item.index)
+        ])
+    
+    def _output_dimension(self, model: str) -> int:
+        """Requested vector length for models that support shortening, 0 for native"""
+        if model.startswith("text-embedding-3-") and settings.embedding_output_dimension:
+            return settings.embedding_output_dimension
+        return 0
+    
+    def _cache_key(self, model: str, text: str) -> bytes:
+        """Cache key that also distinguishes shortened vectors of the same model"""
+        dimensions = self._output_dimension(model)
+        return EmbeddingCache.make_key(f"{model}@{dimensions}" if dimensions else model, text)
+    
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters of the embedding cache"""
+        if self.cache is None:
+            return {}
+        return self.cache.stats()
+    
+    def get_request_stats(self) -> Dict[str, int]:
+        """Request, retry and coalescing counters of the request scheduler"""
+        return self.scheduler.get_stats()
+    
+    def get_local_stats(self) -> Dict[str, int]:
+        """Batch counters of the local embedding model"""
+        if self._local_provider is None:
+            return {}
+        return self._local_provider.get_stats()
+    
+    async def _generate_fallback_embedding(self, text: str) -> np.ndarray:
+        """Generate embedding with the local model as fallback
         
+        Set LOCAL_EMBEDDING_DIMENSION to the primary dimension so fallback
+        vectors fit the same index. Raises if the local model fails too.
+        """
+        metrics.inc('embedding_fallbacks_total')
         try:
-            # Run in thread pool to avoid blocking
-            loop = asyncio.get_event_loop()
-            embedding = await loop.run_in_executor(
-                None, 
-                self.sentence_transformer.encode, 
-                text
-            )
-            return embedding.tolist()
+            return await self.local_provider.embed(text)
         except Exception as e:
             logger.error(f"Error generating fallback embedding: {e}")
-            # Return zero vector as last resort
-            return [0.0] * 384  # all-MiniLM-L6-v2 dimension
+            raise Exception("No embedding service available") from e
     
-    async def _generate_fallback_embeddings_batch(self, texts: List[str]) -> List[List[float]]:
-        """Generate embeddings for multiple texts using sentence transformer"""
-        if not self.sentence_transformer:
-            raise Exception("No embedding service available")
-        
+    async def _generate_fallback_embeddings_batch(self, texts: List[str]) -> np.ndarray:
+        """Generate embeddings for multiple texts with the local model as fallback"""
+        metrics.inc('embedding_fallbacks_total', len(texts))
         try:
-            loop = asyncio.get_event_loop()
-            embeddings = await loop.run_in_executor(
-                None,
-                self.sentence_transformer.encode,
-                texts
-            )
-            return embeddings.tolist()
+            return await self.local_provider.embed_many(texts)
         except Exception as e:
             logger.error(f"Error generating fallback batch embeddings: {e}")
-            # Return zero vectors as last resort
-            return [[0.0] * 384] * len(texts)
+            raise Exception("No embedding service available") from e
+    
+    async def embed_chunks(self, chunks: List[Chunk], model: str = None) -> np.ndarray:
+        """Embed token-bounded chunks without tokenizing them again"""
+        return await self.generate_embeddings_batch(
+            [chunk.text for chunk in chunks], model, token_counts=[chunk.n_tokens for chunk in chunks]
+        )
     
-    def _truncate_text(self, text: str, model: str) -> str:
-        """Truncate text to fit model's token limit"""
+    def _max_tokens(self, model: str) -> int:
+        """Input token limit of an embedding model"""
         if model == "text-embedding-3-large":
-            max_tokens = 8191
+            return 8191
         elif model == "text-embedding-3-small":
-            max_tokens = 8191
+            return 8191
         elif model == "text-embedding-ada-002":
-            max_tokens = 8191
+            return 8191
         else:
-            max_tokens = 8191
+            return 8191
+    
+    def _truncate_text(self, text: str, model: str, n_tokens: Optional[int] = None) -> str:
+        """Truncate text to fit model's token limit
+        
+        Pass n_tokens when the token count is already known to skip encoding
+        texts that fit.
+        """
+        return self._truncate_with_count(text, model, n_tokens)[0]
+    
+    def _truncate_with_count(self, text: str, model: str, n_tokens: Optional[int] = None) -> Tuple[str, int]:
+        """Truncate text to fit model's token limit and return it with its token count"""
+        max_tokens = self._max_tokens(model)
+        if n_tokens is not None and n_tokens <= max_tokens:
+            return text, n_tokens
         
         try:
             tokens = self.encoding.encode(text)
             if len(tokens) <= max_tokens:
-                return text
+                return text, len(tokens)
             
             # Truncate and decode back to text
             truncated_tokens = tokens[:max_tokens]
-            return self.encoding.decode(truncated_tokens)
+            return self.encoding.decode(truncated_tokens), max_tokens
         except Exception as e:
             logger.error(f"Error truncating text: {e}")
             # Simple character-based truncation as fallback
-            return text[:max_tokens * 4]  # Rough estimate: 4 chars per token
+            text = text[:max_tokens * 4]  # Rough estimate: 4 chars per token
+            return text, min(max_tokens, len(text) // 4 + 1)
     
     def get_embedding_dimension(self, model: str = None) -> int:
         """Get the dimension of embeddings for a given model"""
-        model = model or settings.embedding_model
+        model = model or self.default_model
         
-        if model == "text-embedding-3-large":
+        if self._is_local(model):
+            return self.local_provider.dimension
+        elif self._output_dimension(model):
+            return self._output_dimension(model)
+        elif model == "text-embedding-3-large":
             return 3072
         elif model == "text-embedding-3-small":
             return 1536
@@ -144,7 +322,8 @@ class EmbeddingService:
         else:
             return 1536  # Default
     
-    async def compute_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
+    async def compute_similarity(self, embedding1: Union[List[float], np.ndarray],
+                                 embedding2: Union[List[float], np.ndarray]) -> float:
         """Compute cosine similarity between two embeddings"""
         try:
             # Convert to numpy arrays
@@ -166,25 +345,92 @@ class EmbeddingService:
             logger.error(f"Error computing similarity: {e}")
             return 0.0
     
-    async def find_most_similar(self, query_embedding: List[float], 
-                              document_embeddings: List[List[float]], 
+    async def find_most_similar(self, query_embedding: Union[List[float], np.ndarray], 
+                              document_embeddings: Union[List[List[float]], np.ndarray, VectorIndex], 
                               top_k: int = 5) -> List[Dict[str, Any]]:
-        """Find most similar documents to query embedding"""
+        """Find most similar documents to query embedding
+
+        ``document_embeddings`` may be a prebuilt ``VectorIndex``, in which
+        case ``index`` in the results is the id it was stored under.
+        """
         try:
-            similarities = []
-            
-            for i, doc_embedding in enumerate(document_embeddings):
-                similarity = await self.compute_similarity(query_embedding, doc_embedding)
-                similarities.append({
-                    'index': i,
-                    'similarity': similarity
-                })
+            if isinstance(document_embeddings, VectorIndex):
+                index = document_embeddings
+            else:
+                if len(document_embeddings) == 0:
+                    return []
+                index = VectorIndex.from_embeddings(document_embeddings)
             
-            # Sort by similarity (descending)
-            similarities.sort(key=lambda x: x['similarity'], reverse=True)
-            
-            return similarities[:top_k]
+            return [
+                {'index': id, 'similarity': similarity}
+                for id, similarity in index.search(query_embedding, top_k)
+            ]
             
         except Exception as e:
             logger.error(f"Error finding similar documents: {e}")
             return []
+    
+    async def compute_similarity_matrix(self, queries: Union[List[List[float]], np.ndarray, VectorIndex],
+                                        corpus: Union[List[List[float]], np.ndarray, VectorIndex]) -> np.ndarray:
+        """Cosine similarity of every query against every corpus embedding, shape (queries, corpus)
+
+        Computed in blocks of ``similarity_block_size`` queries off the event loop.
+        """
+        return await self._run_similarity('similarity_matrix', similarity.similarity_matrix, queries, corpus)
+    
+    async def find_near_duplicates(self, embeddings: Union[List[List[float]], np.ndarray, VectorIndex],
+                                   threshold: float = None, group: bool = False) -> List[Any]:
+        """Pairs of embeddings at least ``threshold`` similar (default ``near_duplicate_threshold``)
+
+        Returns ``{'first', 'second', 'similarity'}`` dicts, most similar
+        first, or with ``group`` the lists of embeddings linked by such
+        pairs, largest first. Embeddings are named by id for a
+        ``VectorIndex`` or ``EmbeddingStore`` and by position otherwise.
+        """
+        if group:
+            return await self._run_similarity('near_duplicates', similarity.duplicate_groups, embeddings, threshold)
+        
+        pairs = await self._run_similarity('near_duplicates', similarity.near_duplicates, embeddings, threshold)
+        name = (lambda row: row) if pairs.ids is None else pairs.ids.__getitem__
+        return [
+            {'first': name(first), 'second': name(second), 'similarity': score}
+            for first, second, score in zip(pairs.first.tolist(), pairs.second.tolist(), pairs.similarity.tolist())
+        ]
+    
+    async def cluster_embeddings(self, embeddings: Union[List[List[float]], np.ndarray, VectorIndex],
+                                 n_clusters: int = None, method: str = 'kmeans', threshold: float = None,
+                                 linkage: str = 'average') -> Dict[str, Any]:
+        """Group embeddings into themes with k-means or agglomerative clustering
+
+        ``kmeans`` needs ``n_clusters``; ``agglomerative`` is cut at
+        ``n_clusters`` or at a similarity ``threshold`` (see
+        ``services.similarity.agglomerative`` for the linkages). Clusters
+        are numbered by decreasing size and ``members`` lists each one's
+        ids (or positions).
+        """
+        if method == 'kmeans':
+            if not n_clusters:
+                raise ValueError("k-means needs n_clusters")
+            cluster = functools.partial(similarity.kmeans, n_clusters=n_clusters)
+        elif method == 'agglomerative':
+            cluster = functools.partial(similarity.agglomerative, n_clusters=n_clusters, threshold=threshold,
+                                        linkage=linkage)
+        else:
+            raise ValueError(f"Unknown clustering method: {method}, expected kmeans or agglomerative")
+        
+        result = await self._run_similarity('clustering', cluster, embeddings)
+        order = np.argsort(result.labels, kind='stable')
+        members = np.split(order, np.cumsum(result.sizes)[:-1]) if len(order) else []
+        return {
+            'labels': result.labels,
+            'sizes': result.sizes,
+            'centroids': result.centroids,
+            'members': [rows.tolist() if result.ids is None else [result.ids[row] for row in rows]
+                        for rows in members],
+        }
+    
+    async def _run_similarity(self, stage: str, fn, *args) -> Any:
+        """Run a NumPy-bound similarity job off the event loop"""
+        loop = asyncio.get_running_loop()
+        with metrics.timer('stage_seconds', stage=stage):
+            return await loop.run_in_executor(None, fn, *args)
@@ -0,0 +1,229 @@
+"""
+Append-only, memory-mapped embedding store with zero-copy reads
+"""
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+DTYPES = {'float32': np.float32, 'float16': np.float16}
+
+
+class EmbeddingStore:
+    """Embeddings kept on disk as one row-major matrix plus an id index
+
+    The directory holds up to four files:
+
+    * ``meta.json``: dimension and dtype
+    * ``vectors.bin``: raw rows, appended in write order
+    * ``ids.txt``: one id per line; line ``n`` names row ``n``
+    * ``deleted.txt``: numbers of rows whose ids were deleted, one per line
+
+    Reads return ``np.memmap`` views, so any number of processes can open
+    the same store and share its pages through the OS page cache instead
+    of each loading the corpus into RAM. There is a single writer; readers
+    call ``refresh()`` to see rows appended since they opened the store.
+    Appending an id that already exists points it at the new row;
+    ``delete()`` tombstones an id's row until the id is appended again.
+    """
+
+    def __init__(self, path: str = None, dimension: int = None, dtype: str = None,
+                 readonly: bool = False):
+        self.path = Path(path or settings.embedding_store_path)
+        self.readonly = readonly
+        self._lock = threading.Lock()
+        self._rows: Dict[str, int] = {}
+        self._ids: List[str] = []
+        self._map: Optional[np.memmap] = None
+        self._ids_offset = 0
+        self._deleted_offset = 0
+
+        meta_path = self.path / 'meta.json'
+        if meta_path.exists():
+            meta = json.loads(meta_path.read_text())
+            self.dimension = meta['dimension']
+            self.dtype = np.dtype(meta['dtype'])
+            if dimension and dimension != self.dimension:
+                raise ValueError(f"Store at {self.path} has dimension {self.dimension}, not {dimension}")
+        else:
+            if readonly:
+                raise FileNotFoundError(f"No embedding store at {self.path}")
+            self.dimension = dimension
+            self.dtype = np.dtype(DTYPES[dtype or settings.embedding_store_dtype])
+            if dimension:
+                self._write_meta()
+        self.refresh()
+        if not readonly:
+            self._truncate_partial_writes()
+
+    def _truncate_partial_writes(self):
+        """Drop rows or ids left behind by a writer that died mid-append"""
+        ids_path = self.path / 'ids.txt'
+        if ids_path.exists() and os.path.getsize(ids_path) > self._ids_offset:
+            os.truncate(ids_path, self._ids_offset)
+        deleted_path = self.path / 'deleted.txt'
+        if deleted_path.exists() and os.path.getsize(deleted_path) > self._deleted_offset:
+            os.truncate(deleted_path, self._deleted_offset)
+        vectors_path = self.path / 'vectors.bin'
+        if self.dimension and vectors_path.exists():
+            expected = len(self._ids) * self._row_bytes
+            if os.path.getsize(vectors_path) > expected:
+                logger.warning(f"Truncating unindexed rows in {vectors_path}")
+                os.truncate(vectors_path, expected)
+
+    def _write_meta(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        meta = {'dimension': self.dimension, 'dtype': self.dtype.name}
+        tmp = self.path / 'meta.json.tmp'
+        tmp.write_text(json.dumps(meta))
+        os.replace(tmp, self.path / 'meta.json')
+
+    @property
+    def _row_bytes(self) -> int:
+        return self.dimension * self.dtype.itemsize
+
+    def refresh(self):
+        """Pick up rows appended since the store was opened or last refreshed"""
+        with self._lock:
+            ids_path = self.path / 'ids.txt'
+            if ids_path.exists():
+                with open(ids_path, 'rb') as f:
+                    f.seek(self._ids_offset)
+                    data = f.read()
+                # Only complete lines count; the writer may be mid-append
+                end = data.rfind(b'\n') + 1
+                for line in data[:end].splitlines():
+                    id = line.decode('utf-8')
+                    self._rows[id] = len(self._ids)
+                    self._ids.append(id)
+                self._ids_offset += end
+            # Read after ids.txt, so every deleted row is already known
+            deleted_path = self.path / 'deleted.txt'
+            if deleted_path.exists():
+                with open(deleted_path, 'rb') as f:
+                    f.seek(self._deleted_offset)
+                    data = f.read()
+                end = data.rfind(b'\n') + 1
+                for line in data[:end].splitlines():
+                    self._forget(int(line))
+                self._deleted_offset += end
+            self._remap()
+
+    def _forget(self, row: int):
+        """Drop the id of a deleted row, unless it was appended again since"""
+        id = self._ids[row]
+        if self._rows.get(id) == row:
+            del self._rows[id]
+
+    def _remap(self):
+        """Map every complete row that has a matching id"""
+        if not self.dimension or not self._ids:
+            self._map = None
+            return
+        if self._map is not None and len(self._map) == len(self._ids):
+            return
+        vectors_path = self.path / 'vectors.bin'
+        available = os.path.getsize(vectors_path) // self._row_bytes
+        rows = min(available, len(self._ids))
+        # Old views keep their own mapping alive, so remapping never invalidates them
+        self._map = np.memmap(vectors_path, dtype=self.dtype, mode='r', shape=(rows, self.dimension))
+
+    def __len__(self) -> int:
+        return 0 if self._map is None else len(self._map)
+
+    def __contains__(self, id: str) -> bool:
+        row = self._rows.get(id)
+        return row is not None and row < len(self)
+
+    def append(self, ids: Sequence[str], vectors) -> np.ndarray:
+        """Append rows and return a zero-copy view of them"""
+        if self.readonly:
+            raise RuntimeError(f"Embedding store at {self.path} was opened read-only")
+        ids = list(ids)
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} embeddings")
+        if any('\n' in id for id in ids):
+            raise ValueError("Embedding ids cannot contain newlines")
+
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vectors.shape[1]
+                self._write_meta()
+            elif vectors.shape[1] != self.dimension:
+                raise ValueError(f"Expected dimension {self.dimension}, got {vectors.shape[1]}")
+
+            start = len(self._ids)
+            # Vectors first, then ids: readers only map rows that have an id
+            with open(self.path / 'vectors.bin', 'ab') as f:
+                f.write(vectors.tobytes())
+            payload = ''.join(f"{id}\n" for id in ids).encode('utf-8')
+            with open(self.path / 'ids.txt', 'ab') as f:
+                f.write(payload)
+            self._ids_offset += len(payload)
+            for offset, id in enumerate(ids):
+                self._rows[id] = start + offset
+            self._ids.extend(ids)
+            self._remap()
+            return self._map[start:start + len(ids)]
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """Tombstone the current rows of ``ids``; returns how many existed"""
+        if self.readonly:
+            raise RuntimeError(f"Embedding store at {self.path} was opened read-only")
+        with self._lock:
+            rows = [self._rows[id] for id in dict.fromkeys(ids) if id in self._rows]
+            if not rows:
+                return 0
+            payload = ''.join(f"{row}\n" for row in rows).encode('utf-8')
+            with open(self.path / 'deleted.txt', 'ab') as f:
+                f.write(payload)
+            self._deleted_offset += len(payload)
+            for row in rows:
+                self._forget(row)
+            return len(rows)
+
+    def get(self, id: str) -> Optional[np.ndarray]:
+        """Zero-copy view of the row stored under ``id``"""
+        row = self._rows.get(id)
+        if row is None or row >= len(self):
+            return None
+        return self._map[row]
+
+    def get_many(self, ids: Iterable[str]) -> np.ndarray:
+        """Rows for ``ids`` gathered into one matrix (this copies)"""
+        return self._map[self.rows(ids)]
+
+    def rows(self, ids: Iterable[str]) -> np.ndarray:
+        """Row numbers of ``ids`` for use with ``matrix()``"""
+        try:
+            return np.fromiter((self._rows[id] for id in ids), dtype=np.int64)
+        except KeyError as e:
+            raise KeyError(f"Unknown embedding id: {e.args[0]}") from None
+
+    def live_rows(self) -> np.ndarray:
+        """Row numbers holding each live id's latest vector, in row order"""
+        size = len(self)
+        return np.array(sorted(row for row in self._rows.values() if row < size), dtype=np.int64)
+
+    def matrix(self) -> np.ndarray:
+        """Zero-copy view of every row in write order"""
+        if self._map is None:
+            return np.empty((0, self.dimension or 0), dtype=self.dtype)
+        return self._map
+
+    @property
+    def ids(self) -> List[str]:
+        """Ids in row order (superseded and deleted ids still name their old rows)"""
+        return self._ids[:len(self)]
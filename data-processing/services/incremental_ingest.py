@@ -0,0 +1,347 @@
+"""
+Incremental re-ingestion: a manifest of content and chunk hashes so only
+changed documents and chunks are reprocessed
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def content_hash(document: Dict[str, Any]) -> str:
+    """Hash of a document's raw content and metadata"""
+    digest = hashlib.sha256()
+    content = document.get('content', '')
+    digest.update(content if isinstance(content, bytes) else str(content).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(json.dumps(document.get('metadata', {}), sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def chunk_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class IngestManifest:
+    """SQLite record of what was ingested: document id -> content hash -> chunks
+
+    Each chunk row holds its position, hash and the vector id it was stored
+    under, so a re-run can tell which chunks are already in the vector store.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = Path(path or settings.ingest_manifest_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            "id TEXT PRIMARY KEY, content_hash TEXT NOT NULL, analysis TEXT, updated_at TEXT NOT NULL)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            "document_id TEXT NOT NULL, position INTEGER NOT NULL, chunk_hash TEXT NOT NULL, "
+            "vector_id TEXT NOT NULL, PRIMARY KEY (document_id, position))"
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+
+    def content_hashes(self, ids: Iterable[str]) -> Dict[str, str]:
+        """Stored content hash of each known id"""
+        ids = list(ids)
+        found = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                part = ids[start:start + 500]
+                placeholders = ','.join('?' * len(part))
+                found.update(self._db.execute(
+                    f"SELECT id, content_hash FROM documents WHERE id IN ({placeholders})", part
+                ).fetchall())
+        return found
+
+    def chunks(self, document_id: str) -> List[Tuple[str, str]]:
+        """(chunk hash, vector id) of a document's chunks in order"""
+        with self._lock:
+            return self._db.execute(
+                "SELECT chunk_hash, vector_id FROM chunks WHERE document_id = ? ORDER BY position",
+                (document_id,)
+            ).fetchall()
+
+    def document_ids(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._db.execute("SELECT id FROM documents")]
+
+    def analysis(self, document_id: str) -> Optional[Any]:
+        with self._lock:
+            row = self._db.execute("SELECT analysis FROM documents WHERE id = ?", (document_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+    def record(self, entries: List[Tuple[str, str, Any, List[Tuple[str, str]]]]):
+        """Replace documents' rows: (id, content hash, analysis, [(chunk hash, vector id)])"""
+        now = datetime.now().isoformat()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for document_id, digest, analysis, chunks in entries:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO documents (id, content_hash, analysis, updated_at) "
+                        "VALUES (?, ?, ?, ?)",
+                        (document_id, digest, json.dumps(analysis, default=str), now)
+                    )
+                    self._db.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+                    self._db.executemany(
+                        "INSERT INTO chunks (document_id, position, chunk_hash, vector_id) VALUES (?, ?, ?, ?)",
+                        [(document_id, position, hash, vector_id)
+                         for position, (hash, vector_id) in enumerate(chunks)]
+                    )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def remove(self, document_ids: Iterable[str]):
+        with self._lock:
+            self._db.execute("BEGIN")
+            for document_id in document_ids:
+                self._db.execute("DELETE FROM documents WHERE id = ?", (document_id,))
+                self._db.execute("DELETE FROM chunks WHERE document_id = ?", (document_id,))
+            self._db.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class IncrementalIngestor:
+    """Re-ingests a document set, doing work proportional to what changed
+
+    Documents are compared by content hash against the manifest and
+    unchanged ones are skipped without being read further. Changed
+    documents are cleaned and split with ``TextProcessor.chunk_tokens``;
+    chunks whose hash is already stored for that document keep their
+    vector, and only new chunks are embedded, analyzed for the lexical
+    index and written. Chunks that disappeared are deleted from the vector
+    store, the lexical index and the embedding store. Chunk vectors are stored under
+    ``"<document id>#<chunk hash prefix>"`` with the document's metadata
+    plus ``document_id``, ``chunk`` (position), ``start`` and ``end``.
+    """
+
+    def __init__(self, text_processor, embedding_service, vector_service, nlp_analyzer=None,
+                 manifest: IngestManifest = None, lexical_index=None, embedding_store=None,
+                 batch_size: int = None):
+        self.text_processor = text_processor
+        self.embedding_service = embedding_service
+        self.vector_service = vector_service
+        self.nlp_analyzer = nlp_analyzer
+        self.manifest = manifest if manifest is not None else IngestManifest()
+        self.lexical_index = lexical_index
+        self.embedding_store = embedding_store
+        self.batch_size = max(1, batch_size or settings.batch_size)
+
+    async def run(self, documents: Iterable[Dict[str, Any]], delete_missing: bool = False) -> Dict[str, Any]:
+        """Bring the stores in line with ``documents`` and report what was done
+
+        With ``delete_missing``, documents in the manifest but not in the
+        input are treated as deleted, so pass the complete set.
+        """
+        started = time.perf_counter()
+        report = {
+            'documents': {'new': 0, 'changed': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0},
+            'chunks': {'added': 0, 'kept': 0, 'removed': 0},
+            'embedded': 0,
+            'errors': {},
+        }
+        seen = set()
+        pending: List[Dict[str, Any]] = []
+        for document in documents:
+            document_id = document.get('id')
+            if document_id is None:
+                raise ValueError("Incremental ingest needs an 'id' on every document")
+            document_id = str(document_id)
+            if document_id in seen:
+                continue
+            seen.add(document_id)
+            pending.append(document)
+            if len(pending) == self.batch_size:
+                await self._process_batch(pending, report)
+                pending = []
+        if pending:
+            await self._process_batch(pending, report)
+
+        if delete_missing:
+            missing = [document_id for document_id in self.manifest.document_ids() if document_id not in seen]
+            if missing:
+                await self._delete_documents(missing, report)
+
+        report['seconds'] = time.perf_counter() - started
+        for outcome, count in report['documents'].items():
+            metrics.inc('incremental_documents_total', count, outcome=outcome)
+        logger.info(f"Incremental ingest: {report['documents']}, chunks {report['chunks']}, "
+                    f"{report['embedded']} embedded in {report['seconds']:.2f}s")
+        return report
+
+    async def _process_batch(self, documents: List[Dict[str, Any]], report: Dict[str, Any]):
+        digests = {str(document['id']): content_hash(document) for document in documents}
+        stored = self.manifest.content_hashes(digests)
+
+        changed = []
+        for document in documents:
+            document_id = str(document['id'])
+            if stored.get(document_id) == digests[document_id]:
+                report['documents']['unchanged'] += 1
+            else:
+                changed.append(document)
+        if not changed:
+            return
+
+        # Plan each changed document: chunk it and match chunks against the manifest
+        plans = []
+        for document in changed:
+            document_id = str(document['id'])
+            try:
+                text = self.text_processor.clean_text(await self.text_processor.extract_text(document))
+                chunks = self.text_processor.chunk_tokens(text)
+            except Exception as e:
+                logger.error(f"Error preparing document {document_id}: {e}")
+                report['documents']['failed'] += 1
+                report['errors'][document_id] = str(e)
+                continue
+            plans.append(self._plan(document, document_id, digests[document_id], document_id in stored,
+                                    text, chunks))
+
+        # One batched embedding call for every new chunk of the batch
+        new_chunks = [(plan, position) for plan in plans for position in plan['new']]
+        texts = [plan['chunks'][position].text for plan, position in new_chunks]
+        embed_task = self.embedding_service.embed_chunks([plan['chunks'][position] for plan, position in new_chunks])
+        tasks = [embed_task]
+        if self.nlp_analyzer is not None:
+            tasks.append(self.nlp_analyzer.analyze_batch_async([plan['text'] for plan in plans],
+                                                               return_exceptions=True))
+        if self.lexical_index is not None:
+            tasks.append(self.text_processor.preprocess_batch_async(texts))
+        outputs = await asyncio.gather(*tasks)
+        embeddings = outputs[0]
+        analyses = outputs[1] if self.nlp_analyzer is not None else [None] * len(plans)
+        tokens = outputs[-1] if self.lexical_index is not None else None
+
+        # Write new chunks before removing vanished ones, so an interrupted
+        # batch never leaves a document with fewer chunks than either version
+        if new_chunks:
+            vector_ids = [plan['vector_ids'][position] for plan, position in new_chunks]
+            await self.vector_service.store_documents(
+                contents=texts,
+                embeddings=embeddings,
+                metadatas=[self._chunk_metadata(plan, position) for plan, position in new_chunks],
+                ids=vector_ids
+            )
+            if self.lexical_index is not None:
+                self.lexical_index.add_many(vector_ids, token_lists=tokens)
+            if self.embedding_store is not None:
+                self.embedding_store.append(vector_ids, np.asarray(embeddings, dtype=np.float32))
+        kept = [(plan, position) for plan in plans for position in plan['kept']]
+        if kept:
+            self.vector_service.update_metadata(
+                [plan['vector_ids'][position] for plan, position in kept],
+                [self._chunk_metadata(plan, position) for plan, position in kept]
+            )
+        removed = [vector_id for plan in plans for vector_id in plan['removed']]
+        if removed:
+            await self.vector_service.delete_documents(removed)
+            if self.lexical_index is not None:
+                self.lexical_index.delete(removed)
+            if self.embedding_store is not None:
+                self.embedding_store.delete(removed)
+
+        entries = []
+        for plan, analysis in zip(plans, analyses):
+            if isinstance(analysis, BaseException):
+                logger.error(f"Error analyzing document {plan['id']}: {analysis}")
+                analysis = None
+            entries.append((plan['id'], plan['digest'], analysis,
+                            list(zip(plan['hashes'], plan['vector_ids']))))
+            report['documents']['changed' if plan['known'] else 'new'] += 1
+            report['chunks']['added'] += len(plan['new'])
+            report['chunks']['kept'] += len(plan['kept'])
+            report['chunks']['removed'] += len(plan['removed'])
+        report['embedded'] += len(new_chunks)
+        # The manifest is written last, so a crash before this point redoes the batch
+        self.manifest.record(entries)
+
+    def _plan(self, document: Dict[str, Any], document_id: str, digest: str, known: bool,
+              text: str, chunks) -> Dict[str, Any]:
+        """Match a document's chunks against the ones stored for it last time"""
+        previous = self.manifest.chunks(document_id)
+        # hash -> vector ids stored for it, consumed in order for repeated chunks
+        available: Dict[str, List[str]] = {}
+        for hash, vector_id in previous:
+            available.setdefault(hash, []).append(vector_id)
+
+        hashes, vector_ids, new, kept = [], [], [], []
+        for position, chunk in enumerate(chunks):
+            hashes.append(chunk_hash(chunk.text))
+            reusable = available.get(hashes[-1])
+            if reusable:
+                vector_ids.append(reusable.pop(0))
+                kept.append(position)
+            else:
+                vector_ids.append(None)
+                new.append(position)
+
+        # New chunks get ids from their hash; a repeated chunk gets a suffix
+        used = {vector_id for vector_id in vector_ids if vector_id is not None}
+        for position in new:
+            base = f"{document_id}#{hashes[position][:16]}"
+            vector_id, occurrence = base, 0
+            while vector_id in used:
+                occurrence += 1
+                vector_id = f"{base}.{occurrence}"
+            used.add(vector_id)
+            vector_ids[position] = vector_id
+
+        removed = [vector_id for ids in available.values() for vector_id in ids]
+        return {
+            'id': document_id, 'document': document, 'digest': digest, 'text': text, 'known': known,
+            'chunks': chunks, 'hashes': hashes, 'vector_ids': vector_ids, 'new': new, 'kept': kept,
+            'removed': removed
+        }
+
+    def _chunk_metadata(self, plan: Dict[str, Any], position: int) -> Dict[str, Any]:
+        chunk = plan['chunks'][position]
+        return {
+            **plan['document'].get('metadata', {}),
+            'document_id': plan['id'],
+            'chunk': position,
+            'start': chunk.start,
+            'end': chunk.end,
+        }
+
+    async def _delete_documents(self, document_ids: List[str], report: Dict[str, Any]):
+        vector_ids = [vector_id for document_id in document_ids
+                      for _, vector_id in self.manifest.chunks(document_id)]
+        if vector_ids:
+            await self.vector_service.delete_documents(vector_ids)
+            if self.lexical_index is not None:
+                self.lexical_index.delete(vector_ids)
+            if self.embedding_store is not None:
+                self.embedding_store.delete(vector_ids)
+        self.manifest.remove(document_ids)
+        report['documents']['deleted'] += len(document_ids)
+        report['chunks']['removed'] += len(vector_ids)
@@ -0,0 +1,371 @@
+"""
+Staged ingest pipeline for batched, concurrent document processing
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import (
+    List, Dict, Any, Optional, Union, Tuple, Iterable, Iterator, AsyncIterable, AsyncIterator
+)
+
+import numpy as np
+
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Sentinel that tells a stage worker there is no more work
+_STOP = object()
+
+# How many batches per worker may be read ahead of the caller in stream()
+IN_FLIGHT_BATCHES_PER_WORKER = 3
+
+
+async def _aiter(source: Union[Iterable, AsyncIterable]) -> AsyncIterator:
+    """Iterate a sync or async iterable asynchronously"""
+    if hasattr(source, '__aiter__'):
+        async for item in source:
+            yield item
+    else:
+        for item in source:
+            yield item
+
+
+def read_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """Lazily yield one document per non-empty line of a JSONL file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class IngestCheckpoint:
+    """Append-only record of document ids that finished ingesting
+
+    Ids are flushed as each batch completes, so an interrupted ingest can be
+    resumed by streaming the same input with the same checkpoint file.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._done = set()
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._done.update(line.rstrip('\n') for line in f if line.strip())
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def __contains__(self, document_id) -> bool:
+        return document_id is not None and str(document_id) in self._done
+
+    def __len__(self) -> int:
+        return len(self._done)
+
+    def record(self, document_ids: Iterable[Any]):
+        ids = [str(document_id) for document_id in document_ids]
+        if not ids:
+            return
+        self._file.write(''.join(f"{document_id}\n" for document_id in ids))
+        self._file.flush()
+        self._done.update(ids)
+
+    def close(self):
+        self._file.close()
+
+
+class _Batch:
+    """A micro-batch of documents moving through the pipeline"""
+
+    __slots__ = ('start', 'documents', 'texts', 'embeddings', 'analyses', 'tokens', 'vector_ids',
+                 'processed_at', 'errors')
+
+    def __init__(self, start: int, documents: List[Dict[str, Any]]):
+        self.start = start
+        self.documents = documents
+        self.texts: List[Optional[str]] = [None] * len(documents)
+        self.embeddings: List[Any] = [None] * len(documents)
+        self.analyses: List[Any] = [None] * len(documents)
+        self.tokens: List[Optional[List[str]]] = [None] * len(documents)
+        self.vector_ids: List[Optional[str]] = [None] * len(documents)
+        self.processed_at: Optional[str] = None
+        # Position within the batch -> exception raised for that document
+        self.errors: Dict[int, BaseException] = {}
+
+    def live(self) -> List[int]:
+        """Positions of documents that have not failed yet"""
+        return [i for i in range(len(self.documents)) if i not in self.errors]
+
+    def fail_all(self, error: BaseException):
+        for i in self.live():
+            self.errors[i] = error
+
+
+class IngestPipeline:
+    """Micro-batched document pipeline with overlapping stages
+
+    Documents are grouped into batches of ``batch_size`` and flow through
+    three stages connected by bounded queues:
+
+    * prepare: extract and clean text
+    * enrich: one batched embedding request, with NLP analysis (and
+      preprocessing for the lexical index, when one is configured) alongside
+    * store: one bulk upsert into the vector store, plus an append to the
+      embedding store and the lexical index when they are configured
+
+    Embeddings travel as rows of each batch's float32 matrix. With an
+    embedding store the results hold zero-copy views into its memory map
+    instead, so finished batches do not keep their vectors in RAM.
+
+    Each queue holds at most ``max_concurrency`` batches, so a slow stage
+    blocks the one feeding it instead of letting work pile up in memory.
+    """
+
+    def __init__(self, text_processor, embedding_service, vector_service, nlp_analyzer,
+                 batch_size: int = None, max_concurrency: int = None, embedding_store=None,
+                 lexical_index=None):
+        self.text_processor = text_processor
+        self.embedding_service = embedding_service
+        self.vector_service = vector_service
+        self.nlp_analyzer = nlp_analyzer
+        self.embedding_store = embedding_store
+        self.lexical_index = lexical_index
+        self.batch_size = max(1, batch_size or settings.batch_size)
+        self.max_concurrency = max(1, max_concurrency or settings.max_concurrent_requests)
+
+    async def run(self, documents: List[Dict[str, Any]]) -> List[Union[Dict[str, Any], BaseException]]:
+        """Process documents and return one result per input, in input order
+
+        A failed document's slot holds the exception that stopped it.
+        """
+        return [result async for _, result in self.stream(documents)]
+
+    async def stream(self, documents: Union[Iterable[Dict[str, Any]], AsyncIterable[Dict[str, Any]]],
+                     checkpoint: Optional["IngestCheckpoint"] = None
+                     ) -> AsyncIterator[Tuple[Dict[str, Any], Union[Dict[str, Any], BaseException]]]:
+        """Process documents from any sync or async iterable
+
+        Yields ``(document, result)`` pairs in input order as batches finish,
+        where ``result`` is the processed document or the exception that
+        stopped it. The input is pulled lazily and only a fixed window of
+        batches is held at once, so memory stays flat however long the input
+        is. Documents whose id is already in ``checkpoint`` are skipped, and
+        ids of successfully stored documents are recorded as they are yielded.
+        """
+        workers = self.max_concurrency
+        # Batches read from the input but not yet yielded to the caller
+        window = asyncio.Semaphore(IN_FLIGHT_BATCHES_PER_WORKER * workers)
+        prepare_queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+        enrich_queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+        store_queue: asyncio.Queue = asyncio.Queue(maxsize=workers)
+        # Finished batches in input order; the window bounds its size
+        ready: asyncio.Queue = asyncio.Queue()
+        finished: Dict[int, _Batch] = {}
+        next_start = 0
+
+        async def produce():
+            start = 0
+            pending: List[Dict[str, Any]] = []
+            try:
+                async for doc in _aiter(documents):
+                    if checkpoint is not None and doc.get('id') in checkpoint:
+                        continue
+                    pending.append(doc)
+                    if len(pending) == self.batch_size:
+                        await window.acquire()
+                        await prepare_queue.put(_Batch(start, pending))
+                        start += len(pending)
+                        pending = []
+                if pending:
+                    await window.acquire()
+                    await prepare_queue.put(_Batch(start, pending))
+            finally:
+                await prepare_queue.put(_STOP)
+
+        async def collect(batch: _Batch):
+            nonlocal next_start
+            finished[batch.start] = batch
+            # Release batches strictly in input order
+            while next_start in finished:
+                done = finished.pop(next_start)
+                next_start += len(done.documents)
+                ready.put_nowait(done)
+
+        async def run_stages():
+            try:
+                # Preparation is CPU-bound on the event loop, so one worker is
+                # enough; the I/O-bound stages get the full concurrency budget.
+                await asyncio.gather(
+                    self._stage(self._prepare, prepare_queue, enrich_queue, 1),
+                    self._stage(self._enrich, enrich_queue, store_queue, workers),
+                    self._stage(self._store, store_queue, None, workers, on_done=collect),
+                )
+            finally:
+                ready.put_nowait(_STOP)
+
+        tasks = [asyncio.ensure_future(produce()), asyncio.ensure_future(run_stages())]
+        try:
+            while True:
+                batch = await ready.get()
+                if batch is _STOP:
+                    break
+                if checkpoint is not None:
+                    checkpoint.record(
+                        batch.documents[i].get('id') for i in batch.live()
+                        if batch.documents[i].get('id') is not None
+                    )
+                for i, doc in enumerate(batch.documents):
+                    error = batch.errors.get(i)
+                    yield doc, error if error is not None else self._build_result(batch, i)
+                window.release()
+            # Surface input errors such as a malformed line in the source
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _stage(self, handler, inbox: asyncio.Queue, outbox: Optional[asyncio.Queue],
+                     workers: int, on_done=None):
+        """Run ``workers`` copies of a stage until the inbox is drained"""
+        stops_seen = 0
+        name = handler.__name__.lstrip('_')
+        depth = metrics.gauge('pipeline_queue_depth', queue=name)
+
+        async def worker():
+            nonlocal stops_seen
+            while True:
+                batch = await inbox.get()
+                depth.set(inbox.qsize())
+                if batch is _STOP:
+                    stops_seen += 1
+                    # Wake the next sibling so every worker of this stage exits
+                    if stops_seen < workers:
+                        await inbox.put(_STOP)
+                    return
+                try:
+                    with metrics.timer('pipeline_stage_seconds', stage=name):
+                        await handler(batch)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {handler.__name__} failed for batch at {batch.start}: {e}")
+                    batch.fail_all(e)
+                if on_done is not None:
+                    await on_done(batch)
+                if outbox is not None:
+                    await outbox.put(batch)
+
+        await asyncio.gather(*(worker() for _ in range(workers)))
+        if outbox is not None:
+            await outbox.put(_STOP)
+
+    async def _prepare(self, batch: _Batch):
+        """Extract text for every document in the batch, then clean it in one call"""
+        extracted = []
+        for i, doc in enumerate(batch.documents):
+            try:
+                extracted.append((i, await self.text_processor.extract_text(doc)))
+            except Exception as e:
+                batch.errors[i] = e
+        if extracted:
+            cleaned = self.text_processor.clean_texts([content for _, content in extracted])
+            for (i, _), text in zip(extracted, cleaned):
+                batch.texts[i] = text
+
+    async def _enrich(self, batch: _Batch):
+        """Embed the batch in one request while NLP analysis runs alongside"""
+        live = batch.live()
+        if not live:
+            return
+        texts = [batch.texts[i] for i in live]
+
+        async def analyze_all():
+            with metrics.timer('stage_seconds', stage='analyze'):
+                # One nlp.pipe pass over the batch; failed texts come back as exceptions
+                return await self.nlp_analyzer.analyze_batch_async(texts, return_exceptions=True)
+
+        embed_task = self.embedding_service.generate_embeddings_batch(texts)
+        analyze_task = analyze_all()
+        tasks = [embed_task, analyze_task]
+        if self.lexical_index is not None:
+            tasks.append(self.text_processor.preprocess_batch_async(texts))
+        embeddings, analyses, *tokens = await asyncio.gather(*tasks, return_exceptions=True)
+
+        if isinstance(embeddings, BaseException):
+            raise embeddings
+        if isinstance(analyses, BaseException):
+            raise analyses
+        if tokens and isinstance(tokens[0], BaseException):
+            raise tokens[0]
+        if tokens:
+            for i, document_tokens in zip(live, tokens[0]):
+                batch.tokens[i] = document_tokens
+        for i, embedding, analysis in zip(live, embeddings, analyses):
+            if isinstance(analysis, BaseException):
+                batch.errors[i] = analysis
+                continue
+            batch.embeddings[i] = embedding
+            batch.analyses[i] = analysis
+
+    async def _store(self, batch: _Batch):
+        """Write all surviving documents of the batch in one bulk upsert
+
+        The vector store is written first and is the record of what was
+        stored. The lexical index and embedding store are secondary: if
+        either write fails the documents are still stored and reported as
+        processed, and the failure is logged and counted in
+        ``index_write_failures_total``.
+        """
+        live = batch.live()
+        if not live:
+            return
+        batch.processed_at = datetime.now().isoformat()
+        embeddings = np.stack([batch.embeddings[i] for i in live])
+        with metrics.timer('stage_seconds', stage='vector_write'):
+            vector_ids = await self.vector_service.store_documents(
+                contents=[batch.texts[i] for i in live],
+                embeddings=embeddings,
+                metadatas=[
+                    {
+                        **batch.documents[i].get('metadata', {}),
+                        'analysis': batch.analyses[i],
+                        'processed_at': batch.processed_at
+                    }
+                    for i in live
+                ]
+            )
+        for i, vector_id in zip(live, vector_ids):
+            batch.vector_ids[i] = vector_id
+
+        if self.lexical_index is not None:
+            try:
+                with metrics.timer('stage_seconds', stage='lexical_index'):
+                    self.lexical_index.add_many(vector_ids, token_lists=[batch.tokens[i] for i in live])
+            except Exception as e:
+                logger.error(f"Lexical indexing failed for batch at {batch.start}; "
+                             f"{len(live)} stored documents are missing from keyword search: {e}")
+                metrics.inc('index_write_failures_total', stage='lexical_index')
+
+        if self.embedding_store is not None:
+            try:
+                with metrics.timer('stage_seconds', stage='embedding_store'):
+                    views = self.embedding_store.append(vector_ids, embeddings)
+            except Exception as e:
+                logger.error(f"Embedding store write failed for batch at {batch.start}; "
+                             f"{len(live)} stored documents are missing from it: {e}")
+                metrics.inc('index_write_failures_total', stage='embedding_store')
+            else:
+                for i, view in zip(live, views):
+                    batch.embeddings[i] = view
+
+    def _build_result(self, batch: _Batch, i: int) -> Dict[str, Any]:
+        return {
+            'id': batch.vector_ids[i],
+            'document_id': batch.documents[i].get('id'),
+            'content': batch.texts[i],
+            'embedding': batch.embeddings[i],
+            'analysis': batch.analyses[i],
+            'metadata': batch.documents[i].get('metadata', {}),
+            'processed_at': batch.processed_at
+        }
@@ -0,0 +1,368 @@
+"""
+Incremental inverted index with BM25 scoring and rank fusion for hybrid search
+"""
+
+import json
+import logging
+import os
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+# Tokens with no word character (punctuation left by the tokenizer) are not indexed
+_WORD = re.compile(r'\w')
+
+
+def encode_varints(values: Iterable[int], out: bytearray = None) -> bytearray:
+    """Append non-negative integers as LEB128 varints (7 bits per byte)"""
+    out = bytearray() if out is None else out
+    for value in values:
+        while value >= 0x80:
+            out.append((value & 0x7F) | 0x80)
+            value >>= 7
+        out.append(value)
+    return out
+
+
+def decode_varints(data) -> np.ndarray:
+    """Decode a buffer of LEB128 varints into an int64 array, without a Python loop"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not len(raw):
+        return np.empty(0, dtype=np.int64)
+    ends = np.flatnonzero(raw < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    # Byte position within its varint, and so its shift
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(raw)) - starts[group]) * 7
+    parts = (raw & 0x7F).astype(np.int64) << shifts
+    return np.add.reduceat(parts, starts)
+
+
+class _Postings:
+    """Posting list of one term: (doc-number gap, term frequency) varint pairs
+
+    Documents are numbered in insertion order, so new postings always go at
+    the end and gaps stay small and positive.
+    """
+
+    __slots__ = ('data', 'last_doc', 'count')
+
+    def __init__(self):
+        self.data = bytearray()
+        self.last_doc = -1
+        self.count = 0
+
+    def append(self, doc: int, tf: int):
+        encode_varints((doc - self.last_doc, tf), self.data)
+        self.last_doc = doc
+        self.count += 1
+
+    def decode(self) -> Tuple[np.ndarray, np.ndarray]:
+        values = decode_varints(self.data)
+        return np.cumsum(values[0::2]) - 1, values[1::2]
+
+
+class BM25Index:
+    """Inverted index over preprocessed tokens, scored with Okapi BM25
+
+    ``analyzer`` turns text into index terms; pass
+    ``TextProcessor.preprocess_text`` so documents and queries go through
+    the same cleaning, stopword removal and lemmatization. Documents can be
+    added as raw text or as tokens that were already analyzed (e.g. by
+    ``preprocess_batch_async``).
+
+    Postings are delta + varint encoded bytearrays, a few bytes per
+    posting instead of a Python tuple. Documents are addressed by string id;
+    re-adding an id replaces it, and deleted documents are masked out of
+    scoring until ``compact()`` rewrites the postings without them.
+    """
+
+    def __init__(self, analyzer: Callable[[str], List[str]] = None, k1: float = None, b: float = None):
+        self.analyzer = analyzer
+        self.k1 = settings.bm25_k1 if k1 is None else k1
+        self.b = settings.bm25_b if b is None else b
+
+        self._postings: Dict[str, _Postings] = {}
+        self._doc_numbers: Dict[str, int] = {}
+        self._doc_ids: List[Optional[str]] = []
+        self._lengths = np.zeros(1024, dtype=np.int32)
+        self._live = np.zeros(1024, dtype=bool)
+        self._total_length = 0
+        self._deleted = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_numbers)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._doc_numbers
+
+    @property
+    def vocabulary_size(self) -> int:
+        return len(self._postings)
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes held by encoded postings and per-document arrays"""
+        return (sum(len(postings.data) for postings in self._postings.values())
+                + self._lengths.nbytes + self._live.nbytes)
+
+    def _analyze(self, text: str) -> List[str]:
+        if self.analyzer is None:
+            raise RuntimeError("BM25Index needs an analyzer to index or search raw text")
+        return self.analyzer(text)
+
+    def add(self, id: str, text: str = None, tokens: Sequence[str] = None):
+        """Index one document from its text or its already-analyzed tokens"""
+        self.add_many([id], None if text is None else [text], None if tokens is None else [tokens])
+
+    def add_many(self, ids: Sequence[str], texts: Sequence[str] = None,
+                 token_lists: Sequence[Sequence[str]] = None):
+        """Index documents, replacing any already indexed under the same id"""
+        if token_lists is None:
+            token_lists = [self._analyze(text) for text in texts]
+        if len(ids) != len(token_lists):
+            raise ValueError(f"Got {len(ids)} ids for {len(token_lists)} documents")
+
+        self.delete([id for id in ids if id in self._doc_numbers])
+        for id, tokens in zip(ids, token_lists):
+            if id in self._doc_numbers:  # repeated within this call; last one wins
+                self.delete([id])
+            terms = Counter(token for token in tokens if _WORD.search(token))
+            doc = len(self._doc_ids)
+            self._reserve(doc + 1)
+            self._doc_ids.append(id)
+            self._doc_numbers[id] = doc
+            length = sum(terms.values())
+            self._lengths[doc] = length
+            self._live[doc] = True
+            self._total_length += length
+            for term, tf in terms.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = _Postings()
+                postings.append(doc, tf)
+
+    def delete(self, ids: Iterable[str]) -> int:
+        """Remove documents by id; returns how many were present"""
+        removed = 0
+        for id in ids:
+            doc = self._doc_numbers.pop(id, None)
+            if doc is None:
+                continue
+            self._live[doc] = False
+            self._doc_ids[doc] = None
+            self._total_length -= int(self._lengths[doc])
+            self._deleted += 1
+            removed += 1
+        if self._deleted > max(1024, len(self._doc_numbers)):
+            self.compact()
+        return removed
+
+    def compact(self):
+        """Rewrite the postings without deleted documents and renumber the rest"""
+        if not self._deleted:
+            return
+        renumber = np.full(len(self._doc_ids), -1, dtype=np.int64)
+        live_docs = np.flatnonzero(self._live[:len(self._doc_ids)])
+        renumber[live_docs] = np.arange(len(live_docs))
+
+        postings = {}
+        for term, old in self._postings.items():
+            docs, tfs = old.decode()
+            keep = renumber[docs] >= 0
+            if not keep.any():
+                continue
+            new = _Postings()
+            docs = renumber[docs[keep]]
+            gaps = np.diff(docs, prepend=-1)
+            new.data = encode_varints(np.column_stack((gaps, tfs[keep])).ravel().tolist())
+            new.last_doc = int(docs[-1])
+            new.count = len(docs)
+            postings[term] = new
+
+        self._postings = postings
+        self._doc_ids = [self._doc_ids[doc] for doc in live_docs]
+        self._doc_numbers = {id: doc for doc, id in enumerate(self._doc_ids)}
+        lengths = self._lengths[live_docs]
+        self._lengths = np.zeros(max(1024, len(lengths)), dtype=np.int32)
+        self._lengths[:len(lengths)] = lengths
+        self._live = np.zeros(len(self._lengths), dtype=bool)
+        self._live[:len(lengths)] = True
+        self._deleted = 0
+
+    def _reserve(self, size: int):
+        if size <= len(self._lengths):
+            return
+        capacity = len(self._lengths)
+        while capacity < size:
+            capacity *= 2
+        self._lengths = np.concatenate([self._lengths, np.zeros(capacity - len(self._lengths), dtype=np.int32)])
+        self._live = np.concatenate([self._live, np.zeros(capacity - len(self._live), dtype=bool)])
+
+    def term_statistics(self, query: str = None, tokens: Sequence[str] = None) -> Dict[str, Any]:
+        """Live document count, total length and document frequency of each query term
+
+        Summed over indexes that partition one corpus and passed to
+        ``search(statistics=...)``, they make every partition score as if it
+        were the whole index.
+        """
+        if tokens is None:
+            tokens = self._analyze(query)
+        df = {}
+        for term in {token for token in tokens if _WORD.search(token)}:
+            postings = self._postings.get(term)
+            if postings is not None:
+                df[term] = self._document_frequency(postings)
+        return {'documents': len(self._doc_numbers), 'total_length': self._total_length, 'df': df}
+
+    def _document_frequency(self, postings: _Postings, docs: np.ndarray = None) -> int:
+        """Postings count, leaving out deleted documents"""
+        if not self._deleted:
+            return postings.count
+        if docs is None:
+            docs, _ = postings.decode()
+        return int(self._live[docs].sum())
+
+    def search(self, query: str = None, top_k: int = 10, tokens: Sequence[str] = None,
+               allow: Callable[[List[str]], Sequence[bool]] = None,
+               statistics: Dict[str, Any] = None) -> List[Tuple[str, float]]:
+        """Top-k (id, BM25 score) pairs for a query, best first
+
+        Only documents containing at least one query term are returned.
+        ``allow`` filters candidates: it gets a list of ids and returns
+        whether each may be returned. It is called on blocks of candidates,
+        best first, until ``top_k`` have passed. ``statistics`` (see
+        ``term_statistics``) replaces this index's document count, average
+        length and document frequencies in the IDF and length norm.
+        """
+        if tokens is None:
+            tokens = self._analyze(query)
+        terms = Counter(token for token in tokens if _WORD.search(token))
+        n_docs = len(self._doc_numbers)
+        if not terms or not n_docs or top_k <= 0:
+            return []
+
+        total_length = self._total_length
+        if statistics is not None:
+            n_docs, total_length = statistics['documents'], statistics['total_length']
+        size = len(self._doc_ids)
+        lengths = self._lengths[:size]
+        average = total_length / n_docs if total_length else 1.0
+        norm = self.k1 * (1 - self.b + self.b * lengths / average)
+        scores = np.zeros(size, dtype=np.float64)
+        for term, query_tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            docs, tfs = postings.decode()
+            # Document frequency counts only live documents
+            df = self._document_frequency(postings, docs) if statistics is None else statistics['df'].get(term, 0)
+            if not df:
+                continue
+            idf = np.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += query_tf * idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+
+        if self._deleted:
+            scores[~self._live[:size]] = 0
+        matched = np.flatnonzero(scores > 0)
+        if not len(matched):
+            return []
+        if allow is not None:
+            return self._filtered_top_k(scores, matched, top_k, allow)
+        if len(matched) > top_k:
+            matched = matched[np.argpartition(-scores[matched], top_k - 1)[:top_k]]
+        matched = matched[np.argsort(-scores[matched], kind='stable')]
+        return [(self._doc_ids[doc], float(scores[doc])) for doc in matched]
+
+    def _filtered_top_k(self, scores: np.ndarray, matched: np.ndarray, top_k: int,
+                        allow: Callable[[List[str]], Sequence[bool]]) -> List[Tuple[str, float]]:
+        ranked = matched[np.argsort(-scores[matched], kind='stable')]
+        block = max(4 * top_k, 256)
+        accepted: List[int] = []
+        for start in range(0, len(ranked), block):
+            docs = ranked[start:start + block]
+            keep = np.asarray(allow([self._doc_ids[doc] for doc in docs]), dtype=bool)
+            accepted.extend(docs[keep][:top_k - len(accepted)].tolist())
+            if len(accepted) >= top_k:
+                break
+        return [(self._doc_ids[doc], float(scores[doc])) for doc in accepted]
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str = None):
+        """Write the index to a directory (deleted documents are compacted away)"""
+        self.compact()
+        path = Path(path or settings.lexical_index_path)
+        path.mkdir(parents=True, exist_ok=True)
+        terms = list(self._postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(self._postings[term].data) for term in terms], out=offsets[1:])
+        meta = {'k1': self.k1, 'b': self.b, 'terms': terms, 'ids': self._doc_ids}
+
+        def write_postings(f):
+            for term in terms:
+                f.write(self._postings[term].data)
+
+        self._write_atomic(path / 'meta.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+        self._write_atomic(path / 'postings.bin', write_postings)
+        self._write_atomic(path / 'offsets.npy', lambda f: np.save(f, offsets))
+        self._write_atomic(path / 'lengths.npy', lambda f: np.save(f, self._lengths[:len(self._doc_ids)]))
+        logger.info(f"Saved lexical index of {len(self)} documents and {len(terms)} terms to {path}")
+
+    @classmethod
+    def load(cls, path: str = None, analyzer: Callable[[str], List[str]] = None) -> "BM25Index":
+        path = Path(path or settings.lexical_index_path)
+        meta = json.loads((path / 'meta.json').read_text())
+        index = cls(analyzer, meta['k1'], meta['b'])
+        data = (path / 'postings.bin').read_bytes()
+        offsets = np.load(path / 'offsets.npy').tolist()
+        for i, term in enumerate(meta['terms']):
+            postings = _Postings()
+            postings.data = bytearray(data[offsets[i]:offsets[i + 1]])
+            docs, _ = postings.decode()
+            postings.last_doc = int(docs[-1])
+            postings.count = len(docs)
+            index._postings[term] = postings
+
+        index._doc_ids = list(meta['ids'])
+        index._doc_numbers = {id: doc for doc, id in enumerate(index._doc_ids)}
+        lengths = np.load(path / 'lengths.npy')
+        index._reserve(len(lengths))
+        index._lengths[:len(lengths)] = lengths
+        index._live[:len(lengths)] = True
+        index._total_length = int(lengths.sum())
+        return index
+
+    @staticmethod
+    def _write_atomic(path: Path, write):
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Tuple[str, float]]], k: int = None,
+                           weights: Sequence[float] = None) -> List[Tuple[str, float]]:
+    """Fuse ranked (id, score) lists by reciprocal rank: sum of weight / (k + rank)
+
+    Only ranks matter, so BM25 and cosine scores need no calibration
+    against each other.
+    """
+    k = settings.rrf_k if k is None else k
+    weights = weights or [1.0] * len(rankings)
+    fused: Dict[str, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, (id, _) in enumerate(ranking, start=1):
+            fused[id] = fused.get(id, 0.0) + weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,232 @@
+"""
+Local CPU embedding provider with dynamic batching and optional quantization
+"""
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATION_MODES = ('none', 'int8', 'onnx', 'onnx-int8')
+
+
+class LocalEmbeddingProvider:
+    """Sentence embedding model run in-process on the CPU
+
+    Inference runs on a dedicated single-thread executor, so it never
+    competes with the event loop's default executor and the model is only
+    ever used from one thread. Concurrent ``embed`` calls are gathered into
+    batches of up to ``batch_size`` texts, waiting at most ``max_wait_ms``
+    for a batch to fill; while a batch runs, new calls queue up for the
+    next one. Every batch is sorted by length so texts of similar length
+    are padded together.
+
+    ``quantization`` selects the runtime: ``none`` (sentence-transformers),
+    ``int8`` (PyTorch dynamic int8 quantization of the linear layers),
+    ``onnx`` (ONNX Runtime via optimum) or ``onnx-int8`` (ONNX Runtime with
+    dynamically quantized int8 weights). Vectors are L2-normalized.
+    ``output_dimension`` truncates them Matryoshka-style and renormalizes,
+    or zero-pads them to a wider index; 0 keeps the model's dimension.
+    """
+
+    def __init__(self, model_name: str = None, quantization: str = None, output_dimension: int = None,
+                 batch_size: int = None, max_wait_ms: float = None, threads: int = None):
+        self.model_name = model_name or settings.local_embedding_model
+        self.quantization = (quantization or settings.local_embedding_quantization).lower()
+        if self.quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization {self.quantization!r}, expected one of {QUANTIZATION_MODES}")
+        self.output_dimension = (settings.local_embedding_dimension
+                                 if output_dimension is None else output_dimension)
+        self.batch_size = batch_size or settings.local_embedding_batch_size
+        self.max_wait_seconds = (settings.local_embedding_max_wait_ms if max_wait_ms is None else max_wait_ms) / 1000
+        self.threads = settings.local_embedding_threads if threads is None else threads
+
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='local-embedding')
+        self._lock = threading.Lock()
+        self._model = None
+        self._tokenizer = None
+        self._native_dimension: Optional[int] = None
+
+        self._loop = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+
+        self.stats = {'batches': 0, 'texts': 0, 'max_batch': 0}
+
+    @property
+    def signature(self) -> str:
+        """Identifies the vectors this provider produces, e.g. for cache keys"""
+        return f"local:{self.model_name}:{self.quantization}:{self.output_dimension}"
+
+    @property
+    def dimension(self) -> int:
+        """Dimension of the returned vectors (loads the model if needed)"""
+        if self.output_dimension:
+            return self.output_dimension
+        self._load()
+        return self._native_dimension
+
+    def warmup(self):
+        """Load the model and run one batch so the first request is not slow"""
+        self.encode(['warmup'])
+
+    def _load(self):
+        if self._model is not None:
+            return
+        with self._lock:
+            if self._model is not None:
+                return
+            if self.threads:
+                import torch
+                torch.set_num_threads(self.threads)
+            if self.quantization.startswith('onnx'):
+                self._load_onnx()
+            else:
+                self._load_sentence_transformer()
+            logger.info(f"Loaded local embedding model {self.model_name} "
+                        f"({self.quantization}, {self._native_dimension}-d)")
+
+    def _load_sentence_transformer(self):
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(self.model_name, device='cpu')
+        if self.quantization == 'int8':
+            import torch
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        model.eval()
+        self._native_dimension = model.get_sentence_embedding_dimension()
+        self._model = model
+
+    def _load_onnx(self):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        model_id = self.model_name if '/' in self.model_name else f"sentence-transformers/{self.model_name}"
+        export_dir = Path(settings.local_embedding_cache_dir) / model_id.replace('/', '--')
+        file_name = 'model_quantized.onnx' if self.quantization == 'onnx-int8' else 'model.onnx'
+
+        if not (export_dir / 'model.onnx').exists():
+            model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+            model.save_pretrained(export_dir)
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(export_dir)
+        if file_name != 'model.onnx' and not (export_dir / file_name).exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(str(export_dir / 'model.onnx'), str(export_dir / file_name),
+                             weight_type=QuantType.QInt8)
+
+        self._tokenizer = AutoTokenizer.from_pretrained(export_dir)
+        self._model = ORTModelForFeatureExtraction.from_pretrained(export_dir, file_name=file_name)
+        self._native_dimension = self._model.config.hidden_size
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts synchronously as a (len(texts), dimension) float32 matrix
+
+        Texts are sorted by length and run in batches of ``batch_size``;
+        rows come back in input order.
+        """
+        self._load()
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            with metrics.timer('local_embedding_batch_seconds'):
+                result[batch] = self._resize(self._encode_batch([texts[i] for i in batch]))
+            metrics.inc('embedding_inputs_total', len(batch), model=self.signature)
+            self.stats['batches'] += 1
+            self.stats['texts'] += len(batch)
+            self.stats['max_batch'] = max(self.stats['max_batch'], len(batch))
+        return result
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        if self._tokenizer is None:
+            vectors = self._model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                         normalize_embeddings=True, show_progress_bar=False)
+            return np.asarray(vectors, dtype=np.float32)
+
+        inputs = self._tokenizer(texts, padding=True, truncation=True,
+                                 max_length=min(self._tokenizer.model_max_length, 512), return_tensors='np')
+        hidden = np.asarray(self._model(**inputs).last_hidden_state, dtype=np.float32)
+        # Mean pooling over real tokens, as sentence-transformers does
+        mask = inputs['attention_mask'][..., None].astype(np.float32)
+        vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+    def _resize(self, vectors: np.ndarray) -> np.ndarray:
+        """Truncate and renormalize, or zero-pad, to output_dimension"""
+        target = self.output_dimension
+        if not target or target == vectors.shape[1]:
+            return vectors
+        if target < vectors.shape[1]:
+            vectors = vectors[:, :target]
+            return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        padded = np.zeros((vectors.shape[0], target), dtype=np.float32)
+        padded[:, :vectors.shape[1]] = vectors
+        return padded
+
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """Embed a list of texts on the inference thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.encode, list(texts))
+
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed one text, batched with other calls waiting at the same time"""
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop or self._batcher is None or self._batcher.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._batcher = loop.create_task(self._run_batches())
+        future = loop.create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        while True:
+            batch: List[Tuple[str, asyncio.Future]] = [await queue.get()]
+            deadline = loop.time() + self.max_wait_seconds
+            while len(batch) < self.batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if not batch:
+                continue
+            try:
+                vectors = await loop.run_in_executor(self._executor, self.encode, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+
+    def get_stats(self):
+        return dict(self.stats)
+
+    def close(self):
+        if self._batcher is not None and not self._batcher.done():
+            self._batcher.cancel()
+        self._executor.shutdown(wait=False)
+
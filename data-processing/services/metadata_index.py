@@ -0,0 +1,348 @@
+"""
+Bitmap and range indexes over document metadata for filtered search
+"""
+
+import json
+import logging
+from datetime import date, datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+KEYWORD_OPERATORS = ('$eq', '$ne', '$in', '$nin')
+RANGE_OPERATORS = ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte')
+
+# A value's labels switch from a sorted array to a bitmap once they cover
+# more than 1/DENSE_RATIO of the label space (4 bytes per label vs 1 bit)
+DENSE_RATIO = 32
+
+
+def _field_list(fields) -> List[str]:
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    return [field.strip() for field in fields if field and field.strip()]
+
+
+def _keyword_key(value: Any) -> str:
+    return value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+
+
+def _keyword_values(value: Any) -> List[str]:
+    """Index keys of a metadata value; lists are indexed element by element"""
+    if value is None or isinstance(value, dict):
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return [_keyword_key(item) for item in value if item is not None and not isinstance(item, dict)]
+    return [_keyword_key(value)]
+
+
+def to_number(value: Any) -> Optional[float]:
+    """Numeric form of a range value: numbers as is, dates and ISO strings as epoch seconds"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return float(value)
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        # Naive timestamps are taken as UTC
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    return None
+
+
+class _Postings:
+    """Labels carrying one keyword value
+
+    Kept as a sorted uint32 array while sparse and as a packed,
+    little-endian bitmap (the layout ``faiss.IDSelectorBitmap`` reads) once
+    dense. A bitmap goes back to an array when removals leave it at half
+    the density that created it, so values near the threshold do not flip
+    on every write.
+    """
+
+    __slots__ = ('labels', 'bits', 'count')
+
+    def __init__(self):
+        self.labels = np.empty(0, dtype=np.uint32)
+        self.bits: Optional[np.ndarray] = None
+        self.count = 0
+
+    def add(self, labels: np.ndarray):
+        """Add sorted, unique labels"""
+        if self.bits is None:
+            if not len(self.labels) or labels[0] > self.labels[-1]:
+                self.labels = np.concatenate([self.labels, labels])
+            else:
+                self.labels = np.union1d(self.labels, labels)
+            self.count = len(self.labels)
+            if self.count * DENSE_RATIO > int(self.labels[-1]) + 1:
+                self._densify()
+            return
+        self._grow(int(labels[-1]) + 1)
+        present = self._test(labels)
+        fresh = labels[~present]
+        np.bitwise_or.at(self.bits, fresh >> 3, np.left_shift(1, fresh & 7).astype(np.uint8))
+        self.count += len(fresh)
+
+    def remove(self, labels: np.ndarray):
+        if self.bits is None:
+            self.labels = self.labels[~np.isin(self.labels, labels, assume_unique=True)]
+            self.count = len(self.labels)
+            return
+        labels = labels[labels < len(self.bits) * 8]
+        gone = labels[self._test(labels)]
+        np.bitwise_and.at(self.bits, gone >> 3, ~np.left_shift(1, gone & 7).astype(np.uint8))
+        self.count -= len(gone)
+        if self.count * DENSE_RATIO * 2 <= len(self.bits) * 8:
+            self._sparsify()
+
+    def mask(self, size: int) -> np.ndarray:
+        """Boolean membership over labels [0, size)"""
+        if self.bits is None:
+            mask = np.zeros(size, dtype=bool)
+            mask[self.labels[self.labels < size]] = True
+            return mask
+        mask = np.unpackbits(self.bits, count=min(size, len(self.bits) * 8), bitorder='little').view(bool)
+        if len(mask) < size:
+            mask = np.concatenate([mask, np.zeros(size - len(mask), dtype=bool)])
+        return mask
+
+    def memory_bytes(self) -> int:
+        return self.labels.nbytes + (self.bits.nbytes if self.bits is not None else 0)
+
+    def _test(self, labels: np.ndarray) -> np.ndarray:
+        inside = labels < len(self.bits) * 8
+        present = np.zeros(len(labels), dtype=bool)
+        present[inside] = (self.bits[labels[inside] >> 3] >> (labels[inside] & 7).astype(np.uint8)) & 1 == 1
+        return present
+
+    def _grow(self, size: int):
+        nbytes = (size + 7) // 8
+        if nbytes > len(self.bits):
+            grown = np.zeros(max(nbytes, 2 * len(self.bits)), dtype=np.uint8)
+            grown[:len(self.bits)] = self.bits
+            self.bits = grown
+
+    def _densify(self):
+        size = int(self.labels[-1]) + 1
+        mask = np.zeros(max(size, 64), dtype=bool)
+        mask[self.labels] = True
+        self.bits = np.packbits(mask, bitorder='little')
+        self.labels = np.empty(0, dtype=np.uint32)
+
+    def _sparsify(self):
+        labels = np.flatnonzero(np.unpackbits(self.bits, bitorder='little')).astype(np.uint32)
+        if len(labels) and self.count * DENSE_RATIO * 2 > int(labels[-1]) + 1:
+            # Only the spare capacity was sparse; trim it so the check stays cheap
+            self.bits = self.bits[:(int(labels[-1]) + 8) // 8].copy()
+            return
+        self.labels = labels
+        self.bits = None
+
+
+class MetadataSelection:
+    """Labels matching a filter, as a boolean mask over the label space"""
+
+    def __init__(self, mask: np.ndarray):
+        self.mask = mask
+        self.count = int(np.count_nonzero(mask))
+
+    def __len__(self) -> int:
+        return self.count
+
+    def labels(self) -> np.ndarray:
+        """Matching labels, ascending"""
+        return np.flatnonzero(self.mask)
+
+    def contains(self, labels: np.ndarray) -> np.ndarray:
+        """Membership of each label; labels outside the index never match"""
+        labels = np.asarray(labels, dtype=np.int64)
+        inside = (labels >= 0) & (labels < len(self.mask))
+        result = np.zeros(len(labels), dtype=bool)
+        result[inside] = self.mask[labels[inside]]
+        return result
+
+    def bitmap(self) -> np.ndarray:
+        """Packed little-endian bitmap of the matches, for ``faiss.IDSelectorBitmap``"""
+        return np.packbits(self.mask, bitorder='little')
+
+
+class MetadataIndex:
+    """Filter index over the metadata of labelled documents
+
+    Keyword fields (``metadata_keyword_fields``) get one posting set per
+    distinct value: a sorted label array while sparse, a packed bitmap once
+    dense. List values are indexed per element. Range fields
+    (``metadata_range_fields``) are stored as a float64 column per field,
+    with dates and ISO timestamps as epoch seconds, so a range test is one
+    vectorized comparison.
+
+    Filters use the Pinecone/Chroma operator syntax: ``{"type": "pdf"}``,
+    ``{"persona": {"$in": [...]}}``, ``{"processed_at": {"$gte": "2024-01-01"}}``,
+    with ``$eq``, ``$ne``, ``$in`` and ``$nin`` on keyword fields, ``$eq``,
+    ``$ne``, ``$gt``, ``$gte``, ``$lt`` and ``$lte`` on range fields, and
+    ``$and`` / ``$or`` lists. Several fields in one dict must all match.
+    Every filter evaluates to a mask over the label space, so its cost
+    depends on the number of labels, not on how many documents match.
+    """
+
+    def __init__(self, keyword_fields=None, range_fields=None):
+        self.keyword_fields = _field_list(settings.metadata_keyword_fields if keyword_fields is None
+                                          else keyword_fields)
+        self.range_fields = _field_list(settings.metadata_range_fields if range_fields is None
+                                        else range_fields)
+        self._keywords: Dict[str, Dict[str, _Postings]] = {field: {} for field in self.keyword_fields}
+        self._ranges: Dict[str, np.ndarray] = {
+            field: np.empty(0, dtype=np.float64) for field in self.range_fields
+        }
+        self._alive = np.zeros(0, dtype=bool)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(self._alive[:self._size]))
+
+    def add(self, labels: Sequence[int], metadatas: Sequence[Dict[str, Any]]):
+        """Index documents under new labels"""
+        labels = np.asarray(labels, dtype=np.int64)
+        if not len(labels):
+            return
+        self._reserve(int(labels.max()) + 1)
+        self._alive[labels] = True
+        for field, postings in self._keywords.items():
+            groups: Dict[str, List[int]] = {}
+            for label, metadata in zip(labels.tolist(), metadatas):
+                for key in set(_keyword_values(metadata.get(field))):
+                    groups.setdefault(key, []).append(label)
+            for key, group in groups.items():
+                postings.setdefault(key, _Postings()).add(np.unique(np.asarray(group, dtype=np.uint32)))
+        for field, column in self._ranges.items():
+            # None becomes NaN, which no range comparison matches
+            column[labels] = np.array([to_number(metadata.get(field)) for metadata in metadatas], dtype=np.float64)
+
+    def remove(self, labels: Sequence[int], metadatas: Sequence[Dict[str, Any]]):
+        """Drop documents; ``metadatas`` are what they were indexed with"""
+        labels = np.asarray(labels, dtype=np.int64)
+        labels = labels[labels < self._size]
+        if not len(labels):
+            return
+        self._alive[labels] = False
+        for field, postings in self._keywords.items():
+            groups: Dict[str, List[int]] = {}
+            for label, metadata in zip(labels.tolist(), metadatas):
+                for key in set(_keyword_values(metadata.get(field))):
+                    groups.setdefault(key, []).append(label)
+            for key, group in groups.items():
+                value = postings.get(key)
+                if value is None:
+                    continue
+                value.remove(np.unique(np.asarray(group, dtype=np.uint32)))
+                if not value.count:
+                    del postings[key]
+        for column in self._ranges.values():
+            column[labels] = np.nan
+
+    def select(self, filters: Dict[str, Any]) -> MetadataSelection:
+        """Labels of live documents matching ``filters``"""
+        return MetadataSelection(self._evaluate(filters) & self._alive[:self._size])
+
+    def values(self, field: str) -> Dict[str, int]:
+        """Document count per value of a keyword field"""
+        return {key: postings.count for key, postings in self._keywords[field].items()}
+
+    def memory_bytes(self) -> int:
+        keywords = sum(postings.memory_bytes() for values in self._keywords.values() for postings in values.values())
+        return keywords + sum(column.nbytes for column in self._ranges.values()) + self._alive.nbytes
+
+    def _evaluate(self, filters: Dict[str, Any]) -> np.ndarray:
+        if not isinstance(filters, dict):
+            raise ValueError(f"Filters must be a dict, got {type(filters).__name__}")
+        mask = np.ones(self._size, dtype=bool)
+        for key, condition in filters.items():
+            if key == '$and':
+                for part in condition:
+                    mask &= self._evaluate(part)
+            elif key == '$or':
+                union = np.zeros(self._size, dtype=bool)
+                for part in condition:
+                    union |= self._evaluate(part)
+                mask &= union
+            elif key.startswith('$'):
+                raise ValueError(f"Unknown filter operator: {key}")
+            else:
+                mask &= self._condition(key, condition)
+        return mask
+
+    def _condition(self, field: str, condition: Any) -> np.ndarray:
+        if not isinstance(condition, dict):
+            condition = {'$eq': condition}
+        if field in self._keywords:
+            return self._keyword_condition(field, condition)
+        if field in self._ranges:
+            return self._range_condition(field, condition)
+        raise ValueError(f"Metadata field {field!r} is not indexed; add it to METADATA_KEYWORD_FIELDS "
+                         f"or METADATA_RANGE_FIELDS")
+
+    def _keyword_condition(self, field: str, condition: Dict[str, Any]) -> np.ndarray:
+        postings = self._keywords[field]
+        mask = np.ones(self._size, dtype=bool)
+        for operator, operand in condition.items():
+            if operator not in KEYWORD_OPERATORS:
+                raise ValueError(f"Operator {operator} is not supported on keyword field {field!r}")
+            values = operand if operator in ('$in', '$nin') else [operand]
+            matched = np.zeros(self._size, dtype=bool)
+            for value in values:
+                value_postings = postings.get(_keyword_key(value))
+                if value_postings is not None:
+                    matched |= value_postings.mask(self._size)
+            mask &= ~matched if operator in ('$ne', '$nin') else matched
+        return mask
+
+    def _range_condition(self, field: str, condition: Dict[str, Any]) -> np.ndarray:
+        column = self._ranges[field][:self._size]
+        mask = ~np.isnan(column)
+        for operator, operand in condition.items():
+            if operator not in RANGE_OPERATORS:
+                raise ValueError(f"Operator {operator} is not supported on range field {field!r}")
+            number = to_number(operand)
+            if number is None:
+                raise ValueError(f"Cannot compare range field {field!r} with {operand!r}")
+            if operator == '$eq':
+                mask &= column == number
+            elif operator == '$ne':
+                mask &= column != number
+            elif operator == '$gt':
+                mask &= column > number
+            elif operator == '$gte':
+                mask &= column >= number
+            elif operator == '$lt':
+                mask &= column < number
+            else:
+                mask &= column <= number
+        return mask
+
+    def _reserve(self, size: int):
+        if size <= self._size:
+            return
+        if size > len(self._alive):
+            capacity = max(size, 2 * len(self._alive), 1024)
+            alive = np.zeros(capacity, dtype=bool)
+            alive[:len(self._alive)] = self._alive
+            self._alive = alive
+            for field, column in self._ranges.items():
+                grown = np.full(capacity, np.nan, dtype=np.float64)
+                grown[:len(column)] = column
+                self._ranges[field] = grown
+        self._size = size
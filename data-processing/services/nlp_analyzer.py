@@ -0,0 +1,278 @@
+"""
+NLP analysis engine deriving entities, keywords, sentences and sentiment from one parse
+"""
+
+import asyncio
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+from config.settings import settings
+from services.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ANALYSES = ('entities', 'keywords', 'sentences', 'sentiment')
+
+# spaCy components each analysis needs; the tokenizer always runs
+_COMPONENTS = {
+    'entities': ('ner',),
+    'keywords': ('tok2vec', 'tagger', 'attribute_ruler', 'lemmatizer'),
+    'sentences': ('tok2vec', 'senter'),
+    'sentiment': (),
+}
+
+_WORD = re.compile(r"\w+(?:'\w+)?|[.,;:?!]")
+_SENTENCE = re.compile(r'[^.?!]+(?:[.?!]+|$)')
+_NEGATIONS = frozenset({'not', 'no', 'never', 'none', 'nobody', 'nothing', 'neither', 'nor', "n't",
+                        "don't", "doesn't", "didn't", "isn't", "wasn't", "can't", "won't", "cannot"})
+# VADER's normalization constant for mapping a valence sum into (-1, 1)
+_SENTIMENT_ALPHA = 15.0
+# Punctuation that ends a negation's scope
+_CLAUSE_ENDS = frozenset('.,;:?!')
+
+
+class _Token(NamedTuple):
+    lower: str
+    lemma: str
+    is_alpha: bool
+    is_stop: bool
+
+
+def _parse_analyses(analyses) -> tuple:
+    if analyses is None:
+        analyses = settings.nlp_analyses
+    if isinstance(analyses, str):
+        analyses = [name.strip() for name in analyses.split(',') if name.strip()]
+    unknown = set(analyses) - set(ANALYSES)
+    if unknown:
+        raise ValueError(f"Unknown analyses {sorted(unknown)}, expected some of {ANALYSES}")
+    return tuple(name for name in ANALYSES if name in analyses)
+
+
+class NLPAnalyzer:
+    """Runs a single spaCy parse per text and derives every requested analysis from it
+
+    ``analyses`` picks the outputs (``entities``, ``keywords``,
+    ``sentences``, ``sentiment``); pipeline components that none of them
+    need are disabled at load, and per-call subsets disable more. Keywords
+    are the most frequent non-stop-word lemmas, sentences come from the
+    lightweight ``senter`` instead of the dependency parser, and sentiment
+    scores the parsed tokens against the VADER lexicon with negation.
+    Batches go through ``nlp.pipe`` on a dedicated thread, so the model is
+    only used from one thread and the event loop is never blocked.
+
+    Without the spaCy model, text is split with regular expressions:
+    entities are empty and keywords use surface forms, with stop words from
+    ``text_processor`` when one is given.
+    """
+
+    def __init__(self, text_processor=None, analyses=None, model: str = None, batch_size: int = None,
+                 keywords_top_k: int = None):
+        self.text_processor = text_processor
+        self.analyses = _parse_analyses(analyses)
+        self.model_name = model or settings.nlp_model
+        self.batch_size = batch_size or settings.nlp_batch_size
+        self.keywords_top_k = keywords_top_k or settings.nlp_keywords_top_k
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='nlp-analyzer')
+        self._lock = threading.Lock()
+        self._nlp = None
+        self._nlp_loaded = False
+        self._lexicon: Optional[Dict[str, float]] = None
+        self._stop_words = None
+
+    @property
+    def nlp(self):
+        """spaCy pipeline with only the needed components enabled (None if unavailable)"""
+        if not self._nlp_loaded:
+            with self._lock:
+                if not self._nlp_loaded:
+                    self._nlp = self._load_pipeline()
+                    self._nlp_loaded = True
+        return self._nlp
+
+    def _load_pipeline(self):
+        try:
+            import spacy
+            nlp = spacy.load(self.model_name)
+        except (ImportError, OSError):
+            logger.warning(f"spaCy model {self.model_name} not found, analyzing with regular expressions")
+            return None
+        required = set()
+        for name in self.analyses:
+            required.update(_COMPONENTS[name])
+        if 'sentences' in self.analyses and 'senter' not in nlp.component_names:
+            required.add('parser')
+        for name in nlp.component_names:
+            if name in required:
+                nlp.enable_pipe(name)
+            else:
+                nlp.disable_pipe(name)
+        logger.info(f"Loaded {self.model_name} with {nlp.pipe_names} for {list(self.analyses)}")
+        return nlp
+
+    @property
+    def lexicon(self) -> Dict[str, float]:
+        """VADER word valences, loaded on first use (empty if unavailable)"""
+        if self._lexicon is None:
+            with self._lock:
+                if self._lexicon is None:
+                    self._lexicon = self._load_lexicon()
+        return self._lexicon
+
+    def _load_lexicon(self) -> Dict[str, float]:
+        try:
+            import nltk
+            try:
+                nltk.data.find('sentiment/vader_lexicon.zip')
+            except LookupError:
+                if not settings.nltk_auto_download:
+                    raise
+                nltk.download('vader_lexicon', quiet=True)
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            return dict(SentimentIntensityAnalyzer().lexicon)
+        except Exception as e:
+            logger.warning(f"Sentiment lexicon not available ({e}), sentiment will be neutral")
+            return {}
+
+    def warmup(self):
+        """Load the model and lexicon now instead of on first use"""
+        self.nlp
+        if 'sentiment' in self.analyses:
+            self.lexicon
+
+    async def analyze(self, text: str, analyses=None) -> Dict[str, Any]:
+        """Analyze one text"""
+        return (await self.analyze_batch_async([text], analyses))[0]
+
+    async def analyze_batch_async(self, texts: Sequence[str], analyses=None,
+                                  return_exceptions: bool = False) -> List[Any]:
+        """analyze_batch on the analyzer's thread, without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.analyze_batch, texts, analyses,
+                                          return_exceptions)
+
+    @metrics.timed('stage_seconds', stage='nlp_analyze')
+    def analyze_batch(self, texts: Sequence[str], analyses=None, return_exceptions: bool = False) -> List[Any]:
+        """Analyze many texts with one ``nlp.pipe`` pass
+
+        ``analyses`` narrows the configured analyses for this call. If the
+        batch fails, texts are retried one at a time; with
+        ``return_exceptions`` a text that still fails yields its exception
+        instead of raising.
+        """
+        analyses = self.analyses if analyses is None else _parse_analyses(analyses)
+        if not set(analyses) <= set(self.analyses):
+            raise ValueError(f"Analyses {sorted(set(analyses) - set(self.analyses))} are not enabled "
+                             f"on this analyzer ({list(self.analyses)})")
+        nlp = self.nlp
+        if nlp is None:
+            return [self._analyze_one(None, text, analyses, return_exceptions) for text in texts]
+
+        disable = self._disabled_for(nlp, analyses)
+        try:
+            docs = list(nlp.pipe(texts, batch_size=self.batch_size, disable=disable))
+        except Exception as e:
+            logger.error(f"Error analyzing batch, falling back to one text at a time: {e}")
+            docs = [None] * len(texts)
+        results = []
+        for text, doc in zip(texts, docs):
+            if doc is None:
+                try:
+                    doc = nlp(text, disable=disable)
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results.append(e)
+                    continue
+            results.append(self._analyze_one(doc, text, analyses, return_exceptions))
+        return results
+
+    def _disabled_for(self, nlp, analyses: Iterable[str]) -> List[str]:
+        """Enabled components this call's analyses don't need"""
+        required = set()
+        for name in analyses:
+            required.update(_COMPONENTS[name])
+        if 'sentences' in analyses and 'senter' not in nlp.pipe_names:
+            required.add('parser')
+        return [name for name in nlp.pipe_names if name not in required]
+
+    def _analyze_one(self, doc, text: str, analyses: Sequence[str], return_exceptions: bool):
+        try:
+            return self._derive(doc, text, analyses)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return e
+
+    def _derive(self, doc, text: str, analyses: Sequence[str]) -> Dict[str, Any]:
+        """Every requested analysis from one parsed doc (or the regex fallback when doc is None)"""
+        if doc is not None:
+            tokens = [_Token(token.lower_, token.lemma_.lower() or token.lower_, token.is_alpha, token.is_stop)
+                      for token in doc]
+        else:
+            stop_words = self._fallback_stop_words()
+            tokens = [_Token(word, word, word.isalpha(), word in stop_words)
+                      for word in (match.group().lower() for match in _WORD.finditer(text))]
+
+        result: Dict[str, Any] = {'word_count': sum(1 for token in tokens if token.is_alpha)}
+        if 'entities' in analyses:
+            result['entities'] = [] if doc is None else [
+                {'text': ent.text, 'label': ent.label_, 'start': ent.start_char, 'end': ent.end_char,
+                 'confidence': 1.0}
+                for ent in doc.ents
+            ]
+        if 'keywords' in analyses:
+            counts = Counter(token.lemma for token in tokens
+                             if token.is_alpha and not token.is_stop and len(token.lemma) > 2)
+            result['keywords'] = [word for word, _ in counts.most_common(self.keywords_top_k)]
+        if 'sentences' in analyses:
+            if doc is not None:
+                spans = [(sent.start_char, sent.end_char) for sent in doc.sents]
+            else:
+                spans = [match.span() for match in _SENTENCE.finditer(text) if match.group().strip()]
+            result['sentences'] = [{'text': text[start:end].strip(), 'start': start, 'end': end}
+                                   for start, end in spans]
+        if 'sentiment' in analyses:
+            result['sentiment'] = self._sentiment(tokens)
+        return result
+
+    def _fallback_stop_words(self):
+        if self._stop_words is None:
+            stop_words = frozenset()
+            if self.text_processor is not None:
+                try:
+                    stop_words = self.text_processor.stop_words
+                except ImportError:
+                    pass
+            self._stop_words = stop_words
+        return self._stop_words
+
+    def _sentiment(self, tokens: List[_Token]) -> Dict[str, Any]:
+        """Lexicon valence of the tokens, flipped after a negation, squashed into [-1, 1]"""
+        lexicon = self.lexicon
+        total = 0.0
+        scored = 0
+        for i, token in enumerate(tokens):
+            valence = lexicon.get(token.lower)
+            if valence is None:
+                continue
+            # A negation in the three preceding tokens of the clause reverses and dampens the valence
+            for previous in reversed(tokens[max(0, i - 3):i]):
+                if previous.lower in _CLAUSE_ENDS:
+                    break
+                if previous.lower in _NEGATIONS:
+                    valence *= -0.74
+                    break
+            total += valence
+            scored += 1
+        score = total / math.sqrt(total * total + _SENTIMENT_ALPHA) if total else 0.0
+        label = 'positive' if score >= 0.05 else 'negative' if score <= -0.05 else 'neutral'
+        return {'label': label, 'score': round(score, 4), 'scored_tokens': scored}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,349 @@
+"""
+Compact embedding codes (float16, int8, binary) with two-stage search
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from services.vector_index import QUERY_BLOCK_SIZE, VectorIndex, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('float16', 'int8', 'binary')
+
+# Stored rows encoded or Hamming-scored per block
+ROW_BLOCK_SIZE = 16384
+
+# float16/int8 blocks are widened to float32 in a buffer of about this size,
+# small enough to stay in cache between the conversion and the matmul
+WIDEN_BLOCK_BYTES = 1 << 21
+
+# Set bits in each byte value, for popcounts on numpy versions without bitwise_count
+_POPCOUNT = np.array([bin(value).count('1') for value in range(256)], dtype=np.uint8)
+
+
+def truncate_dimensions(vectors: np.ndarray, dimension: int) -> np.ndarray:
+    """Keep the first ``dimension`` components and renormalize (Matryoshka truncation)
+
+    Only meaningful for embeddings trained for it, such as the
+    text-embedding-3 models. Returns a new float32 array.
+    """
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    if dimension and dimension < vectors.shape[1]:
+        vectors = np.ascontiguousarray(vectors[:, :dimension])
+    return normalize_rows(vectors)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-vector int8 codes: ``vector ~= codes * scale``"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    """Sign bits packed eight to a byte"""
+    return np.packbits(np.asarray(vectors) > 0, axis=1)
+
+
+def popcount(codes: np.ndarray) -> np.ndarray:
+    """Set bits per row of a packed uint8 matrix"""
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(codes).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[codes].sum(axis=1, dtype=np.int32)
+
+
+class QuantizedIndex:
+    """Exact-search index over compact codes, with optional full-precision rescoring
+
+    Vectors are normalized, optionally truncated to ``dimension`` and kept
+    as one of:
+
+    * ``float16``: half the memory of float32, practically lossless
+    * ``int8``: a quarter, one float32 scale per vector
+    * ``binary``: 1/32, sign bits compared by Hamming distance
+
+    Scoring runs directly on the codes, a block of rows at a time. When
+    ``full_vectors`` is given (anything with ``get_many(ids)``, such as an
+    ``EmbeddingStore`` mapped from disk), search is two-stage: the codes
+    shortlist ``top_k * rescore_factor`` candidates and only those are
+    rescored against the full-precision, full-dimension vectors.
+
+    The interface mirrors ``VectorIndex``; deletes move the last row into
+    the freed slot. This is a standalone index: ``VectorService`` does not
+    use it, so build one (e.g. ``from_store``) where compact codes are wanted.
+    """
+
+    def __init__(self, format: str = None, dimension: int = None, full_vectors=None,
+                 rescore_factor: int = None, capacity: int = 1024):
+        self.format = (format or settings.quantized_format).lower()
+        if self.format not in FORMATS:
+            raise ValueError(f"Unknown quantized format {self.format!r}, expected one of {FORMATS}")
+        self.dimension = dimension or settings.quantized_dimension or None
+        self.full_vectors = full_vectors
+        self.rescore_factor = rescore_factor or settings.rescore_factor
+        self._capacity = max(1, capacity)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._size = 0
+        self._ids: List[Hashable] = []
+        self._rows: Dict[Hashable, int] = {}
+
+    @classmethod
+    def from_store(cls, store, format: str = None, dimension: int = None,
+                   rescore_factor: int = None) -> "QuantizedIndex":
+        """Build codes for every row of an ``EmbeddingStore`` and rescore against it
+
+        Rows are read in blocks, so the store is never loaded whole.
+        Superseded and deleted rows are skipped; each id keeps its latest
+        vector.
+        """
+        live = store.live_rows()
+        index = cls(format, dimension, full_vectors=store, rescore_factor=rescore_factor,
+                    capacity=max(1, len(live)))
+        matrix = store.matrix()
+        ids = store.ids
+        for start in range(0, len(live), ROW_BLOCK_SIZE):
+            rows = live[start:start + ROW_BLOCK_SIZE]
+            index.add([ids[row] for row in rows], matrix[rows])
+        return index
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, id: Hashable) -> bool:
+        return id in self._rows
+
+    @property
+    def ids(self) -> List[Hashable]:
+        """Ids in row order"""
+        return list(self._ids)
+
+    @property
+    def codes(self) -> np.ndarray:
+        """View of the live codes"""
+        if self._codes is None:
+            return np.empty((0, 0), dtype=self._code_dtype)
+        return self._codes[:self._size]
+
+    @property
+    def memory_bytes(self) -> int:
+        """Bytes held by the live codes and scales"""
+        total = self.codes.nbytes
+        if self._scales is not None:
+            total += self._scales[:self._size].nbytes
+        return total
+
+    @property
+    def _code_dtype(self):
+        return {'float16': np.float16, 'int8': np.int8, 'binary': np.uint8}[self.format]
+
+    def _encode(self, vectors: np.ndarray) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        vectors = truncate_dimensions(vectors, self.dimension)
+        if self.format == 'float16':
+            return vectors.astype(np.float16), None
+        if self.format == 'int8':
+            return quantize_int8(vectors)
+        return quantize_binary(vectors), None
+
+    def add(self, ids: Iterable[Hashable], embeddings: Sequence) -> None:
+        """Insert embeddings, replacing any that already exist under the same id"""
+        ids = list(ids)
+        vectors = np.array(embeddings, dtype=np.float32, ndmin=2)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} embeddings")
+        if not ids:
+            return
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        codes, scales = self._encode(vectors)
+
+        # Existing ids are overwritten in place; for repeated ids the last one wins
+        pending: Dict[Hashable, int] = {}
+        for position, id in enumerate(ids):
+            row = self._rows.get(id)
+            if row is None:
+                pending[id] = position
+            else:
+                self._codes[row] = codes[position]
+                if scales is not None:
+                    self._scales[row] = scales[position]
+
+        if not pending:
+            return
+        new_ids = list(pending)
+        positions = list(pending.values())
+        self._reserve(self._size + len(new_ids), codes.shape[1])
+        start = self._size
+        self._codes[start:start + len(new_ids)] = codes[positions]
+        if scales is not None:
+            self._scales[start:start + len(new_ids)] = scales[positions]
+        for offset, id in enumerate(new_ids):
+            self._rows[id] = start + offset
+        self._ids.extend(new_ids)
+        self._size += len(new_ids)
+
+    def delete(self, ids: Iterable[Hashable]) -> int:
+        """Remove embeddings by id; returns how many were present"""
+        removed = 0
+        for id in ids:
+            row = self._rows.pop(id, None)
+            if row is None:
+                continue
+            last = self._size - 1
+            if row != last:
+                moved = self._ids[last]
+                self._codes[row] = self._codes[last]
+                if self._scales is not None:
+                    self._scales[row] = self._scales[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+            self._ids.pop()
+            self._size -= 1
+            removed += 1
+        return removed
+
+    def get(self, id: Hashable) -> Optional[np.ndarray]:
+        """Approximate normalized embedding reconstructed from its code"""
+        row = self._rows.get(id)
+        if row is None:
+            return None
+        code = self._codes[row]
+        if self.format == 'float16':
+            return code.astype(np.float32)
+        if self.format == 'int8':
+            return code.astype(np.float32) * self._scales[row]
+        bits = np.unpackbits(code)[:self.dimension].astype(np.float32)
+        return (bits * 2 - 1) / np.sqrt(self.dimension)
+
+    def score(self, queries: np.ndarray) -> np.ndarray:
+        """(queries, rows) similarity estimates computed on the codes
+
+        ``queries`` must already be normalized and truncated. float16 and
+        int8 estimate the inner product; binary returns ``1 - 2 * hamming / d``,
+        the fraction of agreeing signs mapped to [-1, 1].
+        """
+        codes = self.codes
+        scores = np.empty((len(queries), len(codes)), dtype=np.float32)
+        if self.format == 'binary':
+            query_codes = quantize_binary(queries)
+            for start in range(0, len(codes), ROW_BLOCK_SIZE):
+                block = codes[start:start + ROW_BLOCK_SIZE]
+                for i, query_code in enumerate(query_codes):
+                    distances = popcount(np.bitwise_xor(block, query_code))
+                    scores[i, start:start + len(block)] = 1.0 - 2.0 * distances / self.dimension
+            return scores
+
+        # BLAS has no float16/int8 kernels; widen one block at a time into a reused buffer
+        block_rows = max(64, WIDEN_BLOCK_BYTES // (4 * codes.shape[1]))
+        buffer = np.empty((block_rows, codes.shape[1]), dtype=np.float32)
+        for start in range(0, len(codes), block_rows):
+            block = buffer[:min(block_rows, len(codes) - start)]
+            np.copyto(block, codes[start:start + len(block)])
+            block_scores = queries @ block.T
+            if self.format == 'int8':
+                block_scores *= self._scales[start:start + len(block)]
+            scores[:, start:start + len(block)] = block_scores
+        return scores
+
+    def search(self, query: Sequence[float], top_k: int = 10,
+               rescore: bool = True) -> List[Tuple[Hashable, float]]:
+        """Top-k (id, similarity) pairs for one query, best first"""
+        return self.search_batch(np.array(query, dtype=np.float32, ndmin=2), top_k, rescore)[0]
+
+    def search_batch(self, queries: Sequence, top_k: int = 10,
+                     rescore: bool = True) -> List[List[Tuple[Hashable, float]]]:
+        """Top-k (id, similarity) pairs for each row of ``queries``
+
+        With ``full_vectors`` and ``rescore``, scores are exact cosine
+        similarities of the rescored shortlist; otherwise they are the
+        code-based estimates.
+        """
+        queries = normalize_rows(np.array(queries, dtype=np.float32, ndmin=2))
+        if self._size == 0 or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        rescore = rescore and self.full_vectors is not None
+        shortlist = min(self._size, top_k * self.rescore_factor if rescore else top_k)
+        truncated = truncate_dimensions(queries, self.dimension)
+
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            scores = self.score(truncated[start:start + QUERY_BLOCK_SIZE])
+            for offset, row_scores in enumerate(scores):
+                top = VectorIndex._top_k(row_scores, shortlist)
+                if rescore:
+                    results.append(self._rescore(queries[start + offset], top, top_k))
+                else:
+                    results.append([(self._ids[row], float(row_scores[row])) for row in top])
+        return results
+
+    def _rescore(self, query: np.ndarray, rows: np.ndarray, top_k: int) -> List[Tuple[Hashable, float]]:
+        """Exact scores for a shortlist, from the full-precision vectors"""
+        ids = [self._ids[row] for row in rows]
+        full = normalize_rows(np.array(self.full_vectors.get_many(ids), dtype=np.float32, ndmin=2))
+        exact = full @ query
+        best = VectorIndex._top_k(exact, min(top_k, len(ids)))
+        return [(ids[i], float(exact[i])) for i in best]
+
+    def _reserve(self, size: int, width: int):
+        """Grow the code (and scale) arrays geometrically to hold ``size`` rows"""
+        if self._codes is not None and size <= len(self._codes):
+            return
+        capacity = self._capacity if self._codes is None else len(self._codes)
+        while capacity < size:
+            capacity *= 2
+        codes = np.empty((capacity, width), dtype=self._code_dtype)
+        if self._codes is not None:
+            codes[:self._size] = self._codes[:self._size]
+        self._codes = codes
+        if self.format == 'int8':
+            scales = np.empty(capacity, dtype=np.float32)
+            if self._scales is not None:
+                scales[:self._size] = self._scales[:self._size]
+            self._scales = scales
+        self._capacity = capacity
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str):
+        """Write codes, scales and ids to a directory"""
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta = {'format': self.format, 'dimension': self.dimension, 'ids': self._ids}
+        self._write_atomic(path / 'meta.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+        self._write_atomic(path / 'codes.npy', lambda f: np.save(f, self.codes))
+        if self._scales is not None:
+            self._write_atomic(path / 'scales.npy', lambda f: np.save(f, self._scales[:self._size]))
+
+    @classmethod
+    def load(cls, path: str, full_vectors=None, mmap: bool = True) -> "QuantizedIndex":
+        """Load saved codes, memory-mapped copy-on-write by default"""
+        path = Path(path)
+        meta = json.loads((path / 'meta.json').read_text())
+        index = cls(meta['format'], meta['dimension'], full_vectors=full_vectors)
+        mode = 'c' if mmap else None
+        index._codes = np.load(path / 'codes.npy', mmap_mode=mode)
+        if (path / 'scales.npy').exists():
+            index._scales = np.load(path / 'scales.npy', mmap_mode=mode)
+        index._ids = list(meta['ids'])
+        index._rows = {id: row for row, id in enumerate(index._ids)}
+        index._size = len(index._ids)
+        index._capacity = max(1, index._size)
+        return index
+
+    @staticmethod
+    def _write_atomic(path: Path, write):
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
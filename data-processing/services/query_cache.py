@@ -0,0 +1,256 @@
+"""
+Result cache for search queries with TTL, LRU eviction and generation-based invalidation
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCacheBackend:
+    """In-process LRU with per-entry expiry"""
+
+    blocking = False
+
+    def __init__(self, max_items: int = None):
+        self.max_items = settings.query_cache_max_items if max_items is None else max_items
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def generation(self) -> int:
+        return self._generation
+
+    def bump_generation(self) -> int:
+        # Entries of older generations can never be read again; drop them now
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            return self._generation
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class RedisCacheBackend:
+    """Cache shared between processes through Redis (or a compatible server)
+
+    Entries expire with Redis TTLs; LRU eviction is left to the server's
+    ``maxmemory-policy`` (e.g. ``allkeys-lru``). The generation counter is a
+    Redis key, so a write in one process invalidates every process's view.
+    Calls are blocking network round trips, so ``QueryResultCache``'s async
+    methods run them in a thread.
+    """
+
+    blocking = True
+
+    def __init__(self, url: str = None, prefix: str = "avinci:search:"):
+        import redis
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url or settings.redis_url)
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(self.prefix + key)
+        return None if raw is None else json.loads(raw)
+
+    def set(self, key: str, value: Any, ttl_seconds: float):
+        self._client.set(self.prefix + key, json.dumps(value, default=str), px=max(1, int(ttl_seconds * 1000)))
+
+    def generation(self) -> int:
+        return int(self._client.get(self.prefix + "generation") or 0)
+
+    def bump_generation(self) -> int:
+        return int(self._client.incr(self.prefix + "generation"))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self._client.scan_iter(match=self.prefix + "q:*", count=1000))
+
+    def clear(self):
+        keys = list(self._client.scan_iter(match=self.prefix + "q:*", count=1000))
+        if keys:
+            self._client.delete(*keys)
+
+
+class QueryResultCache:
+    """Caches ranked search results keyed by normalized query, mode and filters
+
+    Every key includes the backend's generation counter; ``invalidate()``
+    bumps it whenever the indexed documents change, so stale results are
+    never served. For exact rankings (``prefix=True``) ``top_k`` is not
+    part of the key: each entry keeps the longest result list seen, and
+    smaller ``top_k`` requests are answered with its prefix. Rankings that
+    depend on ``top_k``, such as hybrid fusion over ``top_k``-scaled
+    candidate lists or approximate (IVF/HNSW) search, are cached per
+    ``top_k`` with ``prefix=False``.
+    """
+
+    def __init__(self, backend=None, ttl_seconds: float = None):
+        self.backend = backend if backend is not None else create_backend()
+        self.ttl_seconds = settings.query_cache_ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.prefix_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def normalize_query(query: str) -> str:
+        """Case- and whitespace-insensitive form of a query"""
+        return ' '.join(query.lower().split())
+
+    def make_key(self, query: str, mode: str = None, filters: Optional[Dict[str, Any]] = None,
+                 generation: int = None, top_k: int = None) -> str:
+        generation = self.backend.generation() if generation is None else generation
+        fields = [self.normalize_query(query), mode, filters or {}]
+        if top_k is not None:
+            fields.append(top_k)
+        payload = json.dumps(fields, sort_keys=True, default=str)
+        return f"q:{generation}:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+    def generation(self) -> int:
+        """Current generation; pass it to ``put`` when capturing it before a slow search"""
+        return self.backend.generation()
+
+    def get(self, query: str, top_k: int, mode: str = None, filters: Optional[Dict[str, Any]] = None,
+            generation: int = None, prefix: bool = True) -> Optional[List[Dict[str, Any]]]:
+        """Cached results for at least ``top_k`` hits, or None
+
+        With ``prefix=False`` only results cached for this exact ``top_k``
+        are returned.
+        """
+        entry = self.backend.get(self.make_key(query, mode, filters, generation, None if prefix else top_k))
+        # A list shorter than its top_k is everything that matched, so it answers any top_k
+        if entry is not None and (entry['top_k'] >= top_k or len(entry['results']) < entry['top_k']):
+            with self._lock:
+                self.hits += 1
+                if entry['top_k'] > top_k:
+                    self.prefix_hits += 1
+            # Copies, so callers can annotate results without touching the cache
+            return [dict(result) for result in entry['results'][:top_k]]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, query: str, top_k: int, results: List[Dict[str, Any]], mode: str = None,
+            filters: Optional[Dict[str, Any]] = None, generation: int = None, prefix: bool = True):
+        """Store results unless a longer list is already cached for the query
+
+        Results computed across a write are stored under the generation they
+        started in, so they are never served after it. Pass the same
+        ``prefix`` as to ``get``.
+        """
+        key = self.make_key(query, mode, filters, generation, None if prefix else top_k)
+        existing = self.backend.get(key)
+        if existing is not None and existing['top_k'] >= top_k:
+            return
+        self.backend.set(key, {'top_k': top_k, 'results': [dict(result) for result in results]},
+                         self.ttl_seconds)
+
+    async def lookup(self, query: str, top_k: int, mode: str = None, filters: Optional[Dict[str, Any]] = None,
+                     prefix: bool = True) -> Tuple[Optional[List[Dict[str, Any]]], int]:
+        """(cached results or None, generation) without blocking the event loop
+
+        Pass the generation to ``store`` with the results of the search.
+        """
+        return await self._call(self._lookup, query, top_k, mode, filters, prefix)
+
+    def _lookup(self, query: str, top_k: int, mode: str, filters: Optional[Dict[str, Any]], prefix: bool):
+        generation = self.backend.generation()
+        return self.get(query, top_k, mode, filters, generation, prefix), generation
+
+    async def store(self, query: str, top_k: int, results: List[Dict[str, Any]], mode: str = None,
+                    filters: Optional[Dict[str, Any]] = None, generation: int = None, prefix: bool = True):
+        """``put`` without blocking the event loop"""
+        await self._call(self.put, query, top_k, results, mode, filters, generation, prefix)
+
+    async def _call(self, fn, *args):
+        """Run a backend operation, in a thread when the backend does network I/O"""
+        if not getattr(self.backend, 'blocking', True):
+            return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, fn, *args)
+
+    def invalidate(self):
+        """Make every cached result unreachable (call after the index changes)"""
+        self.backend.bump_generation()
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters, hit rate and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'prefix_hits': self.prefix_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'invalidations': self.invalidations,
+                'evictions': self.backend.evictions,
+                'items': len(self.backend)
+            }
+
+    def clear(self):
+        self.backend.clear()
+
+
+def exact_ranking(mode: str, index_type: str) -> bool:
+    """Whether a search's top-k results are a prefix of its results for any larger k
+
+    True for BM25 and exact (flat) vector search; hybrid fusion draws
+    ``top_k``-scaled candidate lists and IVF/HNSW recall depends on k.
+    """
+    return mode == 'lexical' or (mode == 'vector' and index_type == 'flat')
+
+
+def create_backend(name: str = None):
+    """Backend named by ``settings.query_cache_backend``; falls back to memory if Redis is unavailable"""
+    name = (name or settings.query_cache_backend).lower()
+    if name == 'memory':
+        return MemoryCacheBackend()
+    if name != 'redis':
+        raise ValueError(f"Unknown query cache backend: {name}")
+    try:
+        backend = RedisCacheBackend()
+        backend._client.ping()
+        return backend
+    except Exception as e:
+        logger.warning(f"Redis query cache unavailable ({e}), using the in-process cache")
+        return MemoryCacheBackend()
@@ -0,0 +1,445 @@
+"""
+Sharded execution: AvinciDataProcessor shards in worker processes behind one coordinator
+"""
+
+import asyncio
+import hashlib
+import heapq
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from config.settings import settings
+from services.lexical_index import reciprocal_rank_fusion
+from services.query_cache import QueryResultCache, exact_ranking
+
+logger = logging.getLogger(__name__)
+
+# Settings naming files or directories; each shard gets its own copy
+SHARD_PATHS = ('vector_index_path', 'lexical_index_path', 'embedding_store_path', 'ingest_manifest_path',
+               'embedding_cache_path')
+# Pool sizes where 0 means every CPU core; shards split the cores between them instead
+SHARD_POOLS = ('nlp_workers', 'extract_workers', 'local_embedding_threads')
+
+
+def shard_of(document_id: Any, shards: int) -> int:
+    """Shard owning a document id; stable across processes and runs, unlike hash()"""
+    digest = hashlib.blake2b(str(document_id).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') % shards
+
+
+def shard_settings(shard: int, shards: int) -> Dict[str, Any]:
+    """The current settings with paths and pool sizes specific to one shard
+
+    Paths get a ``.shard-<i>-of-<n>`` suffix, so changing the shard count
+    starts from empty shards instead of serving documents from the wrong one.
+    """
+    values = {name: value for name, value in settings.model_dump().items() if value is not None}
+    for name in SHARD_PATHS:
+        path = Path(values[name])
+        values[name] = str(path.with_name(f"{path.stem}.shard-{shard}-of-{shards}{path.suffix}"))
+    cores = max(1, (os.cpu_count() or 1) // shards)
+    for name in SHARD_POOLS:
+        if not values.get(name):
+            values[name] = cores
+    return values
+
+
+def _sum_statistics(shards: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Corpus-wide BM25 statistics from each shard's ``term_statistics``"""
+    df: Dict[str, int] = {}
+    for shard in shards:
+        for term, count in shard['df'].items():
+            df[term] = df.get(term, 0) + count
+    return {'documents': sum(shard['documents'] for shard in shards),
+            'total_length': sum(shard['total_length'] for shard in shards), 'df': df}
+
+
+def _portable(error: BaseException) -> BaseException:
+    """The exception itself if it survives pickling, else a RuntimeError describing it"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+class _ShardWorker:
+    """Requests a coordinator can send to one shard's processor"""
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    async def process_documents(self, documents: List[Dict[str, Any]]) -> List[Any]:
+        results = await self.processor.process_documents(documents, return_exceptions=True)
+        return [_portable(result) if isinstance(result, BaseException) else result for result in results]
+
+    async def process_documents_incremental(self, documents: List[Dict[str, Any]],
+                                            delete_missing: bool) -> Dict[str, Any]:
+        return await self.processor.process_documents_incremental(documents, delete_missing=delete_missing)
+
+    async def embed_query(self, query: str):
+        return await self.processor.embedding_service.generate_embedding(query)
+
+    async def lexical_statistics(self, query: str) -> Dict[str, Any]:
+        return self.processor.lexical_index.term_statistics(query)
+
+    async def search(self, query: str, query_embedding, candidates: int, mode: str,
+                     filters: Optional[Dict[str, Any]],
+                     statistics: Optional[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """This shard's vector and/or BM25 candidates, each with its document"""
+        vector_service = self.processor.vector_service
+        selection = vector_service.select(filters) if filters else None
+        found = {}
+        if mode != 'lexical':
+            found['vector'] = await vector_service.search_similar(query_embedding, candidates, filters=selection)
+        if mode != 'vector':
+            allow = vector_service.id_filter(selection) if selection is not None else None
+            found['lexical'] = self.processor._with_documents(
+                self.processor.lexical_index.search(query, candidates, allow=allow, statistics=statistics))
+        return found
+
+    async def analyze_text(self, text: str, analyses: Optional[List[str]]) -> Dict[str, Any]:
+        return await self.processor.analyze_text(text, analyses)
+
+    async def stats(self) -> Dict[str, Any]:
+        return {'pid': os.getpid(), 'documents': len(self.processor.vector_service),
+                'lexical_documents': len(self.processor.lexical_index)}
+
+    async def get_metrics(self) -> Dict[str, Any]:
+        return self.processor.get_metrics()
+
+    async def save(self):
+        self.processor.vector_service.save()
+        self.processor.lexical_index.save()
+
+
+def _serve(shard: int, values: Dict[str, Any], setup: Optional[Callable], conn):
+    """Worker process entry point: configure the shard, build its processor, answer requests"""
+    for name, value in values.items():
+        setattr(settings, name, value)
+        # AvinciDataProcessor also reads a fresh Settings(), which takes these from the environment
+        os.environ[name.upper()] = str(value)
+    from main import AvinciDataProcessor
+
+    processor = AvinciDataProcessor()
+    if setup is not None:
+        setup(processor)
+    logger.info(f"Shard {shard} serving from pid {os.getpid()}")
+    asyncio.run(_answer(_ShardWorker(processor), conn))
+
+
+async def _answer(worker: _ShardWorker, conn):
+    loop = asyncio.get_running_loop()
+    tasks = set()
+
+    async def handle(request_id: int, method: str, args: tuple):
+        try:
+            reply = (request_id, True, await getattr(worker, method)(*args))
+        except Exception as e:
+            reply = (request_id, False, _portable(e))
+        try:
+            conn.send(reply)
+        except Exception as e:
+            conn.send((request_id, False, RuntimeError(f"Shard reply could not be sent: {e}")))
+
+    # Requests run concurrently, so a search is not queued behind an ingest batch
+    while True:
+        try:
+            message = await loop.run_in_executor(None, conn.recv)
+        except EOFError:
+            break
+        if message is None:
+            break
+        task = asyncio.create_task(handle(*message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    conn.close()
+
+
+class _ShardClient:
+    """Coordinator-side handle on one worker process
+
+    A reader thread resolves the futures of replies as they arrive, so any
+    number of requests can be in flight to the shard at once.
+    """
+
+    def __init__(self, shard: int, process, conn):
+        self.shard = shard
+        self.process = process
+        self.conn = conn
+        self._ids = itertools.count()
+        self._pending: Dict[int, Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, name=f'shard-{shard}-reader', daemon=True)
+        self._reader.start()
+
+    async def call(self, method: str, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = next(self._ids)
+        if self.process.exitcode is not None:
+            raise RuntimeError(f"Shard {self.shard} worker exited with code {self.process.exitcode}")
+        with self._lock:
+            self._pending[request_id] = (loop, future)
+        # Sent outside _lock so the reader thread can keep taking replies while a large request goes out
+        with self._send_lock:
+            self.conn.send((request_id, method, args))
+        return await future
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, value = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                pending = self._pending.pop(request_id, None)
+            if pending is not None:
+                loop, future = pending
+                loop.call_soon_threadsafe(self._resolve, future, ok, value)
+        with self._lock:
+            pending, self._pending = list(self._pending.values()), {}
+        for loop, future in pending:
+            loop.call_soon_threadsafe(self._resolve, future, False,
+                                      RuntimeError(f"Shard {self.shard} worker exited"))
+
+    @staticmethod
+    def _resolve(future: asyncio.Future, ok: bool, value: Any):
+        if future.done():
+            return
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+    def close(self, timeout: float):
+        with self._send_lock:
+            try:
+                self.conn.send(None)
+            except (OSError, ValueError):
+                pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            logger.warning(f"Shard {self.shard} did not stop within {timeout}s, terminating it")
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class ShardedProcessor:
+    """Partitions documents by id hash across worker processes, each a full AvinciDataProcessor
+
+    Every shard owns its vector index, BM25 index, embedding store and
+    models, and runs its ingest pipeline, NLP and searches in its own
+    interpreter, so CPU-bound stages use every core instead of sharing one
+    GIL. Searches fan out to all shards and the per-shard top-k lists are
+    merged. Vector scores are cosine similarities and merge exactly; BM25
+    scores are computed with term statistics summed over all shards, so
+    they match a single index too.
+
+    ``setup`` is called with each shard's processor before it serves; it
+    must be a module-level function so it can be sent to the workers. Use
+    as an async context manager, or call ``start()`` and ``close()``.
+    """
+
+    def __init__(self, shards: int = None, setup: Callable[[Any], None] = None):
+        self.shards = shards or settings.shard_count or os.cpu_count() or 1
+        self.setup = setup
+        self.query_cache = QueryResultCache() if settings.query_cache_enabled else None
+        self._clients: List[_ShardClient] = []
+        self._round_robin = itertools.count()
+
+    async def __aenter__(self) -> "ShardedProcessor":
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def start(self):
+        """Spawn the workers and wait until every shard has built its processor"""
+        if self._clients:
+            return
+        # Spawned, not forked: the coordinator has threads and an event loop running
+        context = multiprocessing.get_context('spawn')
+        for shard in range(self.shards):
+            parent, child = context.Pipe()
+            process = context.Process(target=_serve, args=(shard, shard_settings(shard, self.shards), self.setup, child),
+                                      name=f'avinci-shard-{shard}', daemon=True)
+            process.start()
+            child.close()
+            self._clients.append(_ShardClient(shard, process, parent))
+        try:
+            stats = await self.stats()
+        except Exception:
+            await self.close()
+            raise
+        logger.info(f"Started {self.shards} shards: pids {[shard['pid'] for shard in stats]}")
+
+    async def close(self, timeout: float = 30.0):
+        """Stop the workers after their in-flight requests finish"""
+        clients, self._clients = self._clients, []
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, client.close, timeout) for client in clients))
+
+    def _client(self, shard: int) -> _ShardClient:
+        if not self._clients:
+            raise RuntimeError("ShardedProcessor is not started; use 'async with' or call start()")
+        return self._clients[shard]
+
+    async def _all(self, method: str, *args) -> List[Any]:
+        return await asyncio.gather(*(self._client(shard).call(method, *args) for shard in range(self.shards)))
+
+    @staticmethod
+    async def _none():
+        return None
+
+    def _any(self) -> _ShardClient:
+        """Shards in turn, for work any of them can do"""
+        return self._client(next(self._round_robin) % self.shards)
+
+    def _partition(self, documents: Iterable[Dict[str, Any]]) -> List[Tuple[List[int], List[Dict[str, Any]]]]:
+        """(input positions, documents) per shard; documents without an id are spread in turn"""
+        parts = [([], []) for _ in range(self.shards)]
+        for position, document in enumerate(documents):
+            document_id = document.get('id')
+            shard = position % self.shards if document_id is None else shard_of(document_id, self.shards)
+            parts[shard][0].append(position)
+            parts[shard][1].append(document)
+        return parts
+
+    def _changed(self):
+        if self.query_cache is not None:
+            self.query_cache.invalidate()
+
+    async def process_documents(self, documents: List[Dict[str, Any]],
+                                return_exceptions: bool = False) -> List[Any]:
+        """Process a batch of documents, each on the shard owning its id
+
+        Same contract as ``AvinciDataProcessor.process_documents``: results
+        in input order, failures dropped unless ``return_exceptions``.
+        """
+        parts = [(shard, positions, batch) for shard, (positions, batch) in enumerate(self._partition(documents))
+                 if batch]
+        try:
+            replies = await asyncio.gather(*(self._client(shard).call('process_documents', batch)
+                                             for shard, _, batch in parts))
+        finally:
+            self._changed()
+        results: List[Any] = [None] * len(documents)
+        for (_, positions, _), reply in zip(parts, replies):
+            for position, result in zip(positions, reply):
+                results[position] = result
+
+        processed = []
+        for document, result in zip(documents, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error processing document {document.get('id', 'unknown')}: {result}")
+                if not return_exceptions:
+                    continue
+            processed.append(result)
+        logger.info(f"Processed {sum(not isinstance(r, BaseException) for r in results)} of {len(documents)} "
+                     f"documents on {len(parts)} shards")
+        return processed
+
+    async def process_documents_incremental(self, documents: Iterable[Dict[str, Any]],
+                                            delete_missing: bool = False) -> Dict[str, Any]:
+        """Incremental re-ingest on every shard, with the per-shard reports summed
+
+        With ``delete_missing`` every shard is asked, even those receiving
+        no documents, since all of theirs may have been deleted.
+        """
+        parts = self._partition(documents)
+        shards = [shard for shard, (_, batch) in enumerate(parts) if batch or delete_missing]
+        try:
+            reports = await asyncio.gather(*(self._client(shard).call('process_documents_incremental',
+                                                                      parts[shard][1], delete_missing)
+                                             for shard in shards))
+        finally:
+            self._changed()
+        merged = {
+            'documents': {'new': 0, 'changed': 0, 'unchanged': 0, 'deleted': 0, 'failed': 0},
+            'chunks': {'added': 0, 'kept': 0, 'removed': 0},
+            'embedded': 0,
+            'errors': {},
+            'seconds': 0.0,
+        }
+        for report in reports:
+            for section in ('documents', 'chunks'):
+                for key, count in report[section].items():
+                    merged[section][key] = merged[section].get(key, 0) + count
+            merged['embedded'] += report['embedded']
+            merged['errors'].update(report['errors'])
+            merged['seconds'] = max(merged['seconds'], report['seconds'])
+        return merged
+
+    async def search_documents(self, query: str, top_k: int = 10, mode: Optional[str] = None,
+                               filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Search every shard and merge their rankings
+
+        The query is embedded once, by one shard, and the vector sent to
+        all of them. For BM25 the shards' term statistics are summed first
+        and every shard scores with the totals, so scores match a single
+        index. Each shard returns its own top candidates, which contain the
+        global top-k; hybrid mode fuses the merged vector and BM25 lists
+        exactly as a single processor does.
+        """
+        mode = (mode or settings.search_mode).lower()
+        if mode not in ('vector', 'lexical', 'hybrid'):
+            raise ValueError(f"Unknown search mode: {mode}")
+        cache = self.query_cache
+        if cache is not None:
+            prefix = exact_ranking(mode, settings.vector_index_type.lower())
+            cached, generation = await cache.lookup(query, top_k, mode, filters, prefix)
+            if cached is not None:
+                return cached
+
+        candidates = top_k * settings.hybrid_candidates if mode == 'hybrid' else top_k
+        query_embedding, statistics = await asyncio.gather(
+            self._none() if mode == 'lexical' else self._any().call('embed_query', query),
+            self._none() if mode == 'vector' else self._all('lexical_statistics', query))
+        if statistics is not None:
+            statistics = _sum_statistics(statistics)
+        found = await self._all('search', query, query_embedding, candidates, mode, filters, statistics)
+
+        def merged(ranking: str) -> List[Dict[str, Any]]:
+            return heapq.nlargest(candidates, itertools.chain.from_iterable(shard[ranking] for shard in found),
+                                  key=lambda result: result['score'])
+
+        if mode == 'hybrid':
+            vector, lexical = merged('vector'), merged('lexical')
+            documents = {result['id']: result for result in itertools.chain(vector, lexical)}
+            fused = reciprocal_rank_fusion([[(r['id'], r['score']) for r in lexical],
+                                            [(r['id'], r['score']) for r in vector]])
+            results = [{**documents[id], 'score': score} for id, score in fused[:top_k]]
+        else:
+            results = merged(mode)[:top_k]
+
+        if cache is not None:
+            await cache.store(query, top_k, results, mode, filters, generation=generation, prefix=prefix)
+        return results
+
+    async def analyze_text(self, text: str, analyses: Optional[List[str]] = None) -> Dict[str, Any]:
+        """NLP analysis on the next shard in turn"""
+        return await self._any().call('analyze_text', text, analyses)
+
+    async def stats(self) -> List[Dict[str, Any]]:
+        """Worker pid and document counts of each shard"""
+        return await self._all('stats')
+
+    async def get_metrics(self) -> List[Dict[str, Any]]:
+        """Metrics snapshot of each shard"""
+        return await self._all('get_metrics')
+
+    async def save(self):
+        """Persist every shard's vector and BM25 index to its own paths"""
+        await self._all('save')
@@ -0,0 +1,365 @@
+"""
+Blockwise similarity, near-duplicate detection and clustering over embedding matrices
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config.settings import settings
+from services.embedding_store import EmbeddingStore
+from services.vector_index import VectorIndex, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+LINKAGES = ('average', 'single')
+
+
+class Pairs(NamedTuple):
+    """Row pairs ``first < second`` with their cosine similarity, most similar first"""
+    first: np.ndarray
+    second: np.ndarray
+    similarity: np.ndarray
+    ids: Optional[List] = None  # names of the rows, for a VectorIndex or EmbeddingStore
+
+
+class Clustering(NamedTuple):
+    labels: np.ndarray  # cluster of each row, numbered from 0 by decreasing size
+    centroids: np.ndarray  # normalized mean of each cluster
+    sizes: np.ndarray
+    ids: Optional[List] = None  # names of the rows, for a VectorIndex or EmbeddingStore
+
+
+def as_matrix(embeddings: Any) -> Tuple[np.ndarray, Optional[List]]:
+    """(normalized float32 matrix, ids or None) for a matrix, list, VectorIndex or EmbeddingStore
+
+    ``VectorIndex`` rows are already normalized and are used without a
+    copy. An ``EmbeddingStore`` contributes only the latest row of each
+    id that has not been deleted.
+    """
+    if isinstance(embeddings, VectorIndex):
+        return embeddings.matrix, embeddings.ids
+    if isinstance(embeddings, EmbeddingStore):
+        rows = embeddings.live_rows()
+        ids = [embeddings.ids[row] for row in rows]
+        matrix = embeddings.matrix()[rows]
+        return normalize_rows(matrix.astype(np.float32, copy=False)), ids
+    if np.size(embeddings) == 0:
+        return np.empty((0, 0), dtype=np.float32), None
+    matrix = np.array(embeddings, dtype=np.float32, ndmin=2)
+    if matrix.ndim != 2:
+        matrix = matrix.reshape(len(matrix), -1)
+    return normalize_rows(matrix), None
+
+
+def _blocks(count: int, block_size: int) -> List[int]:
+    return list(range(0, count, max(1, block_size)))
+
+
+def _map_blocks(fn: Callable[[int], Any], starts: Sequence[int], workers: int) -> Iterator[Any]:
+    """fn over block starts, in order
+
+    With several workers, ``workers`` blocks at a time run on a thread pool
+    (NumPy releases the GIL inside matrix products), so at most that many
+    results are held at once.
+    """
+    if workers <= 1 or len(starts) <= 1:
+        yield from map(fn, starts)
+        return
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='similarity') as executor:
+        for window in range(0, len(starts), workers):
+            yield from executor.map(fn, starts[window:window + workers])
+
+
+def iter_similarity_blocks(queries: np.ndarray, corpus: np.ndarray, block_size: int = None,
+                           workers: int = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """Yield ``(row, scores)`` for consecutive blocks of normalized query rows
+
+    Each block is ``block_size`` queries by the whole corpus, so memory is
+    bounded by the block rather than the full similarity matrix. With
+    ``workers`` > 1 blocks are scored on a thread pool, which helps when
+    BLAS itself runs single-threaded; results still come back in order.
+    """
+    block_size = block_size or settings.similarity_block_size
+    workers = workers or settings.similarity_workers
+    corpus_t = corpus.T
+    starts = _blocks(len(queries), block_size)
+    yield from zip(starts, _map_blocks(lambda start: queries[start:start + block_size] @ corpus_t,
+                                       starts, workers))
+
+
+def similarity_matrix(queries: Any, corpus: Any, block_size: int = None, workers: int = None,
+                      out: np.ndarray = None) -> np.ndarray:
+    """Cosine similarities of every query against every corpus row, shape (queries, corpus)
+
+    ``out`` may be a preallocated (e.g. memory-mapped) float32 array to
+    fill instead of allocating the result.
+    """
+    queries, _ = as_matrix(queries)
+    corpus, _ = as_matrix(corpus)
+    if out is None:
+        out = np.empty((len(queries), len(corpus)), dtype=np.float32)
+    elif out.shape != (len(queries), len(corpus)):
+        raise ValueError(f"out has shape {out.shape}, expected {(len(queries), len(corpus))}")
+    for start, scores in iter_similarity_blocks(queries, corpus, block_size, workers):
+        out[start:start + len(scores)] = scores
+    return out
+
+
+def near_duplicates(embeddings: Any, threshold: float = None, block_size: int = None,
+                    workers: int = None) -> Pairs:
+    """Every pair of rows whose cosine similarity is at least ``threshold``
+
+    Only the upper triangle is scored: a block of rows is compared with
+    itself and the rows after it, so each pair is computed once.
+    """
+    matrix, ids = as_matrix(embeddings)
+    return _near_duplicates(matrix, threshold, block_size, workers)._replace(ids=ids)
+
+
+def _near_duplicates(matrix: np.ndarray, threshold: float, block_size: int, workers: int) -> Pairs:
+    threshold = settings.near_duplicate_threshold if threshold is None else threshold
+    block_size = block_size or settings.similarity_block_size
+    workers = workers or settings.similarity_workers
+
+    def block_pairs(start: int):
+        scores = matrix[start:start + block_size] @ matrix[start:].T
+        rows, columns = np.nonzero(scores >= threshold)
+        upper = columns > rows
+        rows, columns = rows[upper], columns[upper]
+        return rows + start, columns + start, scores[rows, columns]
+
+    found = list(_map_blocks(block_pairs, _blocks(len(matrix), block_size), workers))
+    if not found:
+        empty = np.empty(0, dtype=np.int64)
+        return Pairs(empty, empty, np.empty(0, dtype=np.float32))
+    first, second, similarity = (np.concatenate(parts) for parts in zip(*found))
+    order = np.argsort(-similarity, kind='stable')
+    return Pairs(first[order].astype(np.int64), second[order].astype(np.int64), similarity[order])
+
+
+def _components(count: int, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+    """Connected component of each row given edges, via union-find"""
+    parent = np.arange(count)
+
+    def find(i: int) -> int:
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    for a, b in zip(first.tolist(), second.tolist()):
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[max(ra, rb)] = min(ra, rb)
+    return np.fromiter((find(i) for i in range(count)), dtype=np.int64, count=count)
+
+
+def duplicate_groups(embeddings: Any, threshold: float = None, block_size: int = None,
+                     workers: int = None) -> List[List[Any]]:
+    """Groups of two or more rows linked by near-duplicate pairs, largest first
+
+    Rows are named by id for a ``VectorIndex`` or ``EmbeddingStore`` and by
+    position otherwise.
+    """
+    matrix, ids = as_matrix(embeddings)
+    pairs = _near_duplicates(matrix, threshold, block_size, workers)
+    roots = _components(len(matrix), pairs.first, pairs.second)
+    groups: Dict[int, List[int]] = {}
+    for row in np.unique(np.concatenate([pairs.first, pairs.second])).tolist():
+        groups.setdefault(int(roots[row]), []).append(row)
+    ordered = sorted(groups.values(), key=lambda rows: (-len(rows), rows[0]))
+    return [rows if ids is None else [ids[row] for row in rows] for rows in ordered]
+
+
+def _assign(matrix: np.ndarray, centroids: np.ndarray, block_size: int, workers: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(nearest centroid, its similarity) for every row"""
+    labels = np.empty(len(matrix), dtype=np.int64)
+    best = np.empty(len(matrix), dtype=np.float32)
+    for start, scores in iter_similarity_blocks(matrix, centroids, block_size, workers):
+        block = scores.argmax(axis=1)
+        labels[start:start + len(block)] = block
+        best[start:start + len(block)] = scores[np.arange(len(block)), block]
+    return labels, best
+
+
+def _sums(matrix: np.ndarray, labels: np.ndarray, n_clusters: int) -> Tuple[np.ndarray, np.ndarray]:
+    """(sum of rows, row count) per cluster, without a Python loop over rows"""
+    order = np.argsort(labels, kind='stable')
+    sizes = np.bincount(labels, minlength=n_clusters)
+    sums = np.zeros((n_clusters, matrix.shape[1]), dtype=np.float32)
+    present = np.flatnonzero(sizes)
+    if len(present):
+        starts = np.concatenate([[0], np.cumsum(sizes[present])[:-1]])
+        sums[present] = np.add.reduceat(matrix[order], starts, axis=0)
+    return sums, sizes
+
+
+def _kmeans_plus_plus(matrix: np.ndarray, n_clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """Seed rows spread out by cosine distance (k-means++)"""
+    chosen = [int(rng.integers(len(matrix)))]
+    distance = np.maximum(1.0 - matrix @ matrix[chosen[0]], 0.0)
+    for _ in range(1, n_clusters):
+        total = float(distance.sum())
+        if total <= 0:
+            # Fewer distinct points than clusters; duplicate seeds end up empty and are reseeded
+            chosen.append(int(rng.integers(len(matrix))))
+            continue
+        chosen.append(int(rng.choice(len(matrix), p=distance / total)))
+        np.minimum(distance, np.maximum(1.0 - matrix @ matrix[chosen[-1]], 0.0), out=distance)
+    return matrix[chosen].copy()
+
+
+def _ordered(matrix: np.ndarray, labels: np.ndarray, n_clusters: int) -> Clustering:
+    """Renumber clusters by decreasing size and compute their centroids"""
+    sums, sizes = _sums(matrix, labels, n_clusters)
+    order = np.argsort(-sizes, kind='stable')
+    order = order[sizes[order] > 0]
+    renumber = np.empty(n_clusters, dtype=np.int64)
+    renumber[order] = np.arange(len(order))
+    return Clustering(renumber[labels], normalize_rows(sums[order]), sizes[order])
+
+
+def kmeans(embeddings: Any, n_clusters: int, max_iter: int = 50, tol: float = 1e-4, seed: int = 0,
+           init: str = 'k-means++', block_size: int = None, workers: int = None) -> Clustering:
+    """Spherical k-means: rows join the centroid with the highest cosine similarity
+
+    Seeded with k-means++ (or ``random`` rows, much cheaper for large
+    ``n_clusters``), then Lloyd iterations until fewer than ``tol`` of
+    the rows change cluster. Assignment is scored in blocks against all
+    centroids at once and centroids are recomputed with segment sums, so
+    each iteration is a handful of matrix operations. A cluster that empties
+    is reseeded with the row worst served by its centroid.
+    """
+    matrix, ids = as_matrix(embeddings)
+    return _kmeans(matrix, n_clusters, max_iter, tol, seed, init, block_size, workers)._replace(ids=ids)
+
+
+def _kmeans(matrix: np.ndarray, n_clusters: int, max_iter: int = 50, tol: float = 1e-4, seed: int = 0,
+            init: str = 'k-means++', block_size: int = None, workers: int = None) -> Clustering:
+    if not 0 < n_clusters <= len(matrix):
+        raise ValueError(f"n_clusters must be between 1 and the number of rows ({len(matrix)}), got {n_clusters}")
+    rng = np.random.default_rng(seed)
+    if init == 'k-means++':
+        centroids = _kmeans_plus_plus(matrix, n_clusters, rng)
+    elif init == 'random':
+        centroids = matrix[rng.choice(len(matrix), n_clusters, replace=False)].copy()
+    else:
+        raise ValueError(f"Unknown init: {init}, expected k-means++ or random")
+    labels = np.full(len(matrix), -1, dtype=np.int64)
+
+    for iteration in range(max_iter):
+        new_labels, best = _assign(matrix, centroids, block_size, workers)
+        changed = int(np.count_nonzero(new_labels != labels))
+        labels = new_labels
+        sums, sizes = _sums(matrix, labels, n_clusters)
+        for cluster in np.flatnonzero(sizes == 0):
+            row = int(best.argmin())
+            sums[cluster] = matrix[row]
+            best[row] = np.inf
+            changed += 1
+        centroids = normalize_rows(sums)
+        if changed <= tol * len(matrix):
+            break
+    logger.info(f"k-means on {len(matrix)} rows: {n_clusters} clusters after {iteration + 1} iterations")
+    return _ordered(matrix, labels, n_clusters)
+
+
+def _average_linkage(similarity: np.ndarray, sizes: np.ndarray) -> List[Tuple[int, int, float]]:
+    """Merges (a, b, similarity) of average-linkage clustering, via the nearest-neighbour chain
+
+    ``similarity`` is overwritten. Each merge keeps the lower index and
+    updates its row with the size-weighted mean (Lance-Williams), so the
+    whole run is O(n²) with one vectorized pass per step.
+    """
+    sizes = sizes.astype(np.float64)
+    np.fill_diagonal(similarity, -np.inf)
+    active = np.ones(len(similarity), dtype=bool)
+    merges = []
+    chain: List[int] = []
+    for _ in range(len(similarity) - 1):
+        if not chain:
+            chain.append(int(np.flatnonzero(active)[0]))
+        while True:
+            a = chain[-1]
+            b = int(similarity[a].argmax())
+            if len(chain) > 1 and similarity[a, chain[-2]] >= similarity[a, b]:
+                b = chain[-2]
+            if len(chain) > 1 and b == chain[-2]:
+                break
+            chain.append(b)
+        chain.pop()
+        chain.pop()
+        a, b = min(a, b), max(a, b)
+        merges.append((a, b, float(similarity[a, b])))
+        merged = (sizes[a] * similarity[a] + sizes[b] * similarity[b]) / (sizes[a] + sizes[b])
+        similarity[a] = merged
+        similarity[:, a] = merged
+        similarity[b] = -np.inf
+        similarity[:, b] = -np.inf
+        similarity[a, a] = -np.inf
+        sizes[a] += sizes[b]
+        active[b] = False
+    return merges
+
+
+def agglomerative(embeddings: Any, n_clusters: int = None, threshold: float = None, linkage: str = 'average',
+                  max_points: int = None, block_size: int = None, workers: int = None) -> Clustering:
+    """Hierarchical clustering cut at ``n_clusters`` or at a similarity ``threshold``
+
+    ``average`` linkage merges the pair of clusters with the highest mean
+    pairwise similarity. It needs a dense matrix, so beyond ``max_points``
+    rows k-means first reduces the input to that many micro-clusters; their
+    initial similarities are still exact averages, because the mean
+    pairwise dot product of two groups equals the dot product of their row
+    means. ``single`` linkage with a ``threshold`` joins every pair at least
+    that similar; it only scores the upper triangle block by block, so it
+    scales to any corpus.
+    """
+    if linkage not in LINKAGES:
+        raise ValueError(f"Unknown linkage: {linkage}, expected one of {LINKAGES}")
+    if (n_clusters is None) == (threshold is None):
+        raise ValueError("Pass exactly one of n_clusters or threshold")
+    matrix, ids = as_matrix(embeddings)
+    if n_clusters is not None and not 0 < n_clusters <= len(matrix):
+        raise ValueError(f"n_clusters must be between 1 and the number of rows ({len(matrix)}), got {n_clusters}")
+
+    if linkage == 'single':
+        if threshold is None:
+            raise ValueError("Single linkage is cut by threshold; use average linkage for n_clusters")
+        pairs = _near_duplicates(matrix, threshold, block_size, workers)
+        roots = _components(len(matrix), pairs.first, pairs.second)
+        _, labels = np.unique(roots, return_inverse=True)
+        return _ordered(matrix, labels, int(labels.max()) + 1 if len(labels) else 0)._replace(ids=ids)
+
+    max_points = max_points or settings.cluster_max_dense_points
+    if len(matrix) > max_points:
+        logger.info(f"Reducing {len(matrix)} rows to {max_points} k-means micro-clusters before average linkage")
+        # Micro-clusters only need to be tight, not well seeded
+        point_of_row = _kmeans(matrix, max_points, max_iter=10, tol=1e-3, init='random',
+                               block_size=block_size, workers=workers).labels
+    else:
+        point_of_row = np.arange(len(matrix))
+    n_points = int(point_of_row.max()) + 1
+    sums, sizes = _sums(matrix, point_of_row, n_points)
+    # Means of unit rows are shorter than unit length; scoring them unnormalized keeps the averages exact
+    means = sums / sizes[:, None]
+    similarity = np.empty((n_points, n_points), dtype=np.float32)
+    for start, scores in iter_similarity_blocks(means, means, block_size, workers):
+        similarity[start:start + len(scores)] = scores
+
+    merges = sorted(_average_linkage(similarity, sizes), key=lambda merge: -merge[2])
+    if n_clusters is not None:
+        merges = merges[:max(0, n_points - n_clusters)]
+    else:
+        merges = [merge for merge in merges if merge[2] >= threshold]
+    first = np.array([merge[0] for merge in merges], dtype=np.int64)
+    second = np.array([merge[1] for merge in merges], dtype=np.int64)
+    roots = _components(n_points, first, second)
+    _, point_labels = np.unique(roots, return_inverse=True)
+    labels = point_labels[point_of_row]
+    return _ordered(matrix, labels, int(labels.max()) + 1)._replace(ids=ids)
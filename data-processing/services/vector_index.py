@@ -0,0 +1,227 @@
+"""
+In-process exact vector index backed by a contiguous float32 matrix
+"""
+
+import logging
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Queries scored per matrix product in search_batch; bounds the score matrix
+QUERY_BLOCK_SIZE = 256
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize each row in place; zero rows stay zero"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+
+class VectorIndex:
+    """Exact cosine-similarity index
+
+    Embeddings are normalized once on insert and kept as rows of a single
+    contiguous float32 matrix, so scoring is one matrix product and top-k
+    selection is an ``argpartition`` over the scores. Rows are addressed by
+    caller-supplied ids; deletes move the last row into the freed slot so
+    the live rows always stay contiguous.
+    """
+
+    def __init__(self, dimension: int = None, capacity: int = 1024):
+        self.dimension = dimension
+        self._capacity = max(1, capacity)
+        self._matrix: Optional[np.ndarray] = None
+        self._size = 0
+        self._ids: List[Hashable] = []
+        self._rows: Dict[Hashable, int] = {}
+        self._id_array: Optional[np.ndarray] = None
+        if dimension:
+            self._matrix = np.empty((self._capacity, dimension), dtype=np.float32)
+
+    @classmethod
+    def from_embeddings(cls, embeddings: Sequence, ids: Optional[Sequence[Hashable]] = None) -> "VectorIndex":
+        """Build an index from a list or matrix of embeddings (ids default to positions)"""
+        matrix = np.asarray(embeddings, dtype=np.float32)
+        if matrix.ndim != 2:
+            matrix = matrix.reshape(len(matrix), -1)
+        index = cls(dimension=matrix.shape[1], capacity=len(matrix))
+        index.add(range(len(matrix)) if ids is None else ids, matrix)
+        return index
+
+    @classmethod
+    def from_normalized(cls, matrix: np.ndarray, ids: Sequence[Hashable]) -> "VectorIndex":
+        """Adopt an already-normalized matrix (e.g. a memmap) without copying it"""
+        if len(ids) != len(matrix):
+            raise ValueError(f"Got {len(ids)} ids for {len(matrix)} embeddings")
+        index = cls(capacity=len(matrix))
+        index.dimension = matrix.shape[1]
+        index._matrix = matrix
+        index._size = len(matrix)
+        index._ids = list(ids)
+        index._rows = {id: row for row, id in enumerate(index._ids)}
+        return index
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, id: Hashable) -> bool:
+        return id in self._rows
+
+    @property
+    def ids(self) -> List[Hashable]:
+        """Ids in row order"""
+        return list(self._ids)
+
+    @property
+    def id_array(self) -> np.ndarray:
+        """Ids in row order as an array, cached until the next add or delete"""
+        if self._id_array is None:
+            self._id_array = np.asarray(self._ids)
+        return self._id_array
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """View of the live, normalized rows"""
+        if self._matrix is None:
+            return np.empty((0, self.dimension or 0), dtype=np.float32)
+        return self._matrix[:self._size]
+
+    def add(self, ids: Iterable[Hashable], embeddings: Sequence) -> None:
+        """Insert embeddings, replacing any that already exist under the same id"""
+        ids = list(ids)
+        vectors = np.array(embeddings, dtype=np.float32, ndmin=2)
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} embeddings")
+        if not ids:
+            return
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected dimension {self.dimension}, got {vectors.shape[1]}")
+
+        normalize_rows(vectors)
+
+        # Existing ids are overwritten in place; for repeated ids the last one wins
+        pending: Dict[Hashable, int] = {}
+        for position, id in enumerate(ids):
+            row = self._rows.get(id)
+            if row is None:
+                pending[id] = position
+            else:
+                self._matrix[row] = vectors[position]
+
+        if not pending:
+            return
+        new_ids = list(pending)
+        new_rows = list(pending.values())
+        self._reserve(self._size + len(new_ids))
+        start = self._size
+        self._matrix[start:start + len(new_ids)] = vectors[new_rows]
+        for offset, id in enumerate(new_ids):
+            self._rows[id] = start + offset
+        self._ids.extend(new_ids)
+        self._size += len(new_ids)
+        self._id_array = None
+
+    def delete(self, ids: Iterable[Hashable]) -> int:
+        """Remove embeddings by id; returns how many were present"""
+        removed = 0
+        for id in ids:
+            row = self._rows.pop(id, None)
+            if row is None:
+                continue
+            last = self._size - 1
+            if row != last:
+                # Keep rows contiguous by moving the last one into the hole
+                moved = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+            self._ids.pop()
+            self._size -= 1
+            removed += 1
+        if removed:
+            self._id_array = None
+        return removed
+
+    def get(self, id: Hashable) -> Optional[np.ndarray]:
+        """Normalized embedding stored under ``id``"""
+        row = self._rows.get(id)
+        return None if row is None else self._matrix[row]
+
+    def search(self, query: Sequence[float], top_k: int = 10) -> List[Tuple[Hashable, float]]:
+        """Top-k (id, cosine similarity) pairs for one query, best first"""
+        return self.search_batch(np.array(query, dtype=np.float32, ndmin=2), top_k)[0]
+
+    def search_batch(self, queries: Sequence, top_k: int = 10) -> List[List[Tuple[Hashable, float]]]:
+        """Top-k (id, cosine similarity) pairs for each row of ``queries``"""
+        queries = np.array(queries, dtype=np.float32, ndmin=2)
+        if self._size == 0 or top_k <= 0:
+            return [[] for _ in range(len(queries))]
+        normalize_rows(queries)
+
+        k = min(top_k, self._size)
+        matrix = self.matrix
+        results = []
+        for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+            scores = queries[start:start + QUERY_BLOCK_SIZE] @ matrix.T
+            for row_scores in scores:
+                top = self._top_k(row_scores, k)
+                results.append([(self._ids[row], float(row_scores[row])) for row in top])
+        return results
+
+    def search_subset(self, query: Sequence[float], top_k: int = 10, rows: np.ndarray = None,
+                      mask: np.ndarray = None) -> List[Tuple[Hashable, float]]:
+        """Top-k over a subset of rows, best first
+
+        Pass ``rows`` (row positions) for small subsets: only those rows
+        are gathered and scored. Pass a boolean ``mask`` over the rows for
+        large ones: every row is scored and the rest are excluded before
+        top-k selection, which costs the same as an unfiltered search.
+        """
+        if self._size == 0 or top_k <= 0:
+            return []
+        query = normalize_rows(np.array(query, dtype=np.float32, ndmin=2))[0]
+        if rows is not None:
+            rows = np.asarray(rows, dtype=np.int64)
+            if not len(rows):
+                return []
+            scores = self.matrix[rows] @ query
+            top = self._top_k(scores, min(top_k, len(rows)))
+            return [(self._ids[rows[i]], float(scores[i])) for i in top]
+
+        selected = int(np.count_nonzero(mask))
+        if not selected:
+            return []
+        scores = self.matrix @ query
+        scores[~mask] = -np.inf
+        top = self._top_k(scores, min(top_k, selected))
+        return [(self._ids[row], float(scores[row])) for row in top]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Row positions of the k highest scores, best first"""
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+    def _reserve(self, size: int):
+        """Grow the backing matrix geometrically to hold ``size`` rows"""
+        if self._matrix is None:
+            self._capacity = max(self._capacity, size)
+            self._matrix = np.empty((self._capacity, self.dimension), dtype=np.float32)
+            return
+        if size <= len(self._matrix):
+            return
+        capacity = len(self._matrix)
+        while capacity < size:
+            capacity *= 2
+        grown = np.empty((capacity, self.dimension), dtype=np.float32)
+        grown[:self._size] = self._matrix[:self._size]
+        self._matrix = grown
+        self._capacity = capacity
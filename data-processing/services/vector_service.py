@@ -0,0 +1,625 @@
+"""
+Local vector storage and search with exact and approximate (FAISS) indexes
+"""
+
+import json
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Optional, Sequence
+
+import numpy as np
+
+from config.settings import settings
+from services.metadata_index import MetadataIndex, MetadataSelection
+from services.vector_index import VectorIndex, normalize_rows
+
+try:
+    import faiss
+except ImportError:  # flat mode does not need it
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw')
+
+# Filtered searches matching less than this share of the vectors score only the matches
+SPARSE_FILTER_FRACTION = 0.25
+
+
+class VectorService:
+    """Local vector store that needs no network
+
+    Three index modes are supported:
+
+    * ``flat``: exact search over a ``VectorIndex``
+    * ``ivf``: FAISS inverted file index (optionally PQ-compressed); vectors
+      are buffered in an exact index until there are enough to train the
+      coarse quantizer
+    * ``hnsw``: FAISS HNSW graph; deletes are tombstoned because the graph
+      does not support removal, searches exclude tombstones with an id
+      selector, and the graph is rebuilt from the live vectors once
+      ``hnsw_rebuild_fraction`` of it is tombstoned (and on ``save()``)
+
+    All modes use inner product over normalized vectors, i.e. cosine
+    similarity. Documents are addressed by string ids which map to the
+    int64 labels FAISS requires.
+
+    Metadata is indexed in a ``MetadataIndex`` keyed by the same labels, so
+    searches can be filtered before scoring: small selections are scored
+    directly, large ones are masked during the scan (exact vectors) or
+    passed to FAISS as an id selector. No results are overfetched.
+    """
+
+    def __init__(self, index_type: str = None, dimension: int = None, index_path: str = None):
+        self.index_type = (index_type or settings.vector_index_type).lower()
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown vector index type: {self.index_type}")
+        if self.index_type != 'flat' and faiss is None:
+            raise RuntimeError(f"faiss-cpu is required for '{self.index_type}' indexes")
+
+        self.dimension = dimension
+        self.index_path = index_path or settings.vector_index_path
+        self.nprobe = settings.ivf_nprobe
+        self.ef_search = settings.hnsw_ef_search
+
+        self._documents: Dict[str, Dict[str, Any]] = {}
+        self._labels: Dict[str, int] = {}
+        self._ids: Dict[int, str] = {}
+        self._next_label = 0
+        self._tombstones: set = set()
+        # Directory of a memory-mapped, read-only IVF index; see _ensure_writable()
+        self._mapped_path: Optional[Path] = None
+        self.metadata_index = MetadataIndex()
+        # label -> position caches for filtered search, rebuilt after writes
+        self._position_cache: Dict[str, Any] = {}
+
+        # Bumped on every change to the stored documents; see add_listener()
+        self.generation = 0
+        self._listeners: List[Callable[[], None]] = []
+
+        # Exact vectors: the whole store in flat mode, the training buffer in ivf mode
+        self._exact = VectorIndex(dimension=dimension)
+        self._ann = None
+
+    # ------------------------------------------------------------------
+    # Writes
+    # ------------------------------------------------------------------
+
+    async def store_document(self, content: str, embedding: Sequence[float],
+                             metadata: Dict[str, Any] = None, id: str = None) -> str:
+        """Store one document and return its id"""
+        ids = await self.store_documents(
+            contents=[content],
+            embeddings=[embedding],
+            metadatas=[metadata or {}],
+            ids=[id] if id else None
+        )
+        return ids[0]
+
+    async def store_documents(self, contents: List[str], embeddings: Sequence,
+                              metadatas: List[Dict[str, Any]] = None,
+                              ids: List[str] = None) -> List[str]:
+        """Upsert many documents in one call and return their ids"""
+        self._ensure_writable()
+        if not contents:
+            return []
+        metadatas = metadatas or [{} for _ in contents]
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in contents]
+        if not (len(contents) == len(metadatas) == len(ids) == len(embeddings)):
+            raise ValueError("contents, embeddings, metadatas and ids must have the same length")
+
+        vectors = normalize_rows(np.array(embeddings, dtype=np.float32, ndmin=2))
+        if self.dimension is None:
+            self.dimension = vectors.shape[1]
+        elif vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected dimension {self.dimension}, got {vectors.shape[1]}")
+
+        # Replaced documents get a fresh label so every index mode can handle them
+        self._remove_labels([self._labels[id] for id in ids if id in self._labels])
+        labels = np.arange(self._next_label, self._next_label + len(ids), dtype=np.int64)
+        self._next_label += len(ids)
+        for id, label, content, metadata in zip(ids, labels.tolist(), contents, metadatas):
+            self._labels[id] = label
+            self._ids[label] = id
+            self._documents[id] = {'content': content, 'metadata': metadata}
+        self.metadata_index.add(labels, metadatas)
+
+        self._add_vectors(labels, vectors)
+        self._changed()
+        return ids
+
+    async def delete_documents(self, ids: List[str]) -> int:
+        """Delete documents by id; returns how many existed"""
+        self._ensure_writable()
+        labels = [self._labels[id] for id in ids if id in self._labels]
+        self._remove_labels(labels)
+        if labels:
+            self._changed()
+        return len(labels)
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> int:
+        """Replace stored documents' metadata without touching their vectors"""
+        self._ensure_writable()
+        labels, old, new = [], [], []
+        for id, metadata in zip(ids, metadatas):
+            document = self._documents.get(id)
+            if document is not None:
+                labels.append(self._labels[id])
+                old.append(document['metadata'])
+                new.append(metadata)
+                document['metadata'] = metadata
+        if labels:
+            self.metadata_index.remove(labels, old)
+            self.metadata_index.add(labels, new)
+            self._changed()
+        return len(labels)
+
+    def add_listener(self, callback: Callable[[], None]):
+        """Call ``callback`` after every change to the stored documents, e.g. to invalidate caches"""
+        self._listeners.append(callback)
+
+    def _changed(self):
+        self.generation += 1
+        self._position_cache = {}
+        for callback in self._listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Vector store change listener failed: {e}")
+
+    def _add_vectors(self, labels: np.ndarray, vectors: np.ndarray):
+        if self.index_type == 'flat':
+            self._exact.add(labels.tolist(), vectors)
+            return
+
+        if self._ann is None:
+            self._ann = self._new_ann_index(self.dimension)
+
+        if self.index_type == 'ivf' and not self._ann.is_trained:
+            self._exact.add(labels.tolist(), vectors)
+            if len(self._exact) >= self._train_size():
+                self.train()
+            return
+
+        self._ann.add_with_ids(vectors, labels)
+
+    def _remove_labels(self, labels: List[int]):
+        if not labels:
+            return
+        removed_labels, removed_metadatas = [], []
+        for label in labels:
+            id = self._ids.pop(label, None)
+            if id is not None and self._labels.get(id) == label:
+                del self._labels[id]
+                document = self._documents.pop(id, None)
+                if document is not None:
+                    removed_labels.append(label)
+                    removed_metadatas.append(document['metadata'])
+        self.metadata_index.remove(removed_labels, removed_metadatas)
+
+        self._exact.delete(labels)
+        if self._ann is None:
+            return
+        if self.index_type == 'hnsw':
+            self._tombstones.update(labels)
+            if len(self._tombstones) > settings.hnsw_rebuild_fraction * self._ann.ntotal:
+                self._rebuild_hnsw()
+        else:
+            self._ann.remove_ids(np.asarray(labels, dtype=np.int64))
+
+    # ------------------------------------------------------------------
+    # Index construction and training
+    # ------------------------------------------------------------------
+
+    def _new_ann_index(self, dimension: int):
+        if self.index_type == 'ivf':
+            quantizer = faiss.IndexFlatIP(dimension)
+            if settings.ivf_pq_m > 0:
+                index = faiss.IndexIVFPQ(quantizer, dimension, settings.ivf_nlist, settings.ivf_pq_m, 8,
+                                         faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexIVFFlat(quantizer, dimension, settings.ivf_nlist, faiss.METRIC_INNER_PRODUCT)
+            index.nprobe = self.nprobe
+            return index
+
+        index = faiss.IndexHNSWFlat(dimension, settings.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = settings.hnsw_ef_construction
+        index.hnsw.efSearch = self.ef_search
+        # HNSW cannot add with ids itself, the id map supplies them
+        return faiss.IndexIDMap2(index)
+
+    def _rebuild_hnsw(self):
+        """Rebuild the HNSW graph from its live vectors, dropping tombstoned entries"""
+        labels, vectors = self._hnsw_vectors()
+        logger.info(f"Rebuilding HNSW index: {len(labels)} live, {len(self._tombstones)} tombstoned vectors")
+        index = self._new_ann_index(self.dimension)
+        if len(labels):
+            index.add_with_ids(np.ascontiguousarray(vectors), labels)
+        self._ann = index
+        self._tombstones = set()
+        self._position_cache = {}
+
+    def _train_size(self) -> int:
+        return settings.ivf_train_size or 39 * settings.ivf_nlist
+
+    def train(self, embeddings: Sequence = None):
+        """Train the IVF coarse quantizer (and PQ codebooks)
+
+        Trains on ``embeddings`` when given, otherwise on the buffered
+        vectors, then moves the buffer into the trained index.
+        """
+        if self.index_type != 'ivf':
+            return
+        if self._ann is None:
+            if self.dimension is None:
+                if embeddings is None:
+                    raise ValueError("Nothing to train on yet")
+                self.dimension = np.asarray(embeddings[0]).shape[-1]
+            self._ann = self._new_ann_index(self.dimension)
+
+        if embeddings is not None:
+            sample = normalize_rows(np.array(embeddings, dtype=np.float32, ndmin=2))
+        else:
+            sample = np.ascontiguousarray(self._exact.matrix)
+        logger.info(f"Training IVF index on {len(sample)} vectors")
+        self._ann.train(sample)
+
+        if len(self._exact):
+            labels = np.asarray(self._exact.ids, dtype=np.int64)
+            self._ann.add_with_ids(np.ascontiguousarray(self._exact.matrix), labels)
+            self._exact = VectorIndex(dimension=self.dimension)
+        # Approximate results can differ once the buffer moves into the trained index
+        self._changed()
+
+    # ------------------------------------------------------------------
+    # Search
+    # ------------------------------------------------------------------
+
+    async def search_similar(self, query_embedding: Sequence[float], top_k: int = 10,
+                             nprobe: int = None, ef_search: int = None,
+                             filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Return the top-k most similar documents, best first
+
+        ``filters`` restricts the search to documents whose metadata
+        matches (see ``MetadataIndex`` for the syntax); a selection from
+        ``select()`` can be passed instead to reuse it.
+        """
+        if isinstance(filters, MetadataSelection):
+            selection = filters
+        else:
+            selection = self.select(filters) if filters else None
+        hits = self._search_labels(np.array(query_embedding, dtype=np.float32, ndmin=2), top_k,
+                                   nprobe=nprobe, ef_search=ef_search, selection=selection)
+        results = []
+        for label, score in hits:
+            id = self._ids.get(label)
+            if id is None:
+                continue
+            document = self._documents[id]
+            results.append({
+                'id': id,
+                'score': score,
+                'content': document['content'],
+                'metadata': document['metadata']
+            })
+        return results
+
+    def select(self, filters: Dict[str, Any]) -> MetadataSelection:
+        """Documents whose metadata matches ``filters``"""
+        return self.metadata_index.select(filters)
+
+    def id_filter(self, selection: MetadataSelection) -> Callable[[Sequence[str]], np.ndarray]:
+        """Predicate telling which of a list of document ids are in ``selection``"""
+        def allow(ids: Sequence[str]) -> np.ndarray:
+            labels = np.fromiter((self._labels.get(id, -1) for id in ids), dtype=np.int64, count=len(ids))
+            return selection.contains(labels)
+        return allow
+
+    def get_documents(self, ids: Sequence[str]) -> List[Optional[Dict[str, Any]]]:
+        """Stored content and metadata for ids, None for unknown ids"""
+        results = []
+        for id in ids:
+            document = self._documents.get(id)
+            results.append(None if document is None else
+                           {'id': id, 'content': document['content'], 'metadata': document['metadata']})
+        return results
+
+    def _search_labels(self, query: np.ndarray, top_k: int, nprobe: int = None,
+                       ef_search: int = None, selection: MetadataSelection = None) -> List[tuple]:
+        """(label, score) pairs for a single query, best first"""
+        if top_k <= 0 or (selection is not None and not selection.count):
+            return []
+        if not len(self._exact):
+            hits = []
+        elif selection is None:
+            hits = self._exact.search(query[0], top_k)
+        else:
+            hits = self._search_exact_selected(query[0], top_k, selection)
+        if self._ann is None or self._ann.ntotal == 0:
+            return hits
+
+        query = normalize_rows(query.copy())
+        if selection is None:
+            self._set_search_params(nprobe or self.nprobe, ef_search or self.ef_search)
+            k = min(top_k, self._ann.ntotal)
+            if self._tombstones:
+                params = faiss.SearchParametersHNSW(sel=self._live_selector(),
+                                                    efSearch=max(ef_search or self.ef_search, top_k))
+                scores, labels = self._ann.search(query, k, params=params)
+            else:
+                scores, labels = self._ann.search(query, k)
+        else:
+            scores, labels = self._search_ann_selected(query, top_k, selection, nprobe or self.nprobe,
+                                                       ef_search or self.ef_search)
+        for label, score in zip(labels[0].tolist(), scores[0].tolist()):
+            if label >= 0:
+                hits.append((label, score))
+
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:top_k]
+
+    def _live_selector(self):
+        """FAISS id selector passing every label that is not tombstoned"""
+        cached = self._position_cache.get('live')
+        if cached is None:
+            tombstones = np.fromiter(self._tombstones, dtype=np.int64, count=len(self._tombstones))
+            batch = faiss.IDSelectorBatch(len(tombstones), faiss.swig_ptr(tombstones))
+            # The selectors hold raw pointers, so their Python objects are kept alive together
+            cached = self._position_cache['live'] = (batch, faiss.IDSelectorNot(batch))
+        return cached[1]
+
+    def _is_sparse(self, selection: MetadataSelection, total: int) -> bool:
+        return selection.count < SPARSE_FILTER_FRACTION * total
+
+    def _search_exact_selected(self, query: np.ndarray, top_k: int, selection: MetadataSelection) -> List[tuple]:
+        """Filtered exact search: gather the matching rows, or mask the full scan when most rows match"""
+        row_labels = self._exact.id_array
+        if not self._is_sparse(selection, len(row_labels)):
+            return self._exact.search_subset(query, top_k, mask=selection.contains(row_labels))
+        row_of_label = self._position_cache.get('exact')
+        if row_of_label is None:
+            row_of_label = np.full(self._next_label, -1, dtype=np.int64)
+            row_of_label[row_labels] = np.arange(len(row_labels))
+            self._position_cache['exact'] = row_of_label
+        labels = selection.labels()
+        rows = row_of_label[labels[labels < len(row_of_label)]]
+        return self._exact.search_subset(query, top_k, rows=rows[rows >= 0])
+
+    def _search_ann_selected(self, query: np.ndarray, top_k: int, selection: MetadataSelection,
+                             nprobe: int, ef_search: int):
+        """Filtered FAISS search; (scores, labels) arrays shaped like ``Index.search`` output"""
+        sparse = self._is_sparse(selection, self._ann.ntotal)
+        if self.index_type == 'hnsw' and sparse:
+            # A graph walk through mostly excluded nodes loses recall; score the matches directly
+            return self._search_hnsw_exact(query, top_k, selection)
+
+        bitmap = selection.bitmap()
+        selector = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+        if self.index_type == 'ivf':
+            # Probing every list finds sparse matches wherever they sit; non-matching ids are skipped cheaply
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self._ann.nlist if sparse else nprobe)
+        else:
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(ef_search, top_k))
+        k = min(top_k, selection.count)
+        return self._ann.search(query, k, params=params)
+
+    def _search_hnsw_exact(self, query: np.ndarray, top_k: int, selection: MetadataSelection):
+        cached = self._position_cache.get('hnsw')
+        if cached is None:
+            inner = faiss.downcast_index(self._ann.index)
+            storage = faiss.downcast_index(inner.storage)
+            vectors = faiss.rev_swig_ptr(storage.get_xb(), self._ann.ntotal * self.dimension)
+            vectors = vectors.reshape(self._ann.ntotal, self.dimension)
+            ann_labels = faiss.vector_to_array(self._ann.id_map)
+            position_of_label = np.full(self._next_label, -1, dtype=np.int64)
+            position_of_label[ann_labels] = np.arange(len(ann_labels))
+            cached = self._position_cache['hnsw'] = (vectors, ann_labels, position_of_label)
+        vectors, ann_labels, position_of_label = cached
+
+        labels = selection.labels()
+        positions = position_of_label[labels[labels < len(position_of_label)]]
+        positions = positions[positions >= 0]
+        scores = vectors[positions] @ query[0]
+        k = min(top_k, len(positions))
+        top = np.argpartition(-scores, k - 1)[:k] if 0 < k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return scores[top][None, :], ann_labels[positions[top]][None, :]
+
+    def _set_search_params(self, nprobe: int, ef_search: int):
+        if self.index_type == 'ivf':
+            self._ann.nprobe = nprobe
+        elif self.index_type == 'hnsw':
+            faiss.downcast_index(self._ann.index).hnsw.efSearch = ef_search
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    # ------------------------------------------------------------------
+    # Persistence
+    # ------------------------------------------------------------------
+
+    def save(self, path: str = None):
+        """Write the index and document store to a directory"""
+        path = Path(path or self.index_path)
+        path.mkdir(parents=True, exist_ok=True)
+        if self._tombstones and self._ann is not None:
+            self._rebuild_hnsw()
+
+        meta = {
+            'index_type': self.index_type,
+            'dimension': self.dimension,
+            'next_label': self._next_label,
+            'tombstones': sorted(self._tombstones)
+        }
+        self._write_atomic(path / 'meta.json', lambda f: f.write(json.dumps(meta).encode('utf-8')))
+
+        def write_documents(f):
+            for id, label in self._labels.items():
+                document = self._documents[id]
+                record = {'id': id, 'label': label, 'content': document['content'],
+                          'metadata': document['metadata']}
+                f.write(json.dumps(record, default=str).encode('utf-8') + b'\n')
+        self._write_atomic(path / 'documents.jsonl', write_documents)
+
+        self._write_atomic(path / 'vectors.npy', lambda f: np.save(f, self._exact.matrix))
+        self._write_atomic(path / 'labels.npy',
+                           lambda f: np.save(f, np.asarray(self._exact.ids, dtype=np.int64)))
+        if self._ann is not None:
+            tmp = str(path / 'index.faiss.tmp')
+            faiss.write_index(self._ann, tmp)
+            os.replace(tmp, path / 'index.faiss')
+        logger.info(f"Saved {len(self)} documents to {path}")
+
+    def load(self, path: str = None, mmap: bool = True):
+        """Load a saved index, memory-mapping vectors where possible
+
+        Exact vectors are mapped copy-on-write. IVF inverted lists are mapped
+        read-only and read into memory on the first write, so a loaded
+        service stays writable; ``mmap=False`` reads everything up front.
+        """
+        path = Path(path or self.index_path)
+        meta = json.loads((path / 'meta.json').read_text())
+        self.index_type = meta['index_type']
+        self.dimension = meta['dimension']
+        self._next_label = meta['next_label']
+        self._tombstones = set(meta.get('tombstones', []))
+
+        self._documents, self._labels, self._ids = {}, {}, {}
+        with open(path / 'documents.jsonl', 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                self._documents[record['id']] = {'content': record['content'], 'metadata': record['metadata']}
+                self._labels[record['id']] = record['label']
+                self._ids[record['label']] = record['id']
+        # The metadata index is rebuilt rather than stored
+        self.metadata_index = MetadataIndex()
+        self.metadata_index.add(list(self._labels.values()),
+                                [self._documents[id]['metadata'] for id in self._labels])
+
+        vectors = np.load(path / 'vectors.npy', mmap_mode='c' if mmap else None)
+        labels = np.load(path / 'labels.npy')
+        if len(vectors):
+            self._exact = VectorIndex.from_normalized(vectors, labels.tolist())
+        else:
+            self._exact = VectorIndex(dimension=self.dimension)
+
+        self._ann = None
+        self._mapped_path = None
+        if (path / 'index.faiss').exists():
+            if faiss is None:
+                raise RuntimeError(f"faiss-cpu is required to load '{self.index_type}' indexes")
+            if mmap and self.index_type == 'ivf':
+                self._ann = faiss.read_index(str(path / 'index.faiss'), faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self._mapped_path = path
+            else:
+                self._ann = faiss.read_index(str(path / 'index.faiss'))
+        self._changed()
+        logger.info(f"Loaded {len(self)} documents from {path}")
+
+    def _ensure_writable(self):
+        """Replace a memory-mapped IVF index with an in-memory copy before the first write"""
+        if self._mapped_path is None:
+            return
+        self._ann = faiss.read_index(str(self._mapped_path / 'index.faiss'))
+        logger.info(f"Read memory-mapped index at {self._mapped_path} into memory for writing")
+        self._mapped_path = None
+
+    @staticmethod
+    def _write_atomic(path: Path, write):
+        tmp = path.with_name(path.name + '.tmp')
+        with open(tmp, 'wb') as f:
+            write(f)
+        os.replace(tmp, path)
+
+    # ------------------------------------------------------------------
+    # Evaluation
+    # ------------------------------------------------------------------
+
+    def _all_vectors(self):
+        """(labels, normalized vectors) of everything stored, for exact comparison"""
+        labels, vectors = [], []
+        if len(self._exact):
+            labels.append(np.asarray(self._exact.ids, dtype=np.int64))
+            vectors.append(self._exact.matrix)
+        if self._ann is not None and self._ann.ntotal:
+            if self.index_type == 'hnsw':
+                ann_labels, ann_vectors = self._hnsw_vectors()
+            else:
+                invlists = self._ann.invlists
+                ann_labels = np.concatenate([
+                    faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+                    for l in range(self._ann.nlist) if invlists.list_size(l)
+                ])
+                # A hashtable direct map lets IVF reconstruct arbitrary labels
+                self._ann.set_direct_map_type(faiss.DirectMap.Hashtable)
+                try:
+                    ann_vectors = self._ann.reconstruct_batch(ann_labels)
+                finally:
+                    self._ann.set_direct_map_type(faiss.DirectMap.NoMap)
+            labels.append(ann_labels)
+            vectors.append(ann_vectors)
+        if not labels:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dimension or 0), dtype=np.float32)
+        return np.concatenate(labels), np.concatenate(vectors)
+
+    def _hnsw_vectors(self):
+        """(labels, vectors) in the HNSW graph, leaving out tombstoned entries"""
+        inner = faiss.downcast_index(self._ann.index)
+        ann_labels = faiss.vector_to_array(self._ann.id_map)
+        ann_vectors = inner.reconstruct_n(0, self._ann.ntotal)
+        keep = ~np.isin(ann_labels, list(self._tombstones))
+        return ann_labels[keep], ann_vectors[keep]
+
+    def recall_report(self, queries: Sequence, top_k: int = 10,
+                      nprobe_values: Sequence[int] = (1, 4, 16, 64),
+                      ef_search_values: Sequence[int] = (16, 32, 64, 128)) -> List[Dict[str, Any]]:
+        """Recall@k and per-query latency of this index against exact search
+
+        Returns one row for exact search followed by one row per
+        nprobe (ivf) or efSearch (hnsw) setting. For PQ-compressed IVF the
+        "exact" baseline is computed from the reconstructed vectors.
+        """
+        queries = normalize_rows(np.array(queries, dtype=np.float32, ndmin=2))
+        labels, vectors = self._all_vectors()
+        exact = VectorIndex.from_normalized(np.ascontiguousarray(vectors, dtype=np.float32), labels.tolist())
+
+        truth, latencies = [], []
+        for query in queries:
+            start = time.perf_counter()
+            truth.append({label for label, _ in exact.search(query, top_k)})
+            latencies.append(time.perf_counter() - start)
+        report = [self._report_row('exact', None, 1.0, latencies)]
+
+        if self.index_type == 'flat':
+            return report
+        if self.index_type == 'ivf':
+            param, values = 'nprobe', nprobe_values
+        else:
+            param, values = 'ef_search', ef_search_values
+
+        for value in values:
+            found, latencies = 0, []
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                hits = self._search_labels(query[None, :], top_k, **{param: value})
+                latencies.append(time.perf_counter() - start)
+                found += len(expected & {label for label, _ in hits})
+            expected_total = sum(len(expected) for expected in truth) or 1
+            report.append(self._report_row(param, value, found / expected_total, latencies))
+        self._set_search_params(self.nprobe, self.ef_search)
+        return report
+
+    def _report_row(self, param: str, value: Optional[int], recall: float,
+                    latencies: List[float]) -> Dict[str, Any]:
+        latencies_ms = np.asarray(latencies) * 1000
+        return {
+            'index_type': self.index_type if param != 'exact' else 'exact',
+            'param': param,
+            'value': value,
+            'recall_at_k': round(recall, 4),
+            'mean_latency_ms': float(latencies_ms.mean()) if len(latencies_ms) else 0.0,
+            'p95_latency_ms': float(np.percentile(latencies_ms, 95)) if len(latencies_ms) else 0.0
+        }
@@ -0,0 +1,22 @@
+"""
+Shared test setup; run ``python -m pytest`` from the data-processing directory
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Services import ``config`` and ``services`` as top-level packages
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from config.settings import settings  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def restore_settings():
+    """Undo changes a test makes to the process-wide settings"""
+    saved = dict(settings.__dict__)
+    yield
+    for name, value in saved.items():
+        setattr(settings, name, value)
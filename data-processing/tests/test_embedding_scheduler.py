@@ -0,0 +1,181 @@
+"""
+EmbeddingScheduler batching, retries and rate limits
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from config.settings import settings
+from services import embedding_scheduler
+from services.embedding_scheduler import EmbeddingScheduler, TokenBucket
+
+
+class _APIError(Exception):
+    """Shaped like the OpenAI client's status errors"""
+
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(status_code=status_code, headers=headers or {})
+
+
+class _Server:
+    """request_fn that fails with queued errors first, then embeds each text as [len(text)]"""
+
+    def __init__(self, *errors, latency: float = 0):
+        self.errors = list(errors)
+        self.latency = latency
+        self.requests = []
+
+    async def __call__(self, texts, model):
+        self.requests.append(list(texts))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        return np.array([[len(text)] for text in texts], dtype=np.float32)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record backoff delays instead of waiting them out"""
+    delays = []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        delays.append(delay)
+        await real_sleep(0)
+
+    monkeypatch.setattr(embedding_scheduler.asyncio, 'sleep', sleep)
+    return delays
+
+
+def _scheduler(server, **kwargs) -> EmbeddingScheduler:
+    options = dict(tokens_per_minute=0, requests_per_minute=0, coalesce_ms=0, retry_attempts=3)
+    options.update(kwargs)
+    return EmbeddingScheduler(server, **options)
+
+
+def test_batches_split_on_token_and_input_limits():
+    scheduler = _scheduler(_Server(), max_batch_inputs=3, max_batch_tokens=100)
+    # An input over the token limit still goes out, alone
+    assert scheduler.plan_batches([40, 40, 40, 10, 200, 5]) == [[0, 1], [2, 3], [4], [5]]
+    assert scheduler.plan_batches([1] * 7) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert scheduler.plan_batches([100, 1]) == [[0], [1]]
+    assert scheduler.plan_batches([]) == []
+
+
+def test_embed_many_keeps_input_order_across_batches():
+    server = _Server()
+    scheduler = _scheduler(server, max_batch_inputs=2, max_batch_tokens=10)
+    texts = ['a', 'bb', 'ccc', 'dddd', 'eeeee']
+    embeddings = asyncio.run(scheduler.embed_many(texts, [4, 4, 4, 4, 4], 'model'))
+    assert embeddings[:, 0].tolist() == [1, 2, 3, 4, 5]
+    assert sorted(map(len, server.requests)) == [1, 2, 2]
+    assert scheduler.stats['requests'] == 3 and scheduler.stats['tokens'] == 20
+
+
+def test_coalesced_calls_share_a_request():
+    server = _Server()
+    scheduler = _scheduler(server, coalesce_ms=20)
+
+    async def run():
+        return await asyncio.gather(*(scheduler.embed('x' * n, n, 'model') for n in range(1, 6)))
+
+    embeddings = asyncio.run(run())
+    assert [float(embedding[0]) for embedding in embeddings] == [1, 2, 3, 4, 5]
+    assert len(server.requests) == 1 and scheduler.stats['coalesced'] == 5
+
+
+def test_transient_errors_are_retried(sleeps):
+    settings.retry_backoff_base_seconds = 0.5
+    settings.retry_backoff_max_seconds = 1.0
+    server = _Server(_APIError(500), ConnectionError("reset"), _APIError(409))
+    scheduler = _scheduler(server)
+    embeddings = asyncio.run(scheduler.embed_many(['abc'], [1], 'model'))
+    assert embeddings.tolist() == [[3.0]]
+    assert len(server.requests) == 4 and scheduler.stats['retries'] == 3
+    # Full jitter under a doubling ceiling that stops at the maximum
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= ceiling for delay, ceiling in zip(sleeps, [0.5, 1.0, 1.0]))
+
+
+def test_client_errors_and_exhausted_retries_raise(sleeps):
+    server = _Server(_APIError(400))
+    scheduler = _scheduler(server)
+    with pytest.raises(_APIError):
+        asyncio.run(scheduler.embed_many(['abc'], [1], 'model'))
+    assert len(server.requests) == 1 and not sleeps and scheduler.stats['failures'] == 1
+
+    server = _Server(*[_APIError(503)] * 3)
+    scheduler = _scheduler(server, retry_attempts=2)
+    with pytest.raises(_APIError):
+        asyncio.run(scheduler.embed_many(['abc'], [1], 'model'))
+    assert len(server.requests) == 3 and scheduler.stats['retries'] == 2
+
+
+def test_timeouts_are_retried():
+    settings.retry_backoff_base_seconds = 0.001
+    server = _Server(latency=0.05)
+    scheduler = _scheduler(server, timeout_seconds=0.01, retry_attempts=1)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(scheduler.embed_many(['abc'], [1], 'model'))
+    assert len(server.requests) == 2 and scheduler.stats['retries'] == 1
+
+
+def test_backoff_waits_at_least_retry_after(sleeps):
+    settings.retry_backoff_base_seconds = 0.01
+    settings.retry_backoff_max_seconds = 0.01
+    server = _Server(_APIError(429, {'retry-after': '2'}),
+                     _APIError(429, {'retry-after-ms': '1500', 'retry-after': '9'}),
+                     _APIError(503, {'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'}))
+    scheduler = _scheduler(server)
+    asyncio.run(scheduler.embed_many(['abc'], [1], 'model'))
+    # retry-after-ms wins over retry-after; an unparseable value falls back to the backoff
+    assert sleeps[0] == 2 and sleeps[1] == 1.5 and sleeps[2] <= 0.01
+
+
+def test_rate_limit_responses_drain_the_buckets(monkeypatch):
+    settings.retry_backoff_base_seconds = 0
+    now, delays = [0.0], []
+    real_sleep = asyncio.sleep
+
+    async def sleep(delay, *args, **kwargs):
+        # Simulated time: only sleeping moves the buckets' clock
+        delays.append(delay)
+        now[0] += delay
+        await real_sleep(0)
+
+    monkeypatch.setattr(embedding_scheduler.asyncio, 'sleep', sleep)
+    scheduler = _scheduler(_Server(_APIError(429)), tokens_per_minute=6_000_000, requests_per_minute=60_000)
+    for bucket in (scheduler.requests, scheduler.tokens):
+        bucket._clock, bucket._updated = (lambda: now[0]), 0.0
+    asyncio.run(scheduler.embed_many(['abc'], [1], 'model'))
+    # No backoff, then the retry waits 1ms for a request; the token bucket refills 100 meanwhile
+    assert delays == [0, pytest.approx(1 / 1000)]
+    assert scheduler.requests.level == pytest.approx(0) and scheduler.tokens.level == pytest.approx(99)
+
+
+def test_token_bucket_waits_for_refill_and_allows_oversized_requests():
+    now = [0.0]
+    bucket = TokenBucket(rate_per_minute=600, clock=lambda: now[0])
+    assert bucket.capacity == 10
+
+    async def run(amount):
+        task = asyncio.ensure_future(bucket.acquire(amount))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        waiting = not task.done()
+        now[0] += 10
+        await task
+        return waiting
+
+    assert asyncio.run(run(10)) is False
+    bucket.level, bucket._updated = 0, now[0]
+    assert asyncio.run(run(5)) is True
+    # Larger than the bucket: waits for a full bucket, then goes into debt
+    assert asyncio.run(run(25)) is True
+    assert bucket.level == -15
@@ -0,0 +1,119 @@
+"""
+IncrementalIngestor chunk planning and re-ingestion
+"""
+
+import asyncio
+
+import numpy as np
+
+from services.chunker import Chunk
+from services.embedding_store import EmbeddingStore
+from services.incremental_ingest import IncrementalIngestor, IngestManifest, chunk_hash
+from services.vector_service import VectorService
+
+
+def _chunks(*texts):
+    return [Chunk(text, 0, len(text), 0, 1) for text in texts]
+
+
+def _planner(tmp_path) -> IncrementalIngestor:
+    return IncrementalIngestor(None, None, None, manifest=IngestManifest(str(tmp_path / 'manifest.db')))
+
+
+def _record(ingestor, plan):
+    ingestor.manifest.record([(plan['id'], plan['digest'], None, list(zip(plan['hashes'], plan['vector_ids'])))])
+
+
+def test_plan_names_repeated_chunks_with_suffixes(tmp_path):
+    ingestor = _planner(tmp_path)
+    plan = ingestor._plan({}, 'doc', 'h1', False, '', _chunks('a', 'b', 'a', 'a'))
+
+    base = f"doc#{chunk_hash('a')[:16]}"
+    assert plan['new'] == [0, 1, 2, 3] and plan['kept'] == [] and plan['removed'] == []
+    assert plan['vector_ids'] == [base, f"doc#{chunk_hash('b')[:16]}", f"{base}.1", f"{base}.2"]
+
+
+def test_plan_reuses_unchanged_chunks_and_removes_the_rest(tmp_path):
+    ingestor = _planner(tmp_path)
+    first = ingestor._plan({}, 'doc', 'h1', False, '', _chunks('a', 'b', 'a', 'c'))
+    _record(ingestor, first)
+
+    # One copy of 'a' and 'c' go away, 'b' moves and 'd' is new
+    second = ingestor._plan({}, 'doc', 'h2', True, '', _chunks('b', 'a', 'd'))
+    assert second['kept'] == [0, 1] and second['new'] == [2]
+    assert second['vector_ids'][:2] == [first['vector_ids'][1], first['vector_ids'][0]]
+    assert sorted(second['removed']) == sorted([first['vector_ids'][2], first['vector_ids'][3]])
+    assert second['vector_ids'][2] == f"doc#{chunk_hash('d')[:16]}"
+
+
+def test_plan_does_not_reuse_an_id_still_held_by_a_kept_chunk(tmp_path):
+    ingestor = _planner(tmp_path)
+    first = ingestor._plan({}, 'doc', 'h1', False, '', _chunks('a', 'a'))
+    _record(ingestor, first)
+
+    # Keeps "doc#<a>" and "doc#<a>.1"; the third copy needs the next suffix
+    second = ingestor._plan({}, 'doc', 'h2', True, '', _chunks('a', 'a', 'a'))
+    assert second['kept'] == [0, 1] and second['new'] == [2] and second['removed'] == []
+    assert second['vector_ids'][2] == f"{first['vector_ids'][0]}.2"
+    assert len(set(second['vector_ids'])) == 3
+
+
+def test_plan_drops_a_suffixed_copy_when_a_repeat_goes_away(tmp_path):
+    ingestor = _planner(tmp_path)
+    first = ingestor._plan({}, 'doc', 'h1', False, '', _chunks('a', 'x', 'a'))
+    _record(ingestor, first)
+
+    second = ingestor._plan({}, 'doc', 'h2', True, '', _chunks('a'))
+    assert second['vector_ids'] == [first['vector_ids'][0]]
+    assert sorted(second['removed']) == sorted([first['vector_ids'][1], first['vector_ids'][2]])
+
+
+class _SplitProcessor:
+    """Cleans nothing and chunks on '|'"""
+
+    async def extract_text(self, document):
+        return document['content']
+
+    def clean_text(self, text):
+        return text
+
+    def chunk_tokens(self, text):
+        return _chunks(*text.split('|'))
+
+
+class _HashEmbedder:
+    def __init__(self):
+        self.embedded = []
+
+    async def embed_chunks(self, chunks):
+        self.embedded.extend(chunk.text for chunk in chunks)
+        return [np.random.default_rng(int(chunk_hash(chunk.text)[:8], 16)).standard_normal(8).astype(np.float32)
+                for chunk in chunks]
+
+
+def test_run_embeds_only_new_chunks_and_deletes_removed_ones(tmp_path):
+    embedder = _HashEmbedder()
+    vectors = VectorService('flat')
+    store = EmbeddingStore(str(tmp_path / 'store'), dimension=8)
+    ingestor = IncrementalIngestor(_SplitProcessor(), embedder, vectors,
+                                   manifest=IngestManifest(str(tmp_path / 'manifest.db')),
+                                   embedding_store=store)
+
+    first = asyncio.run(ingestor.run([{'id': 'doc', 'content': 'a|b|a'}, {'id': 'other', 'content': 'z'}]))
+    assert first['documents']['new'] == 2 and first['chunks']['added'] == 4
+    assert len(vectors) == len(store.live_rows()) == 4
+
+    embedder.embedded = []
+    second = asyncio.run(ingestor.run([{'id': 'doc', 'content': 'b|a|c'}, {'id': 'other', 'content': 'z'}],
+                                      delete_missing=True))
+    assert embedder.embedded == ['c']
+    assert second['documents'] == {'new': 0, 'changed': 1, 'unchanged': 1, 'deleted': 0, 'failed': 0}
+    assert second['chunks'] == {'added': 1, 'kept': 2, 'removed': 1}
+    ids = [vector_id for _, vector_id in ingestor.manifest.chunks('doc')]
+    assert sorted(vectors._labels) == sorted(ids + [vector_id for _, vector_id in ingestor.manifest.chunks('other')])
+    assert [vectors.get_documents([id])[0]['metadata']['chunk'] for id in ids] == [0, 1, 2]
+    assert len(store.live_rows()) == 4 and all(id in store for id in ids)
+
+    third = asyncio.run(ingestor.run([{'id': 'doc', 'content': 'b|a|c'}], delete_missing=True))
+    assert third['documents']['deleted'] == 1 and third['chunks']['removed'] == 1
+    assert len(vectors) == len(store.live_rows()) == 3
@@ -0,0 +1,82 @@
+"""
+IngestPipeline results and failure handling
+"""
+
+import asyncio
+
+import numpy as np
+
+from services.ingest_pipeline import IngestPipeline
+from services.lexical_index import BM25Index
+from services.vector_service import VectorService
+
+
+class _TextProcessor:
+    async def extract_text(self, document):
+        if document.get('content') is None:
+            raise ValueError("no content")
+        return document['content']
+
+    def clean_texts(self, texts):
+        return [' '.join(text.split()) for text in texts]
+
+    async def preprocess_batch_async(self, texts):
+        return [text.lower().split() for text in texts]
+
+
+class _Embedder:
+    async def generate_embeddings_batch(self, texts):
+        return np.stack([np.random.default_rng(len(text)).standard_normal(8).astype(np.float32)
+                         for text in texts])
+
+
+class _Analyzer:
+    async def analyze_batch_async(self, texts, return_exceptions=False):
+        return [{'words': len(text.split())} for text in texts]
+
+
+class _BrokenStore:
+    def append(self, ids, vectors):
+        raise OSError("disk full")
+
+
+def _pipeline(vectors, lexical_index=None, embedding_store=None) -> IngestPipeline:
+    return IngestPipeline(_TextProcessor(), _Embedder(), vectors, _Analyzer(), batch_size=2, max_concurrency=2,
+                          lexical_index=lexical_index, embedding_store=embedding_store)
+
+
+DOCUMENTS = [
+    {'id': 'a', 'content': "red  fox"},
+    {'id': 'b', 'content': None},
+    {'id': 'c', 'content': "blue whale", 'metadata': {'type': 'note'}},
+]
+
+
+def test_results_keep_input_order_and_per_document_failures():
+    vectors = VectorService('flat')
+    lexical = BM25Index()
+    results = asyncio.run(_pipeline(vectors, lexical).run(DOCUMENTS))
+
+    assert [result['document_id'] for result in (results[0], results[2])] == ['a', 'c']
+    assert isinstance(results[1], ValueError)
+    assert results[0]['content'] == "red fox" and results[0]['analysis'] == {'words': 2}
+    assert len(vectors) == 2 and len(lexical) == 2
+    assert vectors.get_documents([results[2]['id']])[0]['metadata']['type'] == 'note'
+    assert lexical.search(tokens=['whale'])[0][0] == results[2]['id']
+
+
+def test_secondary_index_failures_keep_stored_documents():
+    vectors = VectorService('flat')
+
+    class BrokenIndex(BM25Index):
+        def add_many(self, *args, **kwargs):
+            raise RuntimeError("index corrupted")
+
+    results = asyncio.run(_pipeline(vectors, BrokenIndex(), _BrokenStore()).run(DOCUMENTS))
+
+    stored = [result for result in results if isinstance(result, dict)]
+    assert [result['document_id'] for result in stored] == ['a', 'c']
+    assert len(vectors) == 2
+    assert all(vectors.get_documents([result['id']])[0] is not None for result in stored)
+    # Without the store's views the results keep the computed embeddings
+    assert all(result['embedding'].shape == (8,) for result in stored)
@@ -0,0 +1,152 @@
+"""
+BM25Index postings encoding, deletes and compaction
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+from services.lexical_index import BM25Index, _Postings, decode_varints, encode_varints
+
+CORPUS = {
+    'a': "the quick brown fox jumps over the lazy dog",
+    'b': "a quick brown dog outpaces a quick red fox",
+    'c': "lazy dogs sleep all day",
+    'd': "foxes and dogs are not friends",
+    'e': "the fox",
+}
+
+
+def _index(corpus=CORPUS) -> BM25Index:
+    index = BM25Index(analyzer=str.split, k1=1.2, b=0.75)
+    index.add_many(list(corpus), list(corpus.values()))
+    return index
+
+
+def _reference(corpus, query, k1=1.2, b=0.75):
+    """Textbook BM25 over a dict of id -> text"""
+    documents = {id: text.split() for id, text in corpus.items()}
+    average = sum(map(len, documents.values())) / len(documents)
+    scores = {}
+    for id, tokens in documents.items():
+        score = 0.0
+        for term in query.split():
+            df = sum(term in other for other in documents.values())
+            tf = tokens.count(term)
+            if tf:
+                idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+                score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokens) / average))
+        if score > 0:
+            scores[id] = score
+    return scores
+
+
+def _assert_matches(results, expected):
+    assert {id for id, _ in results} == set(expected)
+    for id, score in results:
+        assert score == pytest.approx(expected[id])
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+
+
+def _assert_same(results, expected):
+    assert [id for id, _ in results] == [id for id, _ in expected]
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected])
+
+
+def test_varints_round_trip_across_byte_boundaries():
+    values = [0, 1, 127, 128, 255, 16383, 16384, 2 ** 21 - 1, 2 ** 21, 2 ** 35 + 7]
+    data = encode_varints(values)
+    assert len(data) == 1 + 1 + 1 + 2 + 2 + 2 + 3 + 3 + 4 + 6
+    assert decode_varints(bytes(data)).tolist() == values
+    assert decode_varints(b'').tolist() == []
+
+
+def test_postings_store_gaps_and_frequencies():
+    postings = _Postings()
+    for doc, tf in [(0, 3), (5, 1), (300, 200), (301, 1)]:
+        postings.append(doc, tf)
+    # Gaps from -1: 1, 5, 295, 1; 295 and 200 take two bytes
+    assert len(postings.data) == 10
+    docs, tfs = postings.decode()
+    assert docs.tolist() == [0, 5, 300, 301] and tfs.tolist() == [3, 1, 200, 1]
+
+
+def test_scores_match_reference_bm25():
+    index = _index()
+    for query in ("quick fox", "lazy dog", "the", "friends foxes", "missing"):
+        _assert_matches(index.search(query, top_k=10), _reference(CORPUS, query))
+    assert [id for id, _ in index.search("quick fox", top_k=1)] == ['b']
+
+
+def test_deleted_documents_are_masked_and_leave_the_statistics():
+    index = _index()
+    assert index.delete(['b', 'missing']) == 1
+    assert len(index) == 4 and 'b' not in index
+    remaining = {id: text for id, text in CORPUS.items() if id != 'b'}
+    for query in ("quick fox", "lazy dog", "brown"):
+        _assert_matches(index.search(query, top_k=10), _reference(remaining, query))
+    assert index.term_statistics("quick fox")['df'] == {'quick': 1, 'fox': 2}
+
+
+def test_readding_an_id_replaces_it():
+    index = _index()
+    index.add('e', "a red fox")
+    index.add_many(['f', 'f'], ["first version", "second version"])
+    corpus = {**CORPUS, 'e': "a red fox", 'f': "second version"}
+    _assert_matches(index.search("red fox first second", top_k=10), _reference(corpus, "red fox first second"))
+
+
+def test_compact_keeps_results_and_shrinks_postings():
+    index = _index()
+    index.delete(['a', 'b'])
+    before = {query: index.search(query, top_k=10) for query in ("quick fox", "lazy dogs", "the fox")}
+    size = index.memory_bytes
+
+    index.compact()
+    assert index._deleted == 0 and len(index._doc_ids) == 3
+    assert 'quick' not in index._postings
+    for query, results in before.items():
+        _assert_same(index.search(query, top_k=10), results)
+    assert sum(len(postings.data) for postings in index._postings.values()) < size
+
+    # New documents go after the renumbered ones
+    index.add('g', "quick fox")
+    assert index._doc_numbers['g'] == 3
+    assert index.search("quick", top_k=10)[0][0] == 'g'
+
+
+def test_deletes_past_the_live_count_compact_automatically():
+    corpus = {f"doc{i}": f"term{i % 7} shared" for i in range(3000)}
+    index = _index(corpus)
+    index.delete([f"doc{i}" for i in range(2000)])
+    assert index._deleted == 0 and len(index._doc_ids) == 1000
+    remaining = {id: text for id, text in corpus.items() if int(id[3:]) >= 2000}
+    results = index.search("term3", top_k=1000)
+    assert {id for id, _ in results} == {id for id, text in remaining.items() if text.startswith('term3 ')}
+
+
+def test_filtered_search_walks_candidates_best_first():
+    index = _index()
+    seen = []
+
+    def allow(ids):
+        seen.append(list(ids))
+        return [id != 'b' for id in ids]
+
+    results = index.search("quick fox", top_k=2, allow=allow)
+    assert [id for id, _ in results] == [id for id, _ in index.search("quick fox", top_k=10) if id != 'b'][:2]
+    assert len(seen) == 1
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = _index()
+    index.delete(['c'])
+    index.save(str(tmp_path))
+    loaded = BM25Index.load(str(tmp_path), analyzer=str.split)
+    assert len(loaded) == 4 and 'c' not in loaded
+    for query in ("lazy dog", "quick fox"):
+        _assert_same(loaded.search(query, top_k=10), index.search(query, top_k=10))
+    loaded.add('h', "lazy lazy")
+    assert loaded.search("lazy", top_k=1)[0][0] == 'h'
+    assert np.array_equal(loaded._lengths[:5], [9, 9, 6, 2, 2])
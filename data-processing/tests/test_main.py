@@ -0,0 +1,33 @@
+"""
+AvinciDataProcessor process-wide metrics
+"""
+
+import asyncio
+import gc
+import weakref
+
+import main
+from benchmarks.suite import configure_offline
+from services.metrics import metrics
+
+
+def _gauge(name: str) -> float:
+    return metrics.snapshot()[name][0]['value']
+
+
+def test_gauges_sum_over_processors_without_keeping_them_alive(tmp_path):
+    configure_offline(str(tmp_path / 'a'), 4)
+    first = main.AvinciDataProcessor()
+    configure_offline(str(tmp_path / 'b'), 4)
+    second = main.AvinciDataProcessor()
+    baseline = _gauge('vector_documents')
+
+    asyncio.run(first.vector_service.store_documents(['a', 'b'], [[1, 0, 0, 0], [0, 1, 0, 0]]))
+    asyncio.run(second.vector_service.store_documents(['c'], [[0, 0, 1, 0]]))
+    assert _gauge('vector_documents') == baseline + 3
+
+    released = weakref.ref(first)
+    del first
+    gc.collect()
+    assert released() is None
+    assert _gauge('vector_documents') == baseline + 1
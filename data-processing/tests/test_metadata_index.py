@@ -0,0 +1,125 @@
+"""
+MetadataIndex filters and posting layouts
+"""
+
+import numpy as np
+import pytest
+
+from services.metadata_index import DENSE_RATIO, MetadataIndex, _Postings
+
+
+def _index() -> MetadataIndex:
+    index = MetadataIndex(keyword_fields='type,persona', range_fields='created_at')
+    index.add(range(6), [
+        {'type': 'pdf', 'persona': ['ana', 'bo'], 'created_at': '2024-01-01'},
+        {'type': 'pdf', 'persona': 'bo', 'created_at': '2024-01-15T12:00:00Z'},
+        {'type': 'doc', 'persona': 'cy', 'created_at': '2024-02-01T00:00:00+02:00'},
+        {'type': 'doc', 'created_at': None},
+        {'type': 'txt', 'persona': 'ana', 'created_at': '2024-03-01'},
+        {'persona': 'bo', 'created_at': 'not a date'},
+    ])
+    return index
+
+
+def _labels(index: MetadataIndex, filters) -> list:
+    return index.select(filters).labels().tolist()
+
+
+def test_keyword_operators():
+    index = _index()
+    assert _labels(index, {'type': 'pdf'}) == [0, 1]
+    assert _labels(index, {'type': {'$ne': 'pdf'}}) == [2, 3, 4, 5]
+    assert _labels(index, {'type': {'$in': ['doc', 'txt', 'missing']}}) == [2, 3, 4]
+    assert _labels(index, {'type': {'$nin': ['doc', 'pdf']}}) == [4, 5]
+    # List values match on any element
+    assert _labels(index, {'persona': 'ana'}) == [0, 4]
+    assert _labels(index, {'persona': {'$in': ['bo']}, 'type': 'pdf'}) == [0, 1]
+
+
+def test_or_and_nesting():
+    index = _index()
+    assert _labels(index, {'$or': [{'type': 'txt'}, {'persona': 'cy'}]}) == [2, 4]
+    assert _labels(index, {'$or': [{'type': 'pdf'}, {'type': 'doc'}], 'persona': {'$nin': ['bo']}}) == [2, 3]
+    assert _labels(index, {'$and': [{'$or': [{'persona': 'ana'}, {'persona': 'cy'}]},
+                                    {'type': {'$ne': 'txt'}}]}) == [0, 2]
+    assert _labels(index, {'$or': []}) == []
+
+
+def test_iso_date_ranges():
+    index = _index()
+    assert _labels(index, {'created_at': {'$gte': '2024-01-15T12:00:00+00:00'}}) == [1, 2, 4]
+    assert _labels(index, {'created_at': {'$gt': '2024-01-01', '$lt': '2024-02-01'}}) == [1, 2]
+    # 2024-02-01T00:00+02:00 is 2024-01-31T22:00Z
+    assert _labels(index, {'created_at': {'$lt': '2024-01-31T23:00:00Z'}}) == [0, 1, 2]
+    assert _labels(index, {'created_at': {'$eq': '2024-03-01T00:00:00'}}) == [4]
+    # Missing and unparseable values match no range test, not even $ne
+    assert _labels(index, {'created_at': {'$ne': '2000-01-01'}}) == [0, 1, 2, 4]
+
+
+def test_removed_documents_stop_matching():
+    index = _index()
+    index.remove([0, 4], [{'type': 'pdf', 'persona': ['ana', 'bo'], 'created_at': '2024-01-01'},
+                          {'type': 'txt', 'persona': 'ana', 'created_at': '2024-03-01'}])
+    assert _labels(index, {'persona': 'ana'}) == []
+    assert 'ana' not in index.values('persona') and 'txt' not in index.values('type')
+    assert _labels(index, {'created_at': {'$gte': '2024-01-01'}}) == [1, 2]
+    assert len(index) == 4
+
+
+def test_invalid_filters_raise():
+    index = _index()
+    with pytest.raises(ValueError):
+        index.select({'unindexed': 'x'})
+    with pytest.raises(ValueError):
+        index.select({'type': {'$gt': 'pdf'}})
+    with pytest.raises(ValueError):
+        index.select({'created_at': {'$gte': 'yesterday'}})
+    with pytest.raises(ValueError):
+        index.select({'$not': {'type': 'pdf'}})
+
+
+def _members(postings: _Postings, size: int) -> list:
+    return np.flatnonzero(postings.mask(size)).tolist()
+
+
+def test_postings_switch_to_a_bitmap_and_back():
+    size = 64 * DENSE_RATIO
+    postings = _Postings()
+    postings.add(np.arange(0, size, 2 * DENSE_RATIO, dtype=np.uint32))
+    assert postings.bits is None and postings.count == 32
+
+    # Twice the density crosses the threshold
+    postings.add(np.arange(DENSE_RATIO, size, 2 * DENSE_RATIO, dtype=np.uint32))
+    assert postings.bits is not None and postings.count == 64
+    assert _members(postings, size) == list(range(0, size, DENSE_RATIO))
+
+    # Adding present labels and labels past the bitmap's end
+    postings.add(np.array([0, size + 5], dtype=np.uint32))
+    assert postings.count == 65 and _members(postings, size + 8)[-1] == size + 5
+
+    # Down to half the density the bitmap is kept, below it labels go back to an array
+    dense = np.arange(0, size, DENSE_RATIO, dtype=np.uint32)
+    postings.remove(np.concatenate([dense[1::2], np.array([size + 5], dtype=np.uint32)]))
+    assert postings.bits is not None and postings.count == 32
+    assert _members(postings, size + 8) == dense[::2].tolist()
+
+    postings.remove(dense[2:3])
+    assert postings.bits is None and postings.count == 31
+    assert postings.labels.tolist() == [0] + dense[4::2].tolist()
+
+    postings.remove(postings.labels.copy())
+    assert postings.count == 0 and postings.labels.size == 0
+
+
+def test_bitmap_postings_in_an_index_filter_like_arrays():
+    index = MetadataIndex(keyword_fields='type', range_fields='')
+    labels = np.arange(1000)
+    index.add(labels, [{'type': 'even' if label % 2 == 0 else 'odd'} for label in labels])
+    assert index._keywords['type']['even'].bits is not None
+
+    odd = labels[labels % 2 == 1][:-10]
+    index.remove(odd, [{'type': 'odd'}] * len(odd))
+    assert index._keywords['type']['odd'].bits is None
+    odd_left = list(range(981, 1000, 2))
+    assert _labels(index, {'type': 'odd'}) == odd_left
+    assert _labels(index, {'type': {'$in': ['odd', 'even']}}) == sorted(list(range(0, 1000, 2)) + odd_left)
@@ -0,0 +1,57 @@
+"""
+QueryResultCache keys, prefix serving and invalidation
+"""
+
+import asyncio
+
+from services.query_cache import MemoryCacheBackend, QueryResultCache, exact_ranking
+
+
+def _results(n):
+    return [{'id': f"d{i}", 'score': 1.0 - i / 100} for i in range(n)]
+
+
+def test_exact_rankings_are_served_from_a_longer_prefix():
+    cache = QueryResultCache(MemoryCacheBackend(100), ttl_seconds=60)
+    cache.put('Hello  World', 10, _results(10), 'vector')
+    assert cache.get('hello world', 3, 'vector') == _results(3)
+    assert cache.get('hello world', 20, 'vector') is None
+    assert cache.stats()['prefix_hits'] == 1
+
+
+def test_short_result_lists_answer_any_top_k():
+    cache = QueryResultCache(MemoryCacheBackend(100), ttl_seconds=60)
+    cache.put('rare', 10, _results(4), 'lexical')
+    assert cache.get('rare', 50, 'lexical') == _results(4)
+
+
+def test_top_k_dependent_rankings_are_cached_per_top_k():
+    cache = QueryResultCache(MemoryCacheBackend(100), ttl_seconds=60)
+    cache.put('q', 10, _results(10), 'hybrid', prefix=False)
+    assert cache.get('q', 2, 'hybrid', prefix=False) is None
+    assert cache.get('q', 10, 'hybrid', prefix=False) == _results(10)
+    cache.put('q', 2, _results(2)[::-1], 'hybrid', prefix=False)
+    assert cache.get('q', 2, 'hybrid', prefix=False) == _results(2)[::-1]
+    assert cache.get('q', 10, 'hybrid', prefix=False) == _results(10)
+
+
+def test_exact_ranking():
+    assert exact_ranking('lexical', 'hnsw')
+    assert exact_ranking('vector', 'flat')
+    assert not exact_ranking('vector', 'ivf')
+    assert not exact_ranking('vector', 'hnsw')
+    assert not exact_ranking('hybrid', 'flat')
+
+
+def test_invalidate_hides_older_entries():
+    cache = QueryResultCache(MemoryCacheBackend(100), ttl_seconds=60)
+
+    async def run():
+        cached, generation = await cache.lookup('q', 5, 'vector')
+        assert cached is None
+        await cache.store('q', 5, _results(5), 'vector', generation=generation)
+        assert (await cache.lookup('q', 5, 'vector'))[0] == _results(5)
+        cache.invalidate()
+        return await cache.lookup('q', 5, 'vector')
+
+    assert asyncio.run(run()) == (None, 1)
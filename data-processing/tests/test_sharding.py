@@ -0,0 +1,67 @@
+"""
+ShardedProcessor against a single in-process AvinciDataProcessor
+"""
+
+import asyncio
+
+import pytest
+
+from benchmarks.sharded import MODES, by_content, label_documents, use_mock_embeddings
+from benchmarks.suite import configure_offline, make_chunks, make_documents, make_queries
+from services.sharding import ShardedProcessor, shard_of
+
+
+def _models_available() -> bool:
+    """Chunking needs tiktoken's cl100k_base and BM25 needs NLTK's punkt"""
+    try:
+        import nltk
+        import tiktoken
+        tiktoken.get_encoding("cl100k_base")
+        nltk.data.find('tokenizers/punkt')
+        return True
+    except Exception:
+        return False
+
+
+def test_shard_of_is_stable_and_in_range():
+    shards = [shard_of(f"doc{i}", 3) for i in range(300)]
+    assert shards == [shard_of(f"doc{i}", 3) for i in range(300)]
+    assert set(shards) == {0, 1, 2}
+
+
+@pytest.mark.skipif(not _models_available(), reason="tokenizer data is not installed")
+def test_two_shards_match_a_single_processor(tmp_path):
+    from main import AvinciDataProcessor
+
+    documents = make_documents(make_chunks(400))
+    filters = label_documents(documents)
+    queries = make_queries(10)
+
+    async def search_everything(processor):
+        return {(mode, bool(case_filters)): [await processor.search_documents(query, 5, mode=mode,
+                                                                             filters=case_filters)
+                                             for query in queries]
+                for mode in MODES for case_filters in (None, filters)}
+
+    async def run():
+        configure_offline(str(tmp_path / 'single'), 64)
+        single = AvinciDataProcessor()
+        use_mock_embeddings(single)
+        await single.process_documents(documents)
+        expected = await search_everything(single)
+
+        configure_offline(str(tmp_path / 'sharded'), 64)
+        async with ShardedProcessor(2, setup=use_mock_embeddings) as processor:
+            results = await processor.process_documents(documents)
+            counts = [shard['documents'] for shard in await processor.stats()]
+            found = await search_everything(processor)
+        return expected, results, counts, found
+
+    expected, results, counts, found = asyncio.run(run())
+    assert [result['document_id'] for result in results] == [document['id'] for document in documents]
+    assert sum(counts) == len(documents) and all(counts)
+    for case, want in expected.items():
+        assert any(want), case
+        assert [by_content(got) for got in found[case]] == [by_content(hits) for hits in want], case
+    for hits in found[('hybrid', True)]:
+        assert all(hit['metadata']['type'] == 'transcript' for hit in hits)
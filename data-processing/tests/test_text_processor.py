@@ -0,0 +1,62 @@
+"""
+TextProcessor cleaning
+"""
+
+import sys
+
+import pytest
+
+from services.text_processor import TextProcessor
+
+TEXTS = [
+    "Participant:  the EMI was ₹2,000 (approx.)!\n\nInterviewer: okay…",
+    "café naïve Ünïcode ² ½ 中文 ১২৩ under_score",
+    "tabs\tand\xa0no-break\u3000ideographic\u2028line\u2029para\x1cfile\x85next  spaces",
+    "emoji 😊 and <br> tags & @mentions #tags",
+    "e\u0301 combining and ZWJ\u200djoined",
+    "   ",
+    "",
+]
+
+
+@pytest.fixture(scope='module')
+def processor():
+    return TextProcessor()
+
+
+def test_clean_text_keeps_words_and_basic_punctuation(processor):
+    assert processor.clean_text(TEXTS[0]) == "Participant: the EMI was 2,000 (approx.)! Interviewer: okay"
+    assert processor.clean_text(None) == ""
+
+
+def test_clean_texts_matches_clean_text_on_a_list(processor):
+    expected = [processor.clean_text(text) for text in TEXTS]
+    assert processor.clean_texts(TEXTS) == expected
+    assert processor.clean_texts(iter(TEXTS)) == expected
+
+
+def test_clean_texts_handles_missing_and_non_string_values(processor):
+    assert processor.clean_texts(["a  b", None, float('nan')]) == ["a b", "", ""]
+    # Arrow cannot take ints as strings; the per-text path still cleans the rest
+    assert processor.clean_texts(["a  b", 3, None]) == ["a b", "", ""]
+
+
+def test_clean_texts_without_pyarrow(processor, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    assert processor.clean_texts(TEXTS) == [processor.clean_text(text) for text in TEXTS]
+
+
+def test_clean_texts_on_a_series_keeps_its_index(processor):
+    pd = pytest.importorskip("pandas")
+    series = pd.Series(TEXTS + [None], index=[f"d{i}" for i in range(len(TEXTS) + 1)], name='content')
+    cleaned = processor.clean_texts(series)
+    assert list(cleaned.index) == list(series.index) and cleaned.name == 'content'
+    assert cleaned.tolist() == [processor.clean_text(text) for text in TEXTS] + [""]
+
+
+def test_clean_texts_on_an_arrow_array(processor):
+    pa = pytest.importorskip("pyarrow")
+    cleaned = processor.clean_texts(pa.array(TEXTS + [None]))
+    assert cleaned.to_pylist() == [processor.clean_text(text) for text in TEXTS] + [""]
+    chunked = processor.clean_texts(pa.chunked_array([TEXTS[:3], TEXTS[3:]], type=pa.large_string()))
+    assert chunked.to_pylist() == [processor.clean_text(text) for text in TEXTS]
@@ -0,0 +1,107 @@
+"""
+VectorService persistence and HNSW tombstones
+"""
+
+import asyncio
+
+import numpy as np
+import pytest
+
+from config.settings import settings
+from services.vector_service import VectorService
+
+faiss = pytest.importorskip("faiss")
+
+
+def _vectors(count: int, dimension: int = 16, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, dimension)).astype(np.float32)
+
+
+def _store(service: VectorService, vectors: np.ndarray, start: int = 0):
+    ids = [f"doc{i}" for i in range(start, start + len(vectors))]
+    asyncio.run(service.store_documents([f"text {id}" for id in ids], vectors,
+                                        [{'n': i} for i in range(start, start + len(vectors))], ids))
+    return ids
+
+
+def _search_ids(service: VectorService, query, top_k: int = 5):
+    return [hit['id'] for hit in asyncio.run(service.search_similar(query, top_k))]
+
+
+def test_memory_mapped_ivf_load_becomes_writable(tmp_path):
+    settings.ivf_nlist = 4
+    settings.ivf_train_size = 64
+    service = VectorService('ivf')
+    vectors = _vectors(100)
+    _store(service, vectors)
+    assert service._ann.is_trained
+    service.save(str(tmp_path))
+
+    loaded = VectorService('ivf')
+    loaded.load(str(tmp_path))
+    assert loaded._mapped_path is not None
+    loaded.nprobe = 4
+    assert _search_ids(loaded, vectors[3])[0] == 'doc3'
+
+    _store(loaded, _vectors(10, seed=1), start=100)
+    assert asyncio.run(loaded.delete_documents(['doc3'])) == 1
+    assert loaded._mapped_path is None
+    assert len(loaded) == 109
+    assert _search_ids(loaded, _vectors(10, seed=1)[0])[0] == 'doc100'
+    assert 'doc3' not in _search_ids(loaded, vectors[3])
+
+    # The saved directory is untouched by writes to the loaded copy
+    reloaded = VectorService('ivf')
+    reloaded.load(str(tmp_path))
+    reloaded.nprobe = 4
+    assert len(reloaded) == 100
+    assert _search_ids(reloaded, vectors[3])[0] == 'doc3'
+
+
+def test_hnsw_search_skips_tombstones():
+    settings.hnsw_rebuild_fraction = 0.5
+    service = VectorService('hnsw')
+    vectors = _vectors(50)
+    _store(service, vectors)
+
+    asyncio.run(service.delete_documents(['doc0', 'doc1']))
+    assert service._tombstones and service._ann.ntotal == 50
+    for i in (0, 1):
+        hits = _search_ids(service, vectors[i], top_k=10)
+        assert len(hits) == 10
+        assert f"doc{i}" not in hits
+
+    # A replaced document keeps only its new vector
+    _store(service, vectors[2:3] * -1, start=2)
+    assert 'doc2' not in _search_ids(service, vectors[2], top_k=3)
+    assert _search_ids(service, -vectors[2])[0] == 'doc2'
+
+
+def test_hnsw_rebuilds_past_the_tombstone_fraction():
+    settings.hnsw_rebuild_fraction = 0.25
+    service = VectorService('hnsw')
+    vectors = _vectors(40)
+    _store(service, vectors)
+
+    asyncio.run(service.delete_documents([f"doc{i}" for i in range(10)]))
+    assert len(service._tombstones) == 10 and service._ann.ntotal == 40
+    asyncio.run(service.delete_documents(['doc10']))
+    assert not service._tombstones
+    assert service._ann.ntotal == len(service) == 29
+    assert _search_ids(service, vectors[20])[0] == 'doc20'
+
+
+def test_hnsw_save_drops_tombstones(tmp_path):
+    settings.hnsw_rebuild_fraction = 0.5
+    service = VectorService('hnsw')
+    vectors = _vectors(30)
+    _store(service, vectors)
+    asyncio.run(service.delete_documents(['doc5']))
+    service.save(str(tmp_path))
+    assert not service._tombstones
+
+    loaded = VectorService('hnsw')
+    loaded.load(str(tmp_path))
+    assert loaded._ann.ntotal == len(loaded) == 29
+    assert 'doc5' not in _search_ids(loaded, vectors[5], top_k=10)
+    assert _search_ids(loaded, vectors[6])[0] == 'doc6'